@@ -6,11 +6,19 @@ from dash import html
 import dash
 import dash_bootstrap_components as dbc
 
+from libs.metrics import register_metrics
+from libs.profiling import register_profiling
+from libs.export import register_export_routes
+from libs.serve import serve, default_workers
+from libs.scheduler import IngestScheduler
+from libs.finance import set_provider
+from libs.providers import PROVIDERS, build_provider
+from libs.config import PROFILE_ALL
+
 from dash.long_callback import DiskcacheLongCallbackManager
 
 ## Diskcache
-import diskcache
-cache = diskcache.Cache("./cache")
+from libs.cache import cache
 long_callback_manager = DiskcacheLongCallbackManager(cache)
 
 def main(args):
@@ -21,6 +29,7 @@ def main(args):
     )
     log = logging.getLogger()
     log.info("Start program")
+    set_provider(build_provider(args.provider, args.provider_path))
 
     app = dash.Dash(__name__,
                 external_stylesheets=[dbc.themes.BOOTSTRAP],
@@ -46,20 +55,42 @@ def main(args):
         dash.page_container
     ])
 
+    register_metrics(app)
+    register_profiling(app, enabled=args.profile or PROFILE_ALL)
+    register_export_routes(server, args.db_path)
+
+    # in production the workers start their own schedulers, see libs/serve.py
+    if args.scheduler and not args.production:
+        IngestScheduler(args.db_path).start()
+
     return  app, server
 
 
-if __name__ == '__main__':
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description="Stocks")
     parser.add_argument("--log-path", type=str, default="stocks.log", help="Path to log file")
     parser.add_argument("--db-path", type=str, default="stocks.db", help="Path to database file")
     parser.add_argument("--port", type=int, default=5000, help="Port ")
     parser.add_argument("--addr", type=str, default="127.0.0.1", help="Server address")
-    args = parser.parse_args()
+    parser.add_argument("--provider", type=str, default="yfinance", choices=PROVIDERS, help="Market data provider")
+    parser.add_argument("--provider-path", type=str, default="fixtures", help="Directory of the recorded provider responses")
+    parser.add_argument("--scheduler", action="store_true", help="Refresh the stocks after the B3 close in a background thread")
+    parser.add_argument("--production", action="store_true", help="Serve with gunicorn workers (waitress on Windows) instead of the debug server")
+    parser.add_argument("--workers", type=int, default=default_workers(), help="Number of gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="Threads per worker")
+    parser.add_argument("--profile", action="store_true", help="Profile a sample of the callbacks, see libs/profiling.py")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
 
     app, server = main(args)
-    app.run(
-        port=args.port,
-        host=args.addr,
-        debug=True
-    )
+    if args.production:
+        serve(server, args)
+    else:
+        app.run(
+            port=args.port,
+            host=args.addr,
+            debug=True
+        )
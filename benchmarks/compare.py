@@ -0,0 +1,39 @@
+# Description: Compare two result files written by benchmarks/run.py.
+#
+#   $ python -m benchmarks.compare base.json head.json --threshold 1.10
+import argparse
+import json
+import sys
+
+def load(path) -> tuple:
+    with open(path) as f:
+        report = json.load(f)
+    return report["meta"], {r["name"]: r for r in report["results"]}
+
+def main(args):
+    base_meta, base = load(args.base)
+    head_meta, head = load(args.head)
+    print(f"base {base_meta.get('commit')}  head {head_meta.get('commit')}")
+    print(f"{'case':<45}{'base p50 ms':>14}{'head p50 ms':>14}{'ratio':>9}")
+
+    regressions = []
+    for name in sorted(set(base) | set(head)):
+        if name not in base or name not in head:
+            print(f"{name:<45}{'only in ' + ('head' if name in head else 'base'):>37}")
+            continue
+        ratio = head[name][args.metric] / base[name][args.metric] if base[name][args.metric] else float("inf")
+        flag = " <-" if ratio > args.threshold else ""
+        print(f"{name:<45}{base[name][args.metric]*1000:>14.2f}{head[name][args.metric]*1000:>14.2f}{ratio:>9.2f}{flag}")
+        if ratio > args.threshold:
+            regressions.append(name)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare stocks benchmarks")
+    parser.add_argument("base", type=str, help="Results of the base commit")
+    parser.add_argument("head", type=str, help="Results of the new commit")
+    parser.add_argument("--metric", type=str, default="p50_s", help="Latency metric to compare")
+    parser.add_argument("--threshold", type=float, default=1.10, help="Ratio considered a regression")
+    sys.exit(main(parser.parse_args()))
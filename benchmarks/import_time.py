@@ -0,0 +1,78 @@
+# Description: Startup benchmark and guard for the lazy imports of the forecasting stack.
+# Every sample runs in a fresh interpreter. Exits with an error if starting the dashboard
+# imports any of the machine learning modules, which must only load on first forecast.
+#
+#   $ python -m benchmarks.import_time --iterations 5
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import subprocess
+import tempfile
+
+from benchmarks.run import summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("torch", "darts", "pytorch_lightning", "lightning", "sklearn", "sklearnex")
+
+TARGETS = {
+    "import.libs.stocks": "import libs.stocks",
+    "import.app": "import app\napp.main(app.parse_args(['--log-path', log_path]))",
+}
+
+SNIPPET = '''
+import argparse, json, sys, time
+log_path = {log_path!r}
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+try:
+    import resource
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+except ImportError:
+    max_rss = None
+print(json.dumps({{
+    "seconds": elapsed,
+    "max_rss_bytes": max_rss,
+    "heavy_modules": sorted(m for m in {heavy!r} if m in sys.modules),
+}}))
+'''
+
+def sample(code, log_path) -> dict:
+    snippet = SNIPPET.format(code=code, log_path=log_path, heavy=HEAVY_MODULES)
+    output = subprocess.check_output([sys.executable, "-c", snippet], cwd=ROOT, stderr=subprocess.DEVNULL)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+def bench_imports(iterations, log_path) -> list:
+    results = []
+    for name, code in TARGETS.items():
+        samples = [sample(code, log_path) for _ in range(iterations)]
+        result = summarize(name, [s["seconds"] for s in samples], iterations)
+        rss = [s["max_rss_bytes"] for s in samples if s["max_rss_bytes"] is not None]
+        result["max_rss_bytes"] = max(rss) if rss else None
+        result["heavy_modules"] = samples[-1]["heavy_modules"]
+        results.append(result)
+    return results
+
+def main(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        results = bench_imports(args.iterations, os.path.join(workdir, "stocks.log"))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"results": results}, f, indent=2)
+
+    failed = [r for r in results if r["heavy_modules"]]
+    for r in failed:
+        print(f"{r['name']} imported {', '.join(r['heavy_modules'])} at startup")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stocks import time")
+    parser.add_argument("--iterations", type=int, default=5, help="Fresh interpreters per target")
+    parser.add_argument("--output", type=str, default=None, help="Path to json results")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,358 @@
+# Description: Benchmark suite for the database, statistics, models, figures and page layouts.
+# Builds a synthetic database (no network access) and writes the results as json, so runs
+# from different commits can be compared with benchmarks/compare.py.
+#
+#   $ python -m benchmarks.run --tickers 50 --years 10 --output bench.json
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+import polars as pl
+
+from libs.db import DB
+from libs.synthetic import create_synthetic_db, synthetic_history
+
+try:
+    import resource
+except ImportError:
+    # Unix only, the peak resident set size is not reported on Windows
+    resource = None
+
+def max_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS and in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+def measure(name, fn, iterations, rows=None, setup=None, warmup=1) -> dict:
+    '''
+    Time fn() over a number of iterations. setup() runs before every call and is not timed.
+    Peak python memory is taken from one extra traced run, since tracemalloc slows down the timed runs.
+    '''
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        fn()
+
+    latencies = []
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return summarize(name, latencies, iterations, rows, peak)
+
+def summarize(name, latencies, iterations, rows=None, peak=None) -> dict:
+    latencies = np.array(latencies)
+    total = latencies.sum()
+    result = {
+        "name": name,
+        "iterations": iterations,
+        "rows": rows,
+        "mean_s": latencies.mean(),
+        "min_s": latencies.min(),
+        "max_s": latencies.max(),
+        "p50_s": np.percentile(latencies, 50),
+        "p95_s": np.percentile(latencies, 95),
+        "p99_s": np.percentile(latencies, 99),
+        "ops_per_s": iterations / total if total > 0 else None,
+        "rows_per_s": rows * iterations / total if rows and total > 0 else None,
+        "peak_python_bytes": peak,
+        "max_rss_bytes": max_rss_bytes(),
+    }
+    result = {k: float(v) if isinstance(v, np.floating) else v for k, v in result.items()}
+    print(f"{name:<45} p50 {result['p50_s']*1000:10.2f} ms   p95 {result['p95_s']*1000:10.2f} ms   peak {(peak or 0)/2**20:8.1f} MiB")
+    return result
+
+def bench_db(db_path, tickers, iterations) -> list:
+    results = []
+    db = DB(db_path)
+    min_date = (datetime.now() - timedelta(days=365*5)).strftime("%Y-%m-%d")
+    rows = len(db.get_stock(tickers[0], min_date))
+    state = {"i": 0}
+
+    def get_stock():
+        db.get_stock(tickers[state["i"] % len(tickers)], min_date)
+        state["i"] += 1
+    results.append(measure("db.get_stock", get_stock, iterations, rows=rows))
+
+    def universe_dividends():
+        db.get_corporate_events(None, "dividend", min_date)
+    results.append(measure("db.get_corporate_events", universe_dividends, iterations, rows=len(db.get_corporate_events(None, "dividend", min_date))))
+    db.close()
+
+    # insert a ticker history again into a copy of the database, so the stored rows are replaced
+    copy_path = f"{db_path}.insert"
+    history = synthetic_history(tickers[0], 5).with_columns(
+        pl.lit(tickers[0]).alias("Ticker"),
+        pl.col("Date").dt.strftime("%Y-%m-%d %H:%M:%S")
+    ).select(["Ticker", "Open", "Close", "High", "Low", "Adj Open", "Adj Close", "Adj High", "Adj Low", "Dividends", "Volume", "Stock Splits", "Date"]).rows()
+    copy = {}
+
+    def setup():
+        if "db" in copy:
+            copy["db"].close()
+        shutil.copyfile(db_path, copy_path)
+        copy["db"] = DB(copy_path)
+
+    def bulk_insert():
+        copy["db"].bulk_insert(history)
+    results.append(measure("db.bulk_insert+remove_duplicates", bulk_insert, iterations, rows=len(history), setup=setup))
+    copy["db"].close()
+    os.remove(copy_path)
+    return results
+
+def bench_stocks(db_path, tickers, iterations, output_path) -> list:
+    from libs.stocks import Stocks
+    results = []
+
+    def statistics_all_periods():
+        stocks = Stocks(DB(db_path), output_path)
+        for ticker in tickers:
+            stocks.get_statistics_all_periods(ticker)
+        stocks.db.close()
+    results.append(measure("stocks.get_statistics_all_periods", statistics_all_periods, iterations, rows=len(tickers)))
+
+    def monthly_portifolio_statistics():
+        stocks = Stocks(DB(db_path), output_path)
+        stocks.get_monthly_portifolio_statistics()
+        stocks.db.close()
+    results.append(measure("stocks.get_monthly_portifolio_statistics", monthly_portifolio_statistics, iterations))
+
+    def quarterly_breakdown():
+        stocks = Stocks(DB(db_path), output_path)
+        stocks.get_breakdown(tickers, "quarter")
+        stocks.db.close()
+    results.append(measure("stocks.get_breakdown", quarterly_breakdown, iterations, rows=len(tickers)))
+
+    def portifolio_risk():
+        # no benchmark ticker, it would be downloaded from the provider
+        stocks = Stocks(DB(db_path), output_path)
+        stocks.get_portifolio_risk(scenarios=100000, benchmark=None)
+        stocks.db.close()
+    results.append(measure("stocks.get_portifolio_risk", portifolio_risk, iterations, rows=100000))
+    return results
+
+def bench_ingest(workdir, tickers, iterations, output_path, n_tickers=10) -> list:
+    from libs.finance import set_provider
+    from libs.providers import SyntheticProvider
+    from libs.stocks import Stocks
+    from libs.ingest import IngestPipeline
+
+    set_provider(SyntheticProvider(years=10))
+    db_path = os.path.join(workdir, "ingest.db")
+    state = {}
+
+    def setup():
+        if "stocks" in state:
+            state["stocks"].db.close()
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        state["stocks"] = Stocks(DB(db_path), output_path)
+
+    def ingest():
+        for ticker in tickers[:n_tickers]:
+            state["stocks"].get_data_from_api(ticker, "max")
+    results = [measure("stocks.get_data_from_api", ingest, iterations, rows=min(n_tickers, len(tickers)), setup=setup)]
+
+    def pipeline():
+        jobs = [(ticker, "max", True) for ticker in tickers[:n_tickers]]
+        for _ in IngestPipeline(state["stocks"].db).run(jobs):
+            pass
+    results.append(measure("ingest.pipeline", pipeline, iterations, rows=min(n_tickers, len(tickers)), setup=setup))
+    state["stocks"].db.close()
+    return results
+
+def bench_linear_model(db_path, tickers, iterations, output_path, n_boot, n_days) -> list:
+    from libs.linear_model import LinearRegressionModel
+    db = DB(db_path)
+    data = db.get_stock(tickers[0], "1900-01-01")
+    db.close()
+
+    model = LinearRegressionModel("linear", os.path.join(output_path, "bench_linear.pkl"), n_days)
+    model.train(data)
+
+    def bootstrap():
+        model.predict(n_days, return_interval=True, n_boot=n_boot)
+    return [measure("linear_model.bootstrap", bootstrap, iterations, rows=n_boot * n_days)]
+
+def bench_inference(db_path, tickers, iterations, output_path, n_days) -> list:
+    '''
+    Latency of a batch forecast of every ticker with a small TCN, through darts and through the
+    TorchScript and ONNX exports, and the largest difference of the compiled predictions.
+    '''
+    try:
+        import torch  # noqa: F401
+    except ImportError as e:
+        print(f"Skip inference benchmark, torch models not available: {e}")
+        return []
+    from darts.models import TCNModel
+    from darts.dataprocessing.transformers import Scaler
+    from libs.price_prediction import StockForecast
+    from libs.inference import export_models, CompiledForecaster
+
+    db = DB(db_path)
+    forecast = StockForecast(output_path)
+    data = {ticker: db.get_stock(ticker, "1900-01-01") for ticker in tickers}
+    db.close()
+    series = {ticker: forecast.timeseries(df) for ticker, df in data.items()}
+    scaler = Scaler()
+    scaled = scaler.fit_transform(list(series.values()))
+
+    model = TCNModel(input_chunk_length=48, output_chunk_length=12, n_epochs=1, random_state=0,
+                     pl_trainer_kwargs={"accelerator": "cpu", "enable_progress_bar": False})
+    model.fit(scaled)
+    expected = np.stack([s.values()[:, 0] for s in scaler.inverse_transform(model.predict(n_days, series=scaled, verbose=False))])
+
+    def darts_predict():
+        scaler.inverse_transform(model.predict(n_days, series=scaler.transform(list(series.values())), verbose=False))
+    results = [measure("inference.darts", darts_predict, iterations, rows=len(tickers))]
+
+    prices = {ticker: s.values()[:, 0] for ticker, s in series.items()}
+    for fmt in ("torchscript", "onnx"):
+        path = os.path.join(output_path, f"compiled_{fmt}")
+        try:
+            export_models({"tcn": model}, path, n_days, fmt, scaled=True)
+            compiled = CompiledForecaster(path, threads=1)
+        except Exception as e:
+            print(f"Skip {fmt}: {e}")
+            continue
+
+        def compiled_predict():
+            compiled.predict(prices)
+        result = measure(f"inference.{fmt}", compiled_predict, iterations, rows=len(tickers))
+        predictions = compiled.predict(prices)
+        result["max_abs_error"] = float(np.abs(np.stack([predictions[t]["tcn"] for t in tickers]) - expected).max())
+        print(f"{'':<45} max abs error {result['max_abs_error']:.2e}")
+        results.append(result)
+    return results
+
+def bench_figures(db_path, tickers, iterations) -> list:
+    import plotly.graph_objects as go
+    import plotly.io as pio
+    from libs.figures import compact_figure
+
+    db = DB(db_path)
+    data = db.get_stock(tickers[0], "1900-01-01")
+    db.close()
+
+    figures = {
+        "candlestick": go.Figure(data=[go.Candlestick(x=data['Date'], open=data['Open'], high=data['High'], low=data['Low'], close=data['Close'])]),
+        "lines": go.Figure(data=[go.Scatter(x=data['Date'], y=data['Close'], mode='lines'), go.Scatter(x=data['Date'], y=data['Adj Close'], mode='lines')]),
+    }
+    results = []
+    for name, fig in figures.items():
+        # plain is the figure as Dash sent it before, compact the typed array payload
+        encodings = {
+            "plain": lambda fig=fig: pio.json.to_json_plotly(fig),
+            "compact": lambda fig=fig: pio.json.to_json_plotly(compact_figure(fig)),
+        }
+        for encoding, encode in encodings.items():
+            result = measure(f"figure.{name}.{encoding}", encode, iterations, rows=data.height)
+            result["payload_bytes"] = len(encode())
+            print(f"{'':<45} payload {result['payload_bytes']/1024:10.1f} KiB")
+            results.append(result)
+    return results
+
+def bench_layouts(db_path, iterations, log_path) -> list:
+    import dash
+    import app
+
+    app.main(app.parse_args(["--log-path", log_path]))
+    results = []
+    for page in dash.page_registry.values():
+        module = sys.modules[page["module"]]
+        if not callable(page["layout"]):
+            continue
+        module.DATABASE_PATH = db_path
+        results.append(measure(f"layout.{page['module']}", page["layout"], iterations))
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def main(args):
+    workdir = tempfile.mkdtemp(prefix="stocks-bench-")
+    db_path = os.path.join(workdir, "stocks.db")
+    output_path = os.path.join(workdir, "output")
+    os.mkdir(output_path)
+
+    start = time.perf_counter()
+    tickers = create_synthetic_db(db_path, args.tickers, args.years, args.portifolio, args.seed)
+    print(f"Synthetic database with {args.tickers} tickers x {args.years} years created in {time.perf_counter() - start:.1f}s")
+
+    cases = args.cases.split(",")
+    results = []
+    if "db" in cases:
+        results += bench_db(db_path, tickers, args.iterations)
+    if "stocks" in cases:
+        results += bench_stocks(db_path, tickers, args.iterations, output_path)
+    if "ingest" in cases:
+        results += bench_ingest(workdir, tickers, args.iterations, output_path)
+    if "model" in cases:
+        results += bench_linear_model(db_path, tickers, args.iterations, output_path, args.n_boot, args.n_days)
+    if "inference" in cases:
+        results += bench_inference(db_path, tickers, args.iterations, output_path, args.n_days)
+    if "figure" in cases:
+        results += bench_figures(db_path, tickers, args.iterations)
+    if "layout" in cases:
+        results += bench_layouts(db_path, args.iterations, os.path.join(workdir, "stocks.log"))
+    if "import" in cases:
+        from benchmarks.import_time import bench_imports
+        results += bench_imports(args.iterations, os.path.join(workdir, "import.log"))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "tickers": args.tickers,
+            "years": args.years,
+            "portifolio": args.portifolio,
+            "seed": args.seed,
+            "db_bytes": os.path.getsize(db_path),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Results written to {args.output}")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stocks benchmarks")
+    parser.add_argument("--tickers", type=int, default=50, help="Number of synthetic tickers")
+    parser.add_argument("--years", type=int, default=10, help="Years of daily history per ticker")
+    parser.add_argument("--portifolio", type=int, default=10, help="Number of tickers in the portifolio")
+    parser.add_argument("--iterations", type=int, default=10, help="Timed iterations per case")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--n-boot", type=int, default=250, help="Bootstrap resamples of the linear model")
+    parser.add_argument("--n-days", type=int, default=10, help="Days predicted by the linear model")
+    parser.add_argument("--cases", type=str, default="db,stocks,ingest,model,inference,figure,layout,import", help="Comma separated groups to run")
+    parser.add_argument("--output", type=str, default="bench.json", help="Path to json results")
+    main(parser.parse_args())
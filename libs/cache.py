@@ -0,0 +1,13 @@
+# Description: Disk cache shared by the background callbacks, the workers and the precomputed page data.
+import diskcache
+
+from libs.config import CACHE_PATH
+
+cache = diskcache.Cache(CACHE_PATH)
+
+def get_generation() -> int:
+    return cache.get("ingest_generation", 0)
+
+def bump_generation() -> int:
+    # incr is atomic across processes, every ingest or portifolio change invalidates the precomputed data
+    return cache.incr("ingest_generation", default=0)
@@ -0,0 +1,71 @@
+# Description: Ticker catalog backed by the tickers table.
+# The name, currency and sector of a ticker and whether the provider knows the symbol are read from the
+# provider at most once per TICKER_INFO_TTL_DAYS, the first and last stored dates are maintained by the
+# stock inserts (see DB.update_ticker_dates).
+import logging
+from datetime import datetime, timedelta
+
+from libs.config import TICKER_INFO_TTL_DAYS
+from libs.finance import get_provider
+from libs.providers import UnknownTickerError
+from libs.metrics import timed
+
+log = logging.getLogger()
+
+@timed("stocks_provider_call", call="info")
+def _fetch_info(ticker) -> dict:
+    return get_provider().info(ticker)
+
+class TickerCatalog():
+    def __init__(self, db, ttl=timedelta(days=TICKER_INFO_TTL_DAYS)):
+        self.db = db
+        self.ttl = ttl
+
+    def _expired(self, entry) -> bool:
+        return entry is None or entry["Validated At"] is None or datetime.now() - entry["Validated At"] > self.ttl
+
+    def validate(self, ticker) -> dict:
+        '''
+        Fetch the metadata of ticker from the provider and store it, a ticker unknown to the provider is
+        marked invalid until the ttl expires. Other errors of the provider (network, rate limit) are not
+        stored, the stored entry is returned and the provider is asked again by the next lookup.
+        Returns the catalog entry, None when the ticker was never validated.
+        '''
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            info = _fetch_info(ticker)
+            self.db.set_ticker_info(ticker, info.get("longName") or info.get("shortName"), info.get("currency"), info.get("sector"), "valid", now)
+        except UnknownTickerError as e:
+            log.error(f"Ticker was not found {ticker}, please check if value is correct")
+            log.error(f"ERROR MESSAGE: \n{e}")
+            self.db.set_ticker_info(ticker, None, None, None, "invalid", now)
+        except Exception as e:
+            log.warning(f"Can not validate {ticker} now, the provider failed: {e}")
+        return self.db.get_ticker_info(ticker)
+
+    def lookup(self, ticker) -> dict:
+        '''
+        Catalog entry of ticker, read from the provider when it is missing or older than the ttl.
+        '''
+        entry = self.db.get_ticker_info(ticker)
+        if self._expired(entry):
+            entry = self.validate(ticker)
+        return entry
+
+    def is_valid(self, ticker) -> bool:
+        entry = self.lookup(ticker)
+        return entry is not None and entry["Status"] == "valid"
+
+    def refresh(self, tickers=None) -> int:
+        '''
+        Validate again the stored tickers (or tickers) whose metadata is older than the ttl,
+        returns the number of provider lookups.
+        '''
+        catalog = self.db.get_catalog(stored_only=tickers is None)
+        if tickers is not None:
+            catalog = catalog.filter(catalog["Ticker"].is_in(tickers))
+        expired = [entry["Ticker"] for entry in catalog.iter_rows(named=True) if self._expired(entry)]
+        for ticker in expired:
+            self.validate(ticker)
+        log.info(f"Refreshed the catalog entry of {len(expired)} tickers")
+        return len(expired)
@@ -1 +1,26 @@
-DATABASE_PATH = "D:/stocks.db"
\ No newline at end of file
+DATABASE_PATH = "stocks.db"
+OUTPUT_PATH = "output"
+CACHE_PATH = "./cache"
+# intraday bars, one parquet file per interval, ticker and day
+INTRADAY_PATH = "intraday"
+# market index used as reference of the portifolio betas
+BENCHMARK_TICKER = "^BVSP"
+# days the ticker metadata read from the provider is trusted before it is fetched again
+TICKER_INFO_TTL_DAYS = 7
+# tickers kept in the in-memory window index of each process, a ticker with 10 years of history takes ~0.5 MiB
+WINDOW_INDEX_TICKERS = 256
+# seconds between the metrics snapshots each gunicorn worker publishes for /metrics, see libs/metrics.py
+METRICS_PUBLISH_SECONDS = 5
+# per-request profiles of the callbacks, see libs/profiling.py
+PROFILE_PATH = "profiles"
+# profile a sample of all the callbacks, otherwise only the requests asking for it
+PROFILE_ALL = False
+PROFILE_SAMPLE_RATE = 0.01
+# seconds between the stack samples of pyinstrument
+PROFILE_INTERVAL = 0.001
+# most recent profiles kept in PROFILE_PATH
+PROFILE_KEEP = 50
+# clients allowed to ask for a profile, and the value they must send when set
+PROFILE_ALLOWED = ("127.0.0.1", "::1")
+PROFILE_TOKEN = None
+PROFILE_COOKIE_SECONDS = 600
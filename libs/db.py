@@ -1,38 +1,435 @@
+import io
+import json
 import sqlite3
 import logging
 import polars as pl
-from datetime import datetime
+from polars.io.plugins import register_io_source
+from datetime import datetime, date, timedelta
+
+from libs.metrics import instrument_methods
 
 log = logging.getLogger()
 
+# tickers are stored as Categorical, a global string cache lets frames from different queries be concatenated
+pl.enable_string_cache()
+
+EPOCH = date(1970, 1, 1)
+
+# stock dates are stored as days since 1970-01-01, this converts the "%Y-%m-%d %H:%M:%S" text of the inserts
+EPOCH_DAY_SQL = "CAST(julianday(substr(?, 1, 10)) - 2440587.5 AS INTEGER)"
+
+# column name, sql expression and type of the stock readers, Ticker needs the join with tickers
+STOCK_FIELDS = {
+    "Ticker": ("t.symbol", pl.Utf8),
+    "Open": ("s.open_price", pl.Float64),
+    "Close": ("s.close_price", pl.Float64),
+    "High": ("s.high_price", pl.Float64),
+    "Low": ("s.low_price", pl.Float64),
+    "Adj Open": ("s.adj_open_price", pl.Float64),
+    "Adj Close": ("s.adj_close_price", pl.Float64),
+    "Adj High": ("s.adj_high_price", pl.Float64),
+    "Adj Low": ("s.adj_low_price", pl.Float64),
+    "Dividends": ("s.dividends", pl.Float64),
+    "Volume": ("s.volume", pl.Float64),
+    "Stock Splits": ("s.stock_splits", pl.Float64),
+    "Date": ("s.date", pl.Int32),
+}
+
+STOCK_COLUMNS = ", ".join(column for column, _ in STOCK_FIELDS.values())
+
+STOCK_SCHEMA = [(name, dtype) for name, (_, dtype) in STOCK_FIELDS.items()]
+
+INSERT_STOCK_SQL = f'''
+    INSERT OR REPLACE INTO stocks (ticker_id, open_price, close_price, high_price, low_price, adj_open_price, adj_close_price, adj_high_price, adj_low_price, dividends, volume, stock_splits, date)
+    VALUES ((SELECT id FROM tickers WHERE symbol = ?), ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {EPOCH_DAY_SQL})
+'''
+
+def to_epoch_day(value) -> int:
+    if isinstance(value, str):
+        value = datetime.strptime(value[:10], "%Y-%m-%d")
+    if isinstance(value, datetime):
+        value = value.date()
+    return (value - EPOCH).days
+
+def from_epoch_day(value) -> datetime:
+    return datetime(1970, 1, 1) + timedelta(days=value)
+
+def _stock_frame(rows, schema) -> pl.DataFrame:
+    df = pl.DataFrame(rows, schema=schema, orient="row")
+    casts = {"Ticker": pl.Categorical, "Date": pl.Date}
+    return df.cast({name: dtype for name, dtype in casts.items() if name in df.columns})
+
+# comparisons of the polars predicates scan_stocks translates to sql, and the same comparison with the sides swapped
+SQL_OPERATORS = {"Eq": "=", "Lt": "<", "LtEq": "<=", "Gt": ">", "GtEq": ">="}
+SWAPPED_OPERATORS = {"Eq": "Eq", "Lt": "Gt", "LtEq": "GtEq", "Gt": "Lt", "GtEq": "LtEq"}
+# a date against a time of the day, the sql keeps the day of the time and polars drops the rows outside
+DAY_OPERATORS = {"Eq": "=", "Lt": "<=", "LtEq": "<=", "Gt": ">=", "GtEq": ">="}
+
+def _constant(node) -> list:
+    '''
+    Values of a node of a serialized polars expression that reads no column, None otherwise.
+    '''
+    expr = pl.Expr.deserialize(io.StringIO(json.dumps(node)), format="json")
+    if expr.meta.root_names():
+        return None
+    values = pl.select(expr).to_series().to_list()
+    return None if None in values else values
+
+def _comparison_sql(column, op, node) -> tuple:
+    values = _constant(node)
+    if values is None or len(values) != 1:
+        return None
+    value = values[0]
+    if column == "Ticker" and op == "Eq" and isinstance(value, str):
+        return "s.ticker_id = (SELECT id FROM tickers WHERE symbol = ?)", [value], True
+    if column == "Date" and isinstance(value, datetime) and value.tzinfo is None:
+        if value.time() == datetime.min.time():
+            return f"s.date {SQL_OPERATORS[op]} ?", [to_epoch_day(value)], True
+        return f"s.date {DAY_OPERATORS[op]} ?", [to_epoch_day(value)], False
+    if column == "Date" and isinstance(value, date) and not isinstance(value, datetime):
+        return f"s.date {SQL_OPERATORS[op]} ?", [to_epoch_day(value)], True
+    return None
+
+def _predicate_sql(node) -> tuple:
+    '''
+    Conditions of the stocks table for the Ticker ==, Ticker.is_in and Date comparisons of the serialized
+    predicate node and its & operands, their parameters and whether they select exactly the predicate rows.
+    '''
+    if "BinaryExpr" in node:
+        left, op, right = node["BinaryExpr"]["left"], node["BinaryExpr"]["op"], node["BinaryExpr"]["right"]
+        if op in ("And", "LogicalAnd"):
+            left_where, left_params, left_exact = _predicate_sql(left)
+            right_where, right_params, right_exact = _predicate_sql(right)
+            return left_where + right_where, left_params + right_params, left_exact and right_exact
+        if op in SQL_OPERATORS:
+            if "Column" in right:
+                left, op, right = right, SWAPPED_OPERATORS[op], left
+            if "Column" in left:
+                condition = _comparison_sql(left["Column"], op, right)
+                if condition is not None:
+                    return [condition[0]], condition[1], condition[2]
+    elif "Function" in node and node["Function"]["function"] == {"Boolean": "IsIn"}:
+        column, values = node["Function"]["input"]
+        if column == {"Column": "Ticker"}:
+            values = _constant(values)
+            if values is not None and all(isinstance(value, str) for value in values):
+                return [f"s.ticker_id IN (SELECT id FROM tickers WHERE symbol IN ({', '.join('?' * len(values))}))"], values, True
+    return [], [], False
+
+def predicate_sql(predicate) -> tuple:
+    '''
+    SQL conditions, parameters and exactness of a polars predicate over the stocks frame, see _predicate_sql.
+    The predicates polars can not serialize, or in an unknown form, give no condition.
+    '''
+    try:
+        return _predicate_sql(json.loads(predicate.meta.serialize(format="json")))
+    except Exception as e:
+        log.debug(f"Predicate {predicate} not translated to sql: {e}")
+        return [], [], False
+
+# seconds a connection waits for the write lock held by another worker
+BUSY_TIMEOUT = 30
+
+def connect(filename) -> sqlite3.Connection:
+    '''
+    Connection in WAL mode, so readers in other workers do not block the writer and the other way around.
+    '''
+    conn = sqlite3.connect(filename, timeout=BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def _iter_rows(filename, sql, params=(), batch_size=100000):
+    conn = connect(filename)
+    try:
+        cursor = conn.execute(sql, params)
+        # the first batch is yielded even when empty, so the readers always get the schema
+        rows = cursor.fetchmany(batch_size)
+        yield rows
+        while len(rows) == batch_size:
+            rows = cursor.fetchmany(batch_size)
+            if rows:
+                yield rows
+    finally:
+        conn.close()
+
+def _migrate_compact_stocks(cursor):
+    '''
+    Version 1: tickers dictionary table, INTEGER epoch-day dates and a WITHOUT ROWID stocks table
+    clustered by (ticker_id, date), so each ticker history is stored contiguously.
+    '''
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'stocks'")
+    legacy = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tickers (
+            id INTEGER PRIMARY KEY,
+            symbol TEXT NOT NULL UNIQUE
+        )
+    ''')
+    if legacy:
+        cursor.execute("DROP INDEX IF EXISTS stocks_ticker_date")
+        cursor.execute("ALTER TABLE stocks RENAME TO stocks_legacy")
+    cursor.execute('''
+        CREATE TABLE stocks (
+            ticker_id INTEGER NOT NULL REFERENCES tickers (id),
+            date INTEGER NOT NULL,
+            open_price REAL NOT NULL,
+            close_price REAL NOT NULL,
+            high_price REAL NOT NULL,
+            low_price REAL NOT NULL,
+            adj_open_price REAL NOT NULL,
+            adj_close_price REAL NOT NULL,
+            adj_high_price REAL NOT NULL,
+            adj_low_price REAL NOT NULL,
+            dividends REAL NOT NULL,
+            volume REAL NOT NULL,
+            stock_splits REAL NOT NULL,
+            PRIMARY KEY (ticker_id, date)
+        ) WITHOUT ROWID
+    ''')
+    if legacy:
+        cursor.execute("INSERT OR IGNORE INTO tickers (symbol) SELECT DISTINCT ticker FROM stocks_legacy")
+        # rows are replayed in id order, so the last inserted duplicate wins like remove_duplicates did
+        cursor.execute('''
+            INSERT OR REPLACE INTO stocks
+            SELECT t.id, CAST(julianday(substr(l.date, 1, 10)) - 2440587.5 AS INTEGER),
+                   l.open_price, l.close_price, l.high_price, l.low_price, l.adj_open_price, l.adj_close_price,
+                   l.adj_high_price, l.adj_low_price, l.dividends, l.volume, l.stock_splits
+            FROM stocks_legacy l JOIN tickers t ON t.symbol = l.ticker
+            ORDER BY l.id
+        ''')
+        cursor.execute("DROP TABLE stocks_legacy")
+    return legacy
+
+# rollup granularities and the sql expression of the bucket (first day, epoch-day) of a stocks date,
+# weeks start on monday, 1970-01-01 was a thursday
+ROLLUP_BUCKETS = {
+    "1w": "s.date - ((s.date + 3) % 7)",
+    "1mo": "CAST(julianday(s.date * 86400, 'unixepoch', 'start of month') - 2440587.5 AS INTEGER)",
+    "1y": "CAST(julianday(s.date * 86400, 'unixepoch', 'start of year') - 2440587.5 AS INTEGER)",
+}
+
+# column name, sql column and type of the rollup readers, Date is the first day of the bucket
+ROLLUP_FIELDS = {
+    "Ticker": ("t.symbol", pl.Utf8),
+    "Date": ("r.bucket", pl.Int32),
+    "First Date": ("r.first_date", pl.Int32),
+    "Last Date": ("r.last_date", pl.Int32),
+    "Days": ("r.days", pl.Int64),
+    "Open": ("r.open_price", pl.Float64),
+    "First Close": ("r.first_close_price", pl.Float64),
+    "Close": ("r.close_price", pl.Float64),
+    "High": ("r.high_price", pl.Float64),
+    "Low": ("r.low_price", pl.Float64),
+    "Adj Open": ("r.adj_open_price", pl.Float64),
+    "Adj Close": ("r.adj_close_price", pl.Float64),
+    "Adj High": ("r.adj_high_price", pl.Float64),
+    "Adj Low": ("r.adj_low_price", pl.Float64),
+    "Close Sum": ("r.close_sum", pl.Float64),
+    "Dividends": ("r.dividends", pl.Float64),
+    "Volume": ("r.volume", pl.Float64),
+}
+
+def bucket_start(day, granularity) -> date:
+    '''
+    First day of the rollup bucket of day.
+    '''
+    if isinstance(day, datetime):
+        day = day.date()
+    if granularity == "1w":
+        return day - timedelta(days=day.weekday())
+    if granularity == "1mo":
+        return day.replace(day=1)
+    return day.replace(month=1, day=1)
+
+def next_bucket_start(day, granularity) -> date:
+    start = bucket_start(day, granularity)
+    if granularity == "1w":
+        return start + timedelta(days=7)
+    if granularity == "1mo":
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return start.replace(year=start.year + 1)
+
+def _rollup_select(granularity, where) -> str:
+    # aggregates of the buckets plus the first and last bar, read by primary key, as stock_rollups rows
+    return f'''
+        SELECT g.ticker_id AS ticker_id, '{granularity}' AS granularity, g.bucket AS bucket, g.first_date AS first_date,
+               g.last_date AS last_date, g.days AS days, f.open_price AS open_price, f.close_price AS first_close_price,
+               l.close_price AS close_price, g.high_price AS high_price, g.low_price AS low_price,
+               f.adj_open_price AS adj_open_price, l.adj_close_price AS adj_close_price, g.adj_high_price AS adj_high_price,
+               g.adj_low_price AS adj_low_price, g.close_sum AS close_sum, g.dividends AS dividends, g.volume AS volume
+        FROM (
+            SELECT s.ticker_id, {ROLLUP_BUCKETS[granularity]} AS bucket, MIN(s.date) AS first_date, MAX(s.date) AS last_date,
+                   COUNT(*) AS days, MAX(s.high_price) AS high_price, MIN(s.low_price) AS low_price,
+                   MAX(s.adj_high_price) AS adj_high_price, MIN(s.adj_low_price) AS adj_low_price,
+                   SUM(s.close_price) AS close_sum, SUM(s.dividends) AS dividends, SUM(s.volume) AS volume
+            FROM stocks s {where}
+            GROUP BY s.ticker_id, bucket
+        ) g
+        JOIN stocks f ON f.ticker_id = g.ticker_id AND f.date = g.first_date
+        JOIN stocks l ON l.ticker_id = g.ticker_id AND l.date = g.last_date
+    '''
+
+def _rollup_sql(granularity, where) -> str:
+    return f"INSERT OR REPLACE INTO stock_rollups {_rollup_select(granularity, where)}"
+
+def _migrate_rollups(cursor):
+    '''
+    Version 2: weekly, monthly and yearly OHLC, volume and dividend rollups per ticker, kept up to date
+    by the stock inserts.
+    '''
+    cursor.execute('''
+        CREATE TABLE stock_rollups (
+            ticker_id INTEGER NOT NULL REFERENCES tickers (id),
+            granularity TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            first_date INTEGER NOT NULL,
+            last_date INTEGER NOT NULL,
+            days INTEGER NOT NULL,
+            open_price REAL NOT NULL,
+            first_close_price REAL NOT NULL,
+            close_price REAL NOT NULL,
+            high_price REAL NOT NULL,
+            low_price REAL NOT NULL,
+            adj_open_price REAL NOT NULL,
+            adj_close_price REAL NOT NULL,
+            adj_high_price REAL NOT NULL,
+            adj_low_price REAL NOT NULL,
+            close_sum REAL NOT NULL,
+            dividends REAL NOT NULL,
+            volume REAL NOT NULL,
+            PRIMARY KEY (ticker_id, granularity, bucket)
+        ) WITHOUT ROWID
+    ''')
+    for granularity in ROLLUP_BUCKETS:
+        cursor.execute(_rollup_sql(granularity, ""))
+    return False
+
+def _migrate_ticker_catalog(cursor):
+    '''
+    Version 3: name, currency, sector, first and last stored date and validation status of the tickers,
+    so the ticker lists do not scan the stocks table and the symbol checks do not call the provider.
+    '''
+    for column in ["name TEXT", "currency TEXT", "sector TEXT", "first_date INTEGER", "last_date INTEGER",
+                   "status TEXT NOT NULL DEFAULT 'unknown'", "validated_at TEXT"]:
+        cursor.execute(f"ALTER TABLE tickers ADD COLUMN {column}")
+    # the stored tickers were found by the provider, their metadata is fetched once the ttl expires
+    cursor.execute('''
+        UPDATE tickers SET (first_date, last_date, status) = (
+            SELECT MIN(date), MAX(date), 'valid' FROM stocks WHERE ticker_id = tickers.id
+        ) WHERE EXISTS (SELECT 1 FROM stocks WHERE ticker_id = tickers.id)
+    ''')
+    return False
+
+def _migrate_coverage(cursor):
+    '''
+    Version 4: history coverage of the tickers, the first day requested from the provider (covered_from)
+    and whether the whole history was downloaded, so the reads do not query the stored dates and the
+    download info first. The duplicated download info rows are removed.
+    '''
+    for column in ["covered_from INTEGER", "full_history INTEGER NOT NULL DEFAULT 0"]:
+        cursor.execute(f"ALTER TABLE tickers ADD COLUMN {column}")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_download (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticker TEXT NOT NULL,
+            download_date TEXT NOT NULL,
+            last_update TEXT NOT NULL,
+            download_all_period TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        UPDATE tickers SET covered_from = first_date, full_history = EXISTS (
+            SELECT 1 FROM stock_download WHERE ticker = tickers.symbol AND download_all_period = 'YES'
+        )
+    ''')
+    cursor.execute('''
+        DELETE FROM stock_download WHERE id NOT IN (SELECT MAX(id) FROM stock_download GROUP BY ticker)
+    ''')
+    cursor.execute("CREATE UNIQUE INDEX stock_download_ticker ON stock_download (ticker)")
+    return False
+
+# corporate event types and the stocks column of their amount, a row with a non-zero amount is an event
+EVENT_COLUMNS = {
+    "dividend": "dividends",
+    "split": "stock_splits",
+}
+
+def _events_sql(where) -> str:
+    return " UNION ALL ".join(f'''
+        SELECT s.ticker_id, s.date, '{event_type}', s.{column} FROM stocks s {where} {"AND" if where else "WHERE"} s.{column} != 0
+    ''' for event_type, column in EVENT_COLUMNS.items())
+
+def _migrate_corporate_events(cursor):
+    '''
+    Version 5: sparse table of the dividends and splits, the non-zero Dividends and Stock Splits of the
+    stocks rows, so the dividend sums do not scan the daily history.
+    '''
+    cursor.execute('''
+        CREATE TABLE corporate_events (
+            ticker_id INTEGER NOT NULL REFERENCES tickers (id),
+            date INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            PRIMARY KEY (ticker_id, date, type)
+        ) WITHOUT ROWID
+    ''')
+    # events of every ticker in a date range, for the universe wide dividend queries
+    cursor.execute("CREATE INDEX corporate_events_type_date ON corporate_events (type, date)")
+    cursor.execute(f"INSERT INTO corporate_events {_events_sql('')}")
+    return False
+
+def _migrate_ticker_revision(cursor):
+    '''
+    Version 6: revision of the ticker history, incremented by every insert, and the first date changed by
+    the last insert, so the in-memory window indexes are extended instead of built again.
+    '''
+    for column in ["revision INTEGER NOT NULL DEFAULT 0", "changed_from INTEGER"]:
+        cursor.execute(f"ALTER TABLE tickers ADD COLUMN {column}")
+    return False
+
+# schema migrations, the database PRAGMA user_version holds the number of applied migrations
+MIGRATIONS = [
+    _migrate_compact_stocks,
+    _migrate_rollups,
+    _migrate_ticker_catalog,
+    _migrate_coverage,
+    _migrate_corporate_events,
+    _migrate_ticker_revision,
+]
+
+# coverage of the tickers read by each process, {(database, ticker): entry}, see DB.get_coverage
+_coverage = {}
+
+CATALOG_FIELDS = {
+    "Ticker": ("symbol", pl.Utf8),
+    "Name": ("name", pl.Utf8),
+    "Currency": ("currency", pl.Utf8),
+    "Sector": ("sector", pl.Utf8),
+    "First Date": ("first_date", pl.Int32),
+    "Last Date": ("last_date", pl.Int32),
+    "Status": ("status", pl.Utf8),
+    "Validated At": ("validated_at", pl.Utf8),
+}
+
+CATALOG_COLUMNS = ", ".join(column for column, _ in CATALOG_FIELDS.values())
+
+def _catalog_frame(rows) -> pl.DataFrame:
+    df = pl.DataFrame(rows, schema=[(name, dtype) for name, (_, dtype) in CATALOG_FIELDS.items()], orient="row")
+    return df.cast({"First Date": pl.Date, "Last Date": pl.Date}).with_columns(
+        pl.col("Validated At").str.to_datetime("%Y-%m-%d %H:%M:%S")
+    )
+
+@instrument_methods("stocks_db_query", "statement", exclude=("sort_by_date", "close", "iter_stocks", "iter_portifolio", "iter_forecast"))
 class DB():
     def __init__(self, filename):
         self.filename = filename
-        self.conn = sqlite3.connect(self.filename)
+        self.conn = connect(self.filename)
         self.cursor = self.conn.cursor()
         log.info(f"Initialize database to file: {self.filename}")
 
     def create_tables(self):
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS stocks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ticker TEXT NOT NULL,
-                open_price REAL NOT NULL,
-                close_price REAL NOT NULL,
-                high_price REAL NOT NULL,
-                low_price REAL NOT NULL,
-                adj_open_price REAL NOT NULL,
-                adj_close_price REAL NOT NULL,
-                adj_high_price REAL NOT NULL,
-                adj_low_price REAL NOT NULL,
-                dividends REAL NOT NULL,
-                volume REAL NOT NULL,
-                stock_splits REAL NOT NULL,
-                date TEXT NOT NULL
-            )
-        ''')
-        self.conn.commit()
-        log.info("Created table stocks")
+        self.migrate()
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS portifolio (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -65,74 +462,362 @@ class DB():
         ''')
         self.conn.commit()
         log.info("Created table forecast")
-
-    def insert_stock(self, ticker, open_price, close_price, high_price, low_price, dividend, date):
         self.cursor.execute('''
-            INSERT INTO stocks (ticker, open_price, close_price, high_price, low_price, adj_open_price, adj_close_price, adj_high_price, adj_low_price, dividends, volume, stock_splits, date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (ticker, open_price, close_price, high_price, low_price, dividend, date))
+            CREATE TABLE IF NOT EXISTS ingest_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                trading_date TEXT NOT NULL,
+                started_at TEXT NOT NULL,
+                finished_at TEXT,
+                status TEXT NOT NULL,
+                tickers INTEGER,
+                message TEXT
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS ingest_runs_trading_date ON ingest_runs (trading_date)
+        ''')
+        self.conn.commit()
+        log.info("Created table ingest_runs")
+
+    def migrate(self):
+        self.conn.commit()
+        version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+        vacuum = False
+        for i, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            self.cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # another worker may have migrated while this one waited for the lock
+                if self.cursor.execute("PRAGMA user_version").fetchone()[0] >= i:
+                    self.conn.commit()
+                    continue
+                vacuum = migration(self.cursor) or vacuum
+                self.cursor.execute(f"PRAGMA user_version = {i}")
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            log.info(f"Migrated database {self.filename} to version {i}")
+        if vacuum:
+            self.cursor.execute("VACUUM")
+            log.info(f"Vacuumed database {self.filename}")
+
+    def insert_tickers(self, tickers):
+        self.cursor.executemany('''
+            INSERT OR IGNORE INTO tickers (symbol) VALUES (?)
+        ''', [(ticker,) for ticker in set(tickers)])
+
+    def insert_stock(self, ticker, open_price, close_price, high_price, low_price, adj_open_price, adj_close_price,
+                     adj_high_price, adj_low_price, dividend, volume, stock_splits, date):
+        self.insert_tickers([ticker])
+        self.cursor.execute(INSERT_STOCK_SQL, (ticker, open_price, close_price, high_price, low_price, adj_open_price, adj_close_price,
+                                               adj_high_price, adj_low_price, dividend, volume, stock_splits, date))
+        self._after_insert([(ticker, date)])
         self.conn.commit()
         log.info(f"Inserted stock {ticker} into database")
 
     def bulk_insert(self, data):
-        self.cursor.executemany('''
-            INSERT INTO stocks (ticker, open_price, close_price, high_price, low_price, adj_open_price, adj_close_price, adj_high_price, adj_low_price, dividends, volume, stock_splits, date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', data)
+        # (ticker_id, date) is the primary key, so a new row replaces the stored one of the same day
+        self.insert_tickers(row[0] for row in data)
+        self.cursor.executemany(INSERT_STOCK_SQL, data)
+        self._after_insert(data)
         self.conn.commit()
         log.info(f"Inserted {len(data)} stocks into database")
 
-        self.remove_duplicates()
+    def bulk_write(self, data, download_info, coverage=None):
+        '''
+        Insert the rows of many tickers and update their download info in a single transaction.
+        download_info holds (ticker, download_date, last_update, download_all_period), coverage the
+        (ticker, first requested day) of the downloads.
+        '''
+        try:
+            self.insert_tickers(info[0] for info in download_info)
+            self.cursor.executemany(INSERT_STOCK_SQL, data)
+            self._after_insert(data)
+            self._update_coverage(coverage or [], [info[0] for info in download_info if info[3] == "YES"])
+            self.cursor.executemany('''
+                UPDATE stock_download SET download_date = ?, last_update = ?, download_all_period = ?
+                WHERE ticker = ?
+            ''', [(info[1], info[2], info[3], info[0]) for info in download_info])
+            self.cursor.executemany('''
+                INSERT INTO stock_download (ticker, download_date, last_update, download_all_period)
+                SELECT ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM stock_download WHERE ticker = ?)
+            ''', [(*info, info[0]) for info in download_info])
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        log.info(f"Inserted {len(data)} rows of {len(download_info)} stocks into database")
 
-    def get_stock(self, ticker, min_date):
+    def _after_insert(self, data):
+        '''
+        Maintain the rollups and the ticker catalog for the stock rows of data (ticker first, date last),
+        in the transaction of the insert.
+        '''
+        ranges = {}
+        for row in data:
+            # "%Y-%m-%d ..." dates sort as text
+            ticker, day = row[0], str(row[-1])[:10]
+            first, last = ranges.get(ticker, (day, day))
+            ranges[ticker] = (min(first, day), max(last, day))
+        ranges = {ticker: (datetime.strptime(first, "%Y-%m-%d"), datetime.strptime(last, "%Y-%m-%d")) for ticker, (first, last) in ranges.items()}
+        self.refresh_rollups(ranges)
+        self.refresh_events(ranges)
+        self.update_ticker_dates(ranges)
+        self._invalidate_coverage(ranges)
+
+    def refresh_rollups(self, ranges):
+        '''
+        Recompute the rollup buckets touched by new rows, ranges maps each ticker to the (first, last)
+        new date. Only the buckets between the first and last date are aggregated again.
+        '''
+        for granularity in ROLLUP_BUCKETS:
+            params = [
+                (ticker, to_epoch_day(bucket_start(first, granularity)), to_epoch_day(next_bucket_start(last, granularity)))
+                for ticker, (first, last) in ranges.items()
+            ]
+            self.cursor.executemany(_rollup_sql(granularity, '''
+                WHERE s.ticker_id = (SELECT id FROM tickers WHERE symbol = ?) AND s.date >= ? AND s.date < ?
+            '''), params)
+
+    def refresh_events(self, ranges):
+        '''
+        Extract again the corporate events of the stocks rows between the first and last new date of each ticker.
+        '''
+        params = [(ticker, to_epoch_day(first), to_epoch_day(last)) for ticker, (first, last) in ranges.items()]
+        self.cursor.executemany('''
+            DELETE FROM corporate_events WHERE ticker_id = (SELECT id FROM tickers WHERE symbol = ?1) AND date >= ?2 AND date <= ?3
+        ''', params)
+        self.cursor.executemany(f'''
+            INSERT INTO corporate_events {_events_sql("WHERE s.ticker_id = (SELECT id FROM tickers WHERE symbol = ?1) AND s.date >= ?2 AND s.date <= ?3")}
+        ''', params)
+
+    def get_corporate_events(self, tickers=None, event_type=None, min_date=None, max_date=None) -> pl.DataFrame:
+        '''
+        Corporate events (Ticker, Date, Type, Amount) of tickers (all when None) of event_type ("dividend",
+        "split" or both when None) between min_date and max_date (max_date excluded), ordered by ticker and date.
+        '''
+        where, params = [], []
+        if tickers is not None:
+            if isinstance(tickers, str):
+                tickers = [tickers]
+            where.append(f"e.ticker_id IN (SELECT id FROM tickers WHERE symbol IN ({', '.join('?' * len(tickers))}))")
+            params.extend(tickers)
+        if event_type is not None:
+            # with tickers the primary key range is narrower than the (type, date) index, + keeps the planner off it
+            where.append("+e.type = ?" if tickers is not None else "e.type = ?")
+            params.append(event_type)
+        if min_date is not None:
+            where.append("e.date >= ?")
+            params.append(to_epoch_day(min_date))
+        if max_date is not None:
+            where.append("e.date < ?")
+            params.append(to_epoch_day(max_date))
+        self.cursor.execute(f'''
+            SELECT t.symbol, e.date, e.type, e.amount FROM corporate_events e JOIN tickers t ON t.id = e.ticker_id
+            {f"WHERE {' AND '.join(where)}" if where else ""}
+            ORDER BY t.symbol, e.date
+        ''', params)
+        return _stock_frame(self.cursor.fetchall(), [("Ticker", pl.Utf8), ("Date", pl.Int32), ("Type", pl.Utf8), ("Amount", pl.Float64)])
+
+    def update_ticker_dates(self, ranges):
+        # a ticker with stored bars was found by the provider
+        self.cursor.executemany('''
+            UPDATE tickers SET first_date = MIN(COALESCE(first_date, ?1), ?1), last_date = MAX(COALESCE(last_date, ?2), ?2),
+                               status = CASE WHEN status = 'unknown' THEN 'valid' ELSE status END,
+                               revision = revision + 1, changed_from = ?1
+            WHERE symbol = ?3
+        ''', [(to_epoch_day(first), to_epoch_day(last), ticker) for ticker, (first, last) in ranges.items()])
+
+    def _update_coverage(self, coverage, full_history=()):
+        self.cursor.executemany('''
+            UPDATE tickers SET covered_from = MIN(COALESCE(covered_from, ?1), ?1) WHERE symbol = ?2
+        ''', [(to_epoch_day(start), ticker) for ticker, start in coverage])
+        self.cursor.executemany('''
+            UPDATE tickers SET full_history = 1 WHERE symbol = ?
+        ''', [(ticker,) for ticker in full_history])
+        self._invalidate_coverage([ticker for ticker, _ in coverage] + list(full_history))
+
+    def _invalidate_coverage(self, tickers):
+        for ticker in tickers:
+            _coverage.pop((self.filename, ticker), None)
+
+    def set_coverage(self, ticker, covered_from, full_history=False):
+        '''
+        Record a download of ticker from covered_from that returned no rows, the provider has no older history.
+        '''
+        self.insert_tickers([ticker])
+        self._update_coverage([(ticker, covered_from)], [ticker] if full_history else [])
+        self.conn.commit()
+
+    def get_coverage(self, ticker, cached=True) -> dict:
+        '''
+        Stored history of ticker: Start, the first covered day (requested from the provider or stored),
+        End, the last stored day, and Full History. None when nothing was downloaded. The entry is kept
+        in memory and read again when cached is False, the coverage only grows so a cached entry
+        covers at least what it says.
+        '''
+        key = (self.filename, ticker)
+        if cached and key in _coverage:
+            return _coverage[key]
         self.cursor.execute('''
-            SELECT * FROM stocks WHERE ticker = ? AND date > ?
-        ''', (ticker, min_date))
-        data = self.cursor.fetchall()
-        df = pl.DataFrame(data, 
-            schema=[("id", pl.Int64), ("Ticker", pl.Utf8), ("Open", pl.Float64), ("Close", pl.Float64), ("High", pl.Float64), 
-                    ("Low", pl.Float64), ("Adj Open", pl.Float64), ("Adj Close", pl.Float64), ("Adj High", pl.Float64), 
-                    ("Adj Low", pl.Float64), ("Dividends", pl.Float64), ("Volume", pl.Float64), ("Stock Splits", pl.Float64), ("Date", pl.Utf8)]                 
-        )
-        df = df.with_columns(
-            pl.col("Date").str.to_datetime("%Y-%m-%d %H:%M:%S")
-        )
-        return self.sort_by_date(df)
-    
-    def get_all_stocks(self):
+            SELECT MIN(COALESCE(covered_from, first_date), COALESCE(first_date, covered_from)), last_date, full_history
+            FROM tickers WHERE symbol = ?
+        ''', (ticker,))
+        row = self.cursor.fetchone()
+        entry = None
+        if row is not None and row[0] is not None:
+            entry = {
+                "Start": from_epoch_day(row[0]).date(),
+                "End": from_epoch_day(row[1]).date() if row[1] is not None else None,
+                "Full History": bool(row[2]),
+            }
+        _coverage[key] = entry
+        return entry
+
+    def get_ticker_revision(self, ticker) -> tuple:
+        '''
+        (revision, first date changed by the last insert) of the ticker history, (0, None) for an unknown ticker.
+        '''
+        self.cursor.execute("SELECT revision, changed_from FROM tickers WHERE symbol = ?", (ticker,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return 0, None
+        return row[0], from_epoch_day(row[1]).date() if row[1] is not None else None
+
+    def get_ticker_info(self, ticker) -> dict:
+        '''
+        Catalog entry of ticker, None when it is not in the catalog.
+        '''
+        self.cursor.execute(f"SELECT {CATALOG_COLUMNS} FROM tickers WHERE symbol = ?", (ticker,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return _catalog_frame([row]).row(0, named=True)
+
+    def set_ticker_info(self, ticker, name, currency, sector, status, validated_at):
+        self.insert_tickers([ticker])
         self.cursor.execute('''
-            SELECT * FROM stocks
+            UPDATE tickers SET name = ?, currency = ?, sector = ?, status = ?, validated_at = ? WHERE symbol = ?
+        ''', (name, currency, sector, status, validated_at, ticker))
+        self.conn.commit()
+        log.info(f"Updated catalog entry of {ticker}, status {status}")
+
+    def get_catalog(self, stored_only=True) -> pl.DataFrame:
+        '''
+        Ticker catalog, only the tickers with stored bars when stored_only.
+        '''
+        self.cursor.execute(f'''
+            SELECT {CATALOG_COLUMNS} FROM tickers {"WHERE last_date IS NOT NULL" if stored_only else ""} ORDER BY symbol
         ''')
-        data = self.cursor.fetchall()
-        df = pl.DataFrame(data, 
-            schema=[("id", pl.Int64), ("Ticker", pl.Utf8), ("Open", pl.Float64), ("Close", pl.Float64), ("High", pl.Float64), 
-                    ("Low", pl.Float64), ("Adj Open", pl.Float64), ("Adj Close", pl.Float64), ("Adj High", pl.Float64), 
-                    ("Adj Low", pl.Float64), ("Dividends", pl.Float64), ("Volume", pl.Float64), ("Stock Splits", pl.Float64), ("Date", pl.Utf8)]                 
-        )
-        df = df.with_columns(
-            pl.col("Date").str.to_datetime("%Y-%m-%d %H:%M:%S")
-        )
+        return _catalog_frame(self.cursor.fetchall())
+
+    def get_rollups(self, tickers, granularity, min_date=None, max_date=None) -> pl.DataFrame:
+        '''
+        Rollup bars of tickers (a ticker or a list) at granularity ("1w", "1mo" or "1y") from min_date
+        with a bucket start before max_date, ordered by ticker and date. When min_date cuts a bucket,
+        that bucket is aggregated from the daily rows since min_date, in the same query.
+        '''
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        ticker_ids = f"IN (SELECT id FROM tickers WHERE symbol IN ({', '.join('?' * len(tickers))}))"
+        where, params = [f"ticker_id {ticker_ids}", "granularity = ?"], [*tickers, granularity]
+        partial, partial_params = "", []
+        if min_date is not None:
+            min_date = from_epoch_day(to_epoch_day(min_date)).date()
+            boundary = bucket_start(min_date, granularity)
+            if boundary < min_date:
+                boundary = next_bucket_start(min_date, granularity)
+                partial = f"{_rollup_select(granularity, f'WHERE s.ticker_id {ticker_ids} AND s.date >= ? AND s.date < ?')} UNION ALL"
+                partial_params = [*tickers, to_epoch_day(min_date), to_epoch_day(boundary)]
+            where.append("bucket >= ?")
+            params.append(to_epoch_day(boundary))
+        if max_date is not None:
+            where.append("bucket < ?")
+            params.append(to_epoch_day(max_date))
+        self.cursor.execute(f'''
+            SELECT {", ".join(column for column, _ in ROLLUP_FIELDS.values())}
+            FROM ({partial} SELECT * FROM stock_rollups WHERE {" AND ".join(where)}) r
+            JOIN tickers t ON t.id = r.ticker_id
+            ORDER BY r.ticker_id, r.bucket
+        ''', [*partial_params, *params])
+        df = _stock_frame(self.cursor.fetchall(), [(name, dtype) for name, (_, dtype) in ROLLUP_FIELDS.items()])
+        return df.cast({"First Date": pl.Date, "Last Date": pl.Date})
+
+    def _read_stocks(self, where="", params=()):
+        self.cursor.execute(f'''
+            SELECT {STOCK_COLUMNS} FROM stocks s JOIN tickers t ON t.id = s.ticker_id {where}
+        ''', params)
+        df = _stock_frame(self.cursor.fetchall(), STOCK_SCHEMA)
         return self.sort_by_date(df)
-    
+
+    def iter_stocks(self, tickers=None, min_date=None, max_date=None, columns=None, limit=None, batch_size=100000, where=(), params=()):
+        '''
+        DataFrames of at most batch_size rows of the stocks table ordered by ticker and date, filtered by
+        tickers, the [min_date, max_date) range and the sql conditions where with their params. The rows are
+        read by a connection of its own, so the batches can be consumed after this DB is closed or from
+        another thread.
+        '''
+        where, params = list(where), list(params)
+        if tickers is not None:
+            where.append(f"s.ticker_id IN (SELECT id FROM tickers WHERE symbol IN ({', '.join('?' * len(tickers))}))")
+            params.extend(tickers)
+        if min_date is not None:
+            where.append("s.date >= ?")
+            params.append(to_epoch_day(min_date))
+        if max_date is not None:
+            where.append("s.date < ?")
+            params.append(to_epoch_day(max_date))
+        names = columns if columns is not None else list(STOCK_FIELDS)
+        sql = f'''
+            SELECT {", ".join(STOCK_FIELDS[name][0] for name in names)} FROM stocks s
+            {"JOIN tickers t ON t.id = s.ticker_id" if "Ticker" in names else ""}
+            {f"WHERE {' AND '.join(where)}" if where else ""}
+            ORDER BY s.ticker_id, s.date {f"LIMIT {int(limit)}" if limit is not None else ""}
+        '''
+        schema = [(name, STOCK_FIELDS[name][1]) for name in names]
+        for rows in _iter_rows(self.filename, sql, params, batch_size):
+            yield _stock_frame(rows, schema)
+
+    def scan_stocks(self, tickers=None, min_date=None, max_date=None) -> pl.LazyFrame:
+        '''
+        Lazy read of the stocks table, see iter_stocks. The tickers, the [min_date, max_date) range and the
+        Ticker and Date filters of the query plan become the WHERE clause, see predicate_sql, and only the
+        columns used by the query plan are selected. The other filters are applied to the batches.
+        '''
+        def source(with_columns, predicate, n_rows, batch_size):
+            where, params, exact = predicate_sql(predicate) if predicate is not None else ([], [], True)
+            if exact:
+                predicate = None
+            limit = n_rows if predicate is None else None
+            for df in self.iter_stocks(tickers, min_date, max_date, with_columns, limit, batch_size or 100000, where, params):
+                if predicate is not None:
+                    df = df.filter(predicate)
+                if n_rows is not None:
+                    df = df.head(n_rows)
+                    n_rows -= df.height
+                yield df
+                if n_rows is not None and n_rows <= 0:
+                    break
+
+        return register_io_source(source, schema=dict(_stock_frame([], STOCK_SCHEMA).schema))
+
+    def get_stock(self, ticker, min_date):
+        return self._read_stocks('''
+            WHERE s.ticker_id = (SELECT id FROM tickers WHERE symbol = ?) AND s.date >= ?
+        ''', (ticker, to_epoch_day(min_date)))
+
+    def get_all_stocks(self):
+        return self._read_stocks()
+
     def get_stocks_by_timerange(self, ticker, min_date, max_date):
-        self.cursor.execute('''
-            SELECT * FROM stocks WHERE ticker = ? AND date >= ? AND date <= ?
-        ''', (ticker, min_date, max_date))
-        data = self.cursor.fetchall()
-        df = pl.DataFrame(data, 
-            schema=[("id", pl.Int64), ("Ticker", pl.Utf8), ("Open", pl.Float64), ("Close", pl.Float64), ("High", pl.Float64), 
-                    ("Low", pl.Float64), ("Adj Open", pl.Float64), ("Adj Close", pl.Float64), ("Adj High", pl.Float64), 
-                    ("Adj Low", pl.Float64), ("Dividends", pl.Float64), ("Volume", pl.Float64), ("Stock Splits", pl.Float64), ("Date", pl.Utf8)]                 
-        )
-        df = df.with_columns(
-            pl.col("Date").str.to_datetime("%Y-%m-%d %H:%M:%S")
-        )
-        return self.sort_by_date(df)
+        return self._read_stocks('''
+            WHERE s.ticker_id = (SELECT id FROM tickers WHERE symbol = ?) AND s.date >= ? AND s.date < ?
+        ''', (ticker, to_epoch_day(min_date), to_epoch_day(max_date)))
 
     def get_min_max_date(self, ticker=None):
         if ticker is not None:
             self.cursor.execute('''
-                SELECT MIN(date), MAX(date) FROM stocks WHERE ticker = ?
+                SELECT MIN(date), MAX(date) FROM stocks WHERE ticker_id = (SELECT id FROM tickers WHERE symbol = ?)
             ''', (ticker,))
         else:
             self.cursor.execute('''
@@ -140,14 +825,16 @@ class DB():
             ''')
         min_date, max_date = self.cursor.fetchone()
         log.info(f"Get min and max date in database: {min_date}, {max_date}")
-        return datetime.strptime(min_date, "%Y-%m-%d %H:%M:%S"), datetime.strptime(max_date, "%Y-%m-%d %H:%M:%S")
-    
+        if min_date is None:
+            return None, None
+        return from_epoch_day(min_date), from_epoch_day(max_date)
+
     def get_stocks_ticker(self):
         self.cursor.execute('''
-                SELECT DISTINCT(ticker) FROM stocks
+                SELECT symbol FROM tickers WHERE last_date IS NOT NULL ORDER BY symbol
             ''')
         return  self.cursor.fetchall()
-    
+
     def get_stock_download_info(self, ticker):
         self.cursor.execute('''
                 SELECT * FROM stock_download WHERE ticker = ?
@@ -162,13 +849,15 @@ class DB():
 
     def update_stock_download_info(self, ticker, download_date, last_update, download_all_period):
         self.cursor.execute('''
-            INSERT INTO stock_download (ticker, download_date, last_update, download_all_period)
-            VALUES (?, ?, ?, ?)
-        ''', (ticker, download_date, last_update, download_all_period))
+            UPDATE stock_download SET download_date = ?, last_update = ?, download_all_period = ?
+            WHERE ticker = ?
+        ''', (download_date, last_update, download_all_period, ticker))
+        self._update_coverage([], [ticker] if download_all_period == "YES" else [])
         self.conn.commit()
         log.info(f"Updated stock {ticker} download info")
 
     def insert_stock_download_info(self, ticker, download_date, last_update, download_all_period):
+        self.insert_tickers([ticker])
         #check if already exists
         self.cursor.execute('''
             SELECT * FROM stock_download WHERE ticker = ?
@@ -182,6 +871,7 @@ class DB():
             INSERT INTO stock_download (ticker, download_date, last_update, download_all_period)
             VALUES (?, ?, ?, ?)
         ''', (ticker, download_date, last_update, download_all_period))
+        self._update_coverage([], [ticker] if download_all_period == "YES" else [])
         self.conn.commit()
         log.info(f"Inserted stock {ticker} download info")
 
@@ -236,18 +926,23 @@ class DB():
         return self.sort_by_date(df)
 
 
+    def iter_forecast(self, ticker=None, batch_size=100000):
+        '''
+        DataFrames of at most batch_size forecasts of ticker (all when None), see iter_stocks.
+        '''
+        where, params = ("WHERE ticker = ?", (ticker,)) if ticker is not None else ("", ())
+        for rows in _iter_rows(self.filename, f"SELECT * FROM forecast {where} ORDER BY ticker, date", params, batch_size):
+            df = pl.DataFrame(rows, orient="row",
+                schema=[("id", pl.Int64), ("Ticker", pl.Utf8), ("Date", pl.Utf8), ("Forecast Date", pl.Utf8), ("Price", pl.Float64)]
+            )
+            yield df.with_columns(
+                pl.col("Date").str.to_datetime("%Y-%m-%d %H:%M:%S"),
+                pl.col("Forecast Date").str.to_datetime("%Y-%m-%d %H:%M:%S")
+            )
+
     def sort_by_date(self, df):
         return df.sort("Date", descending=False)
 
-    def remove_duplicates(self):
-        self.cursor.execute('''
-            DELETE FROM stocks WHERE id NOT IN (
-                SELECT MAX(id) FROM stocks GROUP BY ticker, date
-            )
-        ''')
-        self.conn.commit()
-        log.info("Removed duplicates from database")
-
     def insert_portifolio(self, ticker, number_of_stocks, price_at_buy, date):
         self.cursor.execute('''
             INSERT INTO portifolio (ticker, number_of_stocks, price_at_buy, date)
@@ -276,6 +971,65 @@ class DB():
         )
         return self.sort_by_date(df)
 
+    def iter_portifolio(self, batch_size=100000):
+        '''
+        DataFrames of at most batch_size portifolio rows, see iter_stocks.
+        '''
+        for rows in _iter_rows(self.filename, "SELECT * FROM portifolio ORDER BY date", (), batch_size):
+            df = pl.DataFrame(rows, orient="row",
+                schema=[("id", pl.Int64), ("Ticker", pl.Utf8), ("Number of Stocks", pl.Int64), ("Price at Buy", pl.Float64), ("Date", pl.Utf8)]
+            )
+            yield df.with_columns(
+                pl.col("Date").str.to_datetime("%Y-%m-%d %H:%M:%S")
+            )
+
+    def start_ingest_run(self, trading_date, stale_after):
+        '''
+        Register an ingest run for trading_date and return its id, or None if another worker
+        already finished or is running it. BEGIN IMMEDIATE takes the database write lock, so only
+        one process can check and insert at a time. Runs older than stale_after seconds are ignored.
+        '''
+        now = datetime.now()
+        stale_date = datetime.fromtimestamp(now.timestamp() - stale_after).strftime("%Y-%m-%d %H:%M:%S")
+        self.conn.commit()
+        self.cursor.execute("BEGIN IMMEDIATE")
+        try:
+            self.cursor.execute('''
+                SELECT id FROM ingest_runs WHERE trading_date = ? AND
+                (status = 'success' OR (status = 'running' AND started_at > ?))
+            ''', (trading_date, stale_date))
+            if self.cursor.fetchone() is not None:
+                self.conn.commit()
+                return None
+            self.cursor.execute('''
+                INSERT INTO ingest_runs (trading_date, started_at, status)
+                VALUES (?, ?, 'running')
+            ''', (trading_date, now.strftime("%Y-%m-%d %H:%M:%S")))
+            run_id = self.cursor.lastrowid
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        log.info(f"Started ingest run {run_id} for {trading_date}")
+        return run_id
+
+    def finish_ingest_run(self, run_id, status, tickers=None, message=None):
+        self.cursor.execute('''
+            UPDATE ingest_runs SET finished_at = ?, status = ?, tickers = ?, message = ?
+            WHERE id = ?
+        ''', (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), status, tickers, message, run_id))
+        self.conn.commit()
+        log.info(f"Finished ingest run {run_id} with status {status}")
+
+    def get_ingest_runs(self, limit=50):
+        self.cursor.execute('''
+            SELECT * FROM ingest_runs ORDER BY id DESC LIMIT ?
+        ''', (limit,))
+        return pl.DataFrame(self.cursor.fetchall(), orient="row",
+            schema=[("id", pl.Int64), ("Trading Date", pl.Utf8), ("Started At", pl.Utf8), ("Finished At", pl.Utf8),
+                    ("Status", pl.Utf8), ("Tickers", pl.Int64), ("Message", pl.Utf8)]
+        )
+
     def close(self):
         self.conn.close()
         log.info("Closed database connection")
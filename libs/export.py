@@ -0,0 +1,169 @@
+# Description: Streaming export of the price history, portifolio and forecasts for notebooks and BI tools.
+#
+#   GET /export/stocks?ticker=PETR4.SA&ticker=VALE3.SA&start=2020-01-01&end=2024-01-01&format=parquet
+#   GET /export/portifolio?format=csv
+#   GET /export/forecast?ticker=PETR4.SA&format=arrow
+#
+# Without ticker the whole universe is exported. The rows are read from the database in batches and
+# every batch is encoded and sent before the next one is read, so memory does not depend on the
+# size of the export. Formats: csv, arrow (Arrow IPC stream) and parquet (one row group per batch).
+import logging
+from datetime import datetime
+
+import polars as pl
+
+from libs.db import DB
+from libs.metrics import registry
+
+log = logging.getLogger()
+
+BATCH_ROWS = 100000
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+class _ChunkSink():
+    '''
+    Write-only file object that keeps the bytes written since the last take().
+    '''
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def _arrow_table(df):
+    # categorical dictionaries differ between batches, write plain strings
+    return df.with_columns(pl.col(pl.Categorical).cast(pl.Utf8)).to_arrow()
+
+def _stream_csv(batches):
+    header = True
+    for df in batches:
+        yield df.write_csv(include_header=header).encode()
+        header = False
+
+def _stream_arrow(batches):
+    import pyarrow as pa
+
+    sink = _ChunkSink()
+    writer = None
+    for df in batches:
+        table = _arrow_table(df)
+        if writer is None:
+            writer = pa.ipc.new_stream(sink, table.schema)
+        writer.write_table(table)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+def _stream_parquet(batches):
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    writer = None
+    for df in batches:
+        table = _arrow_table(df)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema, compression="zstd")
+        writer.write_table(table)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+STREAMS = {"csv": _stream_csv, "arrow": _stream_arrow, "parquet": _stream_parquet}
+
+def stream_export(batches, fmt, dataset):
+    '''
+    Encode the DataFrame batches in fmt, yielding the bytes of each batch.
+    '''
+    for chunk in STREAMS[fmt](_count_rows(batches, dataset, fmt)):
+        if chunk:
+            yield chunk
+
+def _count_rows(batches, dataset, fmt):
+    rows = 0
+    counter = registry.counter("stocks_export_rows_total", "Rows sent by the export routes")
+    for df in batches:
+        rows += df.height
+        counter.inc(df.height, dataset=dataset, format=fmt)
+        yield df
+    log.info(f"Exported {rows} rows of {dataset} as {fmt}")
+
+def register_export_routes(server, db_path, prefix="/export"):
+    '''
+    Mount the export routes on the Flask server of the app.
+    '''
+    from flask import Response, abort, request
+
+    def respond(dataset, batches):
+        fmt = request.args.get("format", "csv")
+        if fmt not in FORMATS:
+            abort(400, f"Unknown format {fmt}, use one of {list(FORMATS)}")
+        mimetype, extension = FORMATS[fmt]
+        return Response(
+            stream_export(batches, fmt, dataset),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f"attachment; filename={dataset}.{extension}"},
+        )
+
+    def date_arg(name):
+        value = request.args.get(name)
+        if value is None:
+            return None
+        try:
+            return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+        except ValueError:
+            abort(400, f"Invalid {name} {value}, use YYYY-MM-DD")
+
+    # the DB iterators read with a connection of their own, the request connection is closed right away.
+    # The arguments are checked before the response starts, the batches are read after the status is sent
+    @server.route(f"{prefix}/stocks")
+    def _export_stocks():
+        tickers = request.args.getlist("ticker") or None
+        start, end = date_arg("start"), date_arg("end")
+        db = DB(db_path)
+        if tickers is not None:
+            unknown = sorted(set(tickers) - {ticker for (ticker,) in db.get_stocks_ticker()})
+            if unknown:
+                db.close()
+                abort(400, f"Unknown tickers {unknown}")
+        batches = db.iter_stocks(tickers, start, end, batch_size=BATCH_ROWS)
+        db.close()
+        return respond("stocks", batches)
+
+    @server.route(f"{prefix}/portifolio")
+    def _export_portifolio():
+        db = DB(db_path)
+        batches = db.iter_portifolio(BATCH_ROWS)
+        db.close()
+        return respond("portifolio", batches)
+
+    @server.route(f"{prefix}/forecast")
+    def _export_forecast():
+        db = DB(db_path)
+        batches = db.iter_forecast(request.args.get("ticker"), BATCH_ROWS)
+        db.close()
+        return respond("forecast", batches)
+
+    log.info(f"Export available at {prefix}/stocks, {prefix}/portifolio and {prefix}/forecast")
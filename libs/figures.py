@@ -0,0 +1,91 @@
+# Description: Compact Plotly figure payloads for the chart callbacks.
+# compact_figure() replaces the numeric arrays of the traces with base64 typed arrays ({"dtype", "bdata"},
+# read natively by plotly.js >= 2.28) and the dates with milliseconds since the epoch on date axes,
+# instead of JSON lists of floats and ISO date strings. The rest of the figure is serialized by
+# plotly's JSON encoder, which uses orjson when it is installed.
+import base64
+import logging
+from datetime import date
+
+import numpy as np
+import plotly.io as pio
+
+log = logging.getLogger()
+
+# Dash serializes the callback responses with plotly's JSON encoder
+try:
+    import orjson  # noqa: F401
+    pio.json.config.default_engine = "orjson"
+except ImportError:
+    log.info("orjson not installed, figures are serialized with the json module")
+
+# plotly.js typed array dtypes by numpy dtype
+DTYPES = {
+    np.dtype("float64"): "f8", np.dtype("float32"): "f4",
+    np.dtype("int32"): "i4", np.dtype("uint32"): "u4", np.dtype("int16"): "i2",
+    np.dtype("uint16"): "u2", np.dtype("int8"): "i1", np.dtype("uint8"): "u1",
+}
+
+MIN_LENGTH = 16
+
+def typed_array(values, float32=False) -> dict:
+    '''
+    Base64 typed array of a numeric numpy array. int64 is sent as int32 when it fits, bool as uint8
+    and float64 as float32 when float32 is set.
+    '''
+    values = np.asarray(values)
+    if values.dtype == np.float64 and float32:
+        values = values.astype(np.float32)
+    elif values.dtype == np.int64:
+        values = values.astype(np.int32) if np.abs(values).max(initial=0) < 2**31 else values.astype(np.float64)
+    elif values.dtype == np.bool_:
+        values = values.astype(np.uint8)
+    elif values.dtype not in DTYPES:
+        values = values.astype(np.float64)
+    values = np.ascontiguousarray(values, dtype=values.dtype.newbyteorder("<"))
+    array = {"dtype": DTYPES[values.dtype], "bdata": base64.b64encode(values.tobytes()).decode("ascii")}
+    if values.ndim > 1:
+        array["shape"] = ",".join(str(n) for n in values.shape)
+    return array
+
+def date_array(values) -> dict:
+    '''
+    Typed array of milliseconds since the epoch, for an axis of type date.
+    '''
+    return typed_array(np.asarray(values, dtype="datetime64[ms]").astype(np.int64).astype(np.float64))
+
+def _dates(values):
+    # plotly turns date series into arrays of ISO strings, parse them back
+    if values.dtype.kind == "M":
+        return values
+    if values.dtype.kind == "U" or (values.dtype.kind == "O" and isinstance(values.flat[0], (date, str))):
+        try:
+            return np.asarray(values, dtype="datetime64[ms]")
+        except (ValueError, TypeError):
+            return None
+    return None
+
+def compact_figure(fig, float32=False) -> dict:
+    '''
+    Figure dict with the trace arrays of at least MIN_LENGTH values encoded as typed arrays. float values
+    stay float64 since the hover labels show them raw (a float32 38.12 reads 38.119998931884766), set
+    float32 for traces whose values are not shown. x and y arrays of dates become milliseconds (float64)
+    and their axes are set to type date.
+    '''
+    figure = fig.to_plotly_json() if hasattr(fig, "to_plotly_json") else fig
+    layout = dict(figure.get("layout", {}))
+    data = []
+    for trace in figure.get("data", []):
+        trace = dict(trace)
+        for key, values in trace.items():
+            if not isinstance(values, (np.ndarray, list, tuple)) or len(values) < MIN_LENGTH:
+                continue
+            values = np.asarray(values)
+            if key in ("x", "y") and (dates := _dates(values)) is not None:
+                trace[key] = date_array(dates)
+                axis = trace.get(f"{key}axis", key).replace(key, f"{key}axis", 1)
+                layout[axis] = {**layout.get(axis, {}), "type": "date"}
+            elif values.dtype.kind in "fiub":
+                trace[key] = typed_array(values, float32)
+        data.append(trace)
+    return {"data": data, "layout": layout}
@@ -1,34 +1,55 @@
-import yfinance as yf
 import logging
 import polars as pl
 from datetime import datetime, timedelta
 
+from libs.metrics import timed
+from libs.providers import YFinanceProvider
+
 log = logging.getLogger()
 
-def get_historical_data(ticker, period):
-    try:
-        yf.Ticker(ticker).info
-    except Exception as e:
-        log.error(f"Ticker was not found {ticker}, please check if value is correct")
-        log.error(f"ERROR MESSAGE: \n{e}")
+_provider = YFinanceProvider()
+
+def set_provider(provider):
+    global _provider
+    log.info(f"Use market data provider {provider.name}")
+    _provider = provider
+
+def get_provider():
+    return _provider
+
+@timed("stocks_provider_call", call="get_historical_data")
+def get_historical_data(ticker, period, end=None):
+    # an unknown ticker has no history, the symbol is validated by libs.catalog when it is added
+    # end ("%Y-%m-%d") bounds the download to the days before it, to backfill the head of a stored history
+    df = _provider.history(ticker, period, end)
+    if df.is_empty():
+        if end is None:
+            log.error(f"Ticker was not found {ticker}, please check if value is correct")
+        else:
+            log.info(f"No history of {ticker} before {end}")
         return None
-    df = pl.from_pandas(yf.Ticker(ticker).history(period=period).reset_index())
     df = df.with_columns(
-        pl.col("Date").dt.replace_time_zone(None)
+        pl.col("Date").dt.replace_time_zone(None).cast(pl.Datetime("us"))
     ).rename(
         {"Open": "Adj Open", "Close": "Adj Close", "High": "Adj High", "Low": "Adj Low"}
     )
     df = df.select(["Adj Open", "Adj Close", "Adj High", "Adj Low", "Date", "Dividends", "Stock Splits"])
-    df1 = get_data_adj(ticker, period)
+    df1 = get_data_adj(ticker, period, end)
+    if df1.is_empty():
+        return None
+    df1 = df1.with_columns(
+        pl.col("Date").dt.replace_time_zone(None).cast(pl.Datetime("us"))
+    )
     df = df.join(df1, on="Date", how="inner")
 
     return df
 
-def get_data_adj(ticker, period):
+@timed("stocks_provider_call", call="get_data_adj")
+def get_data_adj(ticker, period, end=None):
     period = period_to_days(period)
     start_date = (datetime.now() - timedelta(days=period)).strftime("%Y-%m-%d")
-    end_date = datetime.now().strftime("%Y-%m-%d")
-    df = pl.from_pandas(yf.download(ticker, start=start_date, end=end_date).reset_index())
+    end_date = end or datetime.now().strftime("%Y-%m-%d")
+    df = _provider.download(ticker, start_date, end_date)
 
     # df = df.with_columns(
     #     pl.col("Close")
@@ -66,6 +87,15 @@ def days_to_period(day):
     closest_day = min(days, key=lambda x:abs(x-day))
     return period[days.index(closest_day)]
 
+def days_to_min_period(day):
+    '''
+    Shortest period that covers the number of days, used by incremental updates.
+    '''
+    for period in ["5d", "1mo", "3mo", "6mo", "1y", "2y", "5y", "10y"]:
+        if period_to_days(period) >= day:
+            return period
+    return "max"
+
 def period_to_days(period):
     if period == "1d":
         return 1
@@ -0,0 +1,267 @@
+# Description: Compiled CPU inference of the trained neural forecast models.
+# export_models() traces the torch module of each trained darts model (RNN, TCN, Transformer, N-BEATS,
+# TiDE) together with its prediction loop for a fixed horizon, and saves it as TorchScript or ONNX with a
+# manifest. CompiledForecaster runs them on a batch of series with a fixed number of threads, without
+# importing darts or pytorch-lightning, so a forecast takes milliseconds instead of a full darts predict.
+# Each export is checked against the darts module (max_error in the manifest), ONNX runs in float32.
+#
+#   export_models(forecast.models, "output/compiled", predict_days=12, fmt="onnx")
+#   predictions = CompiledForecaster("output/compiled", threads=2).predict({"PETR4.SA": prices})
+import os
+import copy
+import json
+import logging
+
+import numpy as np
+
+from libs.metrics import timer
+
+log = logging.getLogger()
+
+FORMATS = {"torchscript": "pt", "onnx": "onnx"}
+
+MANIFEST = "manifest.json"
+
+# largest difference allowed between an exported model and darts, on the scale of the training series,
+# the float32 ONNX exports stay around 1e-6
+EXPORT_TOLERANCE = 1e-4
+
+def _block_forecaster(module, n, input_chunk_length, output_chunk_length, first_prediction_index):
+    '''
+    Module with the prediction loop of the darts block models: predict output_chunk_length steps, roll
+    them into the input window and predict again until n steps, the last chunk ends exactly at n.
+    '''
+    import torch
+
+    class BlockForecaster(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.module = module
+
+        def step(self, past, static_covariates):
+            return self.module((past, None, static_covariates))[:, first_prediction_index:, :, 0]
+
+        def forward(self, past, static_covariates=None):
+            out = self.step(past, static_covariates)
+            chunks, length, roll = [out], output_chunk_length, output_chunk_length
+            while length < n:
+                if length + output_chunk_length > n:
+                    spillover = length + output_chunk_length - n
+                    roll -= spillover
+                    length -= spillover
+                    chunks[-1] = chunks[-1][:, :roll]
+                if input_chunk_length >= roll:
+                    past = torch.cat([past[:, roll:], out[:, :roll]], dim=1)
+                else:
+                    past = out[:, -input_chunk_length:]
+                out = self.step(past, static_covariates)
+                chunks.append(out)
+                length += output_chunk_length
+            return torch.cat(chunks, dim=1)[:, :n, 0]
+
+    return BlockForecaster()
+
+def _rnn_forecaster(module, n):
+    '''
+    Module with the recurrent prediction loop of RNNModel: the last output and the hidden state are fed
+    back one step at a time.
+    '''
+    import torch
+
+    class RNNForecaster(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.module = module
+
+        def forward(self, past, static_covariates=None):
+            out, hidden = self.module((past, None, static_covariates))
+            steps = [out[:, -1:, :, 0]]
+            for _ in range(n - 1):
+                out, hidden = self.module((steps[-1], None, static_covariates), hidden)
+                steps.append(out[:, -1:, :, 0])
+            return torch.cat(steps, dim=1)[:, :, 0]
+
+    return RNNForecaster()
+
+def _forecaster(model, module, n):
+    from darts.models import RNNModel
+
+    if isinstance(model, RNNModel):
+        forecaster = _rnn_forecaster(module, n)
+    else:
+        forecaster = _block_forecaster(module, n, module.input_chunk_length, module.output_chunk_length,
+                                       module.first_prediction_index)
+    return forecaster.eval()
+
+def _run_exported(path, fmt, inputs, names):
+    import torch
+
+    if fmt == "onnx":
+        import onnxruntime as ort
+
+        session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        return session.run(None, {name: x.numpy() for name, x in zip(names, inputs)})[0]
+    return torch.jit.load(path).eval()(*inputs).numpy()
+
+def export_model(model, path, predict_days=12, fmt="torchscript", tolerance=EXPORT_TOLERANCE) -> dict:
+    '''
+    Trace a trained darts torch model with its prediction loop for predict_days steps and save it to path.
+    The saved model is run on a random batch and compared to the prediction loop of the darts module, a
+    difference above tolerance raises ValueError. Returns the manifest entry of the model.
+    '''
+    import torch
+
+    reference = model.model.eval()
+    module = reference
+    if fmt == "onnx":
+        # the darts models train in float64, the CPU kernels of onnxruntime (Conv) only run float32
+        module = copy.deepcopy(reference).float().eval()
+    input_chunk_length = module.input_chunk_length
+    static = model.uses_static_covariates and model.static_covariates is not None
+    forecaster = _forecaster(model, module, predict_days)
+
+    dtype = next(module.parameters()).dtype
+    example = (torch.zeros(2, input_chunk_length, 1, dtype=dtype),)
+    if static:
+        example += (torch.tensor(model.static_covariates.values, dtype=dtype).unsqueeze(0).repeat(2, 1, 1),)
+    names = ["past", "static_covariates"][:len(example)]
+
+    with torch.no_grad():
+        if fmt == "onnx":
+            torch.onnx.export(forecaster, example, path, input_names=names, output_names=["forecast"],
+                              dynamic_axes={**{name: {0: "batch"} for name in names}, "forecast": {0: "batch"}})
+        else:
+            torch.jit.save(torch.jit.trace(forecaster, example), path)
+
+        # another batch size than the traced example, the batch axis must stay dynamic
+        generator = torch.Generator().manual_seed(0)
+        check = [torch.rand((3, *x.shape[1:]), generator=generator, dtype=torch.float64) for x in example]
+        expected = _forecaster(model, reference, predict_days)(*[x.to(next(reference.parameters()).dtype) for x in check])
+        error = float(np.abs(_run_exported(path, fmt, [x.to(dtype) for x in check], names) - expected.double().numpy()).max())
+    if not error <= tolerance:
+        raise ValueError(f"The {fmt} export differs from the model by {error:.2e}, above {tolerance:.0e}")
+
+    return {
+        "file": os.path.basename(path),
+        "input_chunk_length": input_chunk_length,
+        "static_covariates": list(model.static_covariates.columns) if static else None,
+        "dtype": str(dtype).replace("torch.", ""),
+        "max_error": error,
+    }
+
+def export_models(models, output_path, predict_days=12, fmt="torchscript", scaled=False) -> dict:
+    '''
+    Export the trained torch models of models ({name: darts model}) to output_path, the models without
+    a torch module (TBATS, FFT) or with a likelihood are skipped. scaled tells the models were trained on
+    min-max scaled series, like the global models.
+    '''
+    from darts.models.forecasting.torch_forecasting_model import TorchForecastingModel
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt}, use one of {list(FORMATS)}")
+    os.makedirs(output_path, exist_ok=True)
+    manifest = {"format": fmt, "predict_days": predict_days, "scaled": scaled, "models": {}}
+    for model_name, model in models.items():
+        if not isinstance(model, TorchForecastingModel) or not model.model_created:
+            continue
+        if model.likelihood is not None:
+            log.warning(f"Skip export of {model_name}, probabilistic models are not supported")
+            continue
+        path = os.path.join(output_path, f"{model_name}.{FORMATS[fmt]}")
+        try:
+            with timer("stocks_model", model=model_name, op=f"export_{fmt}"):
+                manifest["models"][model_name] = export_model(model, path, predict_days, fmt)
+        except ValueError as e:
+            log.error(f"Skip export of {model_name}: {e}")
+            # the onnx exporter of recent torch versions writes the weights next to the model
+            for name in (path, f"{path}.data"):
+                if os.path.exists(name):
+                    os.remove(name)
+            continue
+        log.info(f"Exported {model_name} to {path}, max difference {manifest['models'][model_name]['max_error']:.2e}")
+
+    with open(os.path.join(output_path, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+class CompiledForecaster():
+    '''
+    Run the models exported by export_models() on CPU. threads bounds the intra-op threads of torch or
+    onnxruntime, keep threads x workers within the cores of the machine.
+    '''
+    def __init__(self, path, threads=1):
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.predict_days = self.manifest["predict_days"]
+        self.threads = threads
+        self.models = {
+            model_name: self._load(os.path.join(path, entry["file"]))
+            for model_name, entry in self.manifest["models"].items()
+        }
+        log.info(f"Loaded {len(self.models)} compiled models from {path}")
+
+    def _load(self, path):
+        if self.manifest["format"] == "onnx":
+            import onnxruntime as ort
+
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+            return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+        import torch
+
+        torch.set_num_threads(self.threads)
+        return torch.jit.freeze(torch.jit.load(path).eval())
+
+    def _run(self, model_name, past, static_covariates):
+        entry = self.manifest["models"][model_name]
+        model = self.models[model_name]
+        past = past.astype(entry["dtype"])[:, :, None]
+        inputs = [past] if entry["static_covariates"] is None else [past, static_covariates.astype(entry["dtype"])[:, None, :]]
+        if self.manifest["format"] == "onnx":
+            return model.run(None, dict(zip(["past", "static_covariates"], inputs)))[0]
+
+        import torch
+
+        with torch.inference_mode():
+            return model(*[torch.from_numpy(x) for x in inputs]).numpy()
+
+    def predict(self, series, static_covariates=None, predict_days=None) -> dict:
+        '''
+        Forecast the next predict_days prices of every ticker in one call per model. series maps each
+        ticker to its daily prices (oldest first, missing days filled like StockForecast.timeseries, the
+        whole history for scaled models since it sets the scale), static_covariates maps each ticker to
+        the dict of covariates used in training.
+        Returns {ticker: {model_name: prices}}, the first predict_days prices of the exported horizon.
+        '''
+        predict_days = predict_days or self.predict_days
+        if predict_days > self.predict_days:
+            raise ValueError(f"The models were exported for {self.predict_days} days, can not predict {predict_days}")
+        tickers = list(series)
+        predictions = {ticker: {} for ticker in tickers}
+        if not tickers:
+            return predictions
+
+        values = [np.asarray(series[ticker], dtype=np.float64) for ticker in tickers]
+        if self.manifest["scaled"]:
+            # same min-max scaling per series as the darts Scaler of the global models
+            low = np.array([v.min() for v in values])
+            scale = np.array([v.max() for v in values]) - low
+            scale[scale == 0] = 1
+        else:
+            low, scale = np.zeros(len(values)), np.ones(len(values))
+
+        for model_name, entry in self.manifest["models"].items():
+            length = entry["input_chunk_length"]
+            past = np.stack([v[-length:] for v in values])
+            past = (past - low[:, None]) / scale[:, None]
+            static = None
+            if entry["static_covariates"] is not None:
+                static = np.array([[static_covariates[ticker][c] for c in entry["static_covariates"]] for ticker in tickers])
+            with timer("stocks_model", model=model_name, op="predict_compiled"):
+                forecast = self._run(model_name, past, static)
+            forecast = forecast.astype(np.float64) * scale[:, None] + low[:, None]
+            for ticker, prices in zip(tickers, forecast[:, :predict_days]):
+                predictions[ticker][model_name] = prices
+        return predictions
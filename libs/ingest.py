@@ -0,0 +1,151 @@
+# Description: Staged ingest pipeline, fetch -> transform -> write-behind.
+# Fetch threads download from the market data provider, a transform thread converts the frames
+# into database rows and the calling thread writes many tickers per transaction. Bounded queues
+# between the stages apply backpressure when the writer falls behind.
+import queue
+import threading
+import time
+import logging
+from datetime import datetime
+
+import polars as pl
+
+from libs.finance import get_historical_data
+from libs.cache import bump_generation
+
+log = logging.getLogger()
+
+COLUMNS = ["Ticker", "Open", "Close", "High", "Low", "Adj Open", "Adj Close", "Adj High", "Adj Low", "Dividends", "Volume", "Stock Splits", "Date"]
+
+_DONE = object()
+
+def prepare_stock_data(ticker, data) -> pl.DataFrame:
+    return data.with_columns(
+        pl.lit(ticker).alias("Ticker")
+    ).with_columns(
+        pl.col("Date").dt.strftime("%Y-%m-%d %H:%M:%S")
+    ).select(COLUMNS).fill_null(0)
+
+def download_info(ticker, period, full_history=False) -> tuple:
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return (ticker, now, now, "YES" if period == "max" or full_history else "NO")
+
+class IngestPipeline():
+    def __init__(self, db, fetch_workers=4, queue_size=8, batch_rows=200000, batch_tickers=100, max_delay=30):
+        self.db = db
+        self.fetch_workers = fetch_workers
+        self.queue_size = queue_size
+        self.batch_rows = batch_rows
+        self.batch_tickers = batch_tickers
+        self.max_delay = max_delay
+
+    def _put(self, q, item, stop) -> bool:
+        # put that gives up when the pipeline is stopped, a full queue would block the thread forever
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q, stop):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _fetch(self, jobs, fetched, stop):
+        while not stop.is_set():
+            try:
+                job = jobs.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                data = get_historical_data(job[0], job[1])
+            except Exception as e:
+                log.error(f"Error fetching {job[0]}: {e}")
+                data = None
+            if not self._put(fetched, (job, data), stop):
+                return
+        self._put(fetched, _DONE, stop)
+
+    def _transform(self, fetched, transformed, workers, stop):
+        finished = 0
+        while finished < workers and not stop.is_set():
+            item = self._get(fetched, stop)
+            if item is _DONE:
+                finished += 1
+                continue
+            (ticker, period, full_history), data = item
+            if data is None or data.is_empty():
+                log.warning(f"Stock {ticker} not found, yfinance api can not find this ticker")
+                self._put(transformed, (ticker, None, None), stop)
+                continue
+            rows = prepare_stock_data(ticker, data).rows()
+            self._put(transformed, (ticker, rows, download_info(ticker, period, full_history)), stop)
+        self._put(transformed, _DONE, stop)
+
+    def run(self, jobs):
+        '''
+        Ingest a list of (ticker, period, full_history) jobs, yielding (done, total) once the
+        rows of each ticker are committed.
+        '''
+        total = len(jobs)
+        if total == 0:
+            return
+
+        job_queue = queue.Queue()
+        for job in jobs:
+            job_queue.put(job)
+        fetched = queue.Queue(maxsize=self.queue_size)
+        transformed = queue.Queue(maxsize=self.queue_size)
+
+        workers = min(self.fetch_workers, total)
+        stop = threading.Event()
+        threads = [threading.Thread(target=self._fetch, args=(job_queue, fetched, stop), daemon=True) for _ in range(workers)]
+        threads.append(threading.Thread(target=self._transform, args=(fetched, transformed, workers, stop), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        rows, infos, pending, done, batches = [], [], 0, 0, 0
+        first_pending = None
+        try:
+            while True:
+                try:
+                    item = transformed.get(timeout=1)
+                except queue.Empty:
+                    item = None
+                finished = item is _DONE
+
+                if item is not None and not finished:
+                    _, ticker_rows, info = item
+                    pending += 1
+                    first_pending = first_pending or time.monotonic()
+                    if ticker_rows is not None:
+                        rows.extend(ticker_rows)
+                        infos.append(info)
+
+                if pending > 0 and (finished or len(rows) >= self.batch_rows or len(infos) >= self.batch_tickers
+                                    or time.monotonic() - first_pending >= self.max_delay):
+                    if infos:
+                        self.db.bulk_write(rows, infos)
+                        batches += 1
+                    for _ in range(pending):
+                        done += 1
+                        yield done, total
+                    rows, infos, pending, first_pending = [], [], 0, None
+
+                if finished:
+                    break
+        finally:
+            # a failed write or a consumer closing the generator early stops the fetch and transform
+            # threads, they would wait on the full queues forever
+            stop.set()
+            for thread in threads:
+                thread.join()
+            if batches > 0:
+                bump_generation()
+        log.info(f"Ingested {total} stocks in {batches} transactions")
@@ -0,0 +1,184 @@
+# Description: Storage and resampling of intraday bars.
+# Intraday history is hundreds of times larger than the daily one, so it is kept out of the SQLite
+# database, in one parquet file per interval, ticker and trading day:
+#
+#   intraday/5m/PETR4.SA/2024-05-02.parquet
+#
+# A trading day the provider has no bars for is stored as an empty file, so it is not asked for again.
+# A range query lists the day files of the tickers and only scans the ones inside the range. Datetimes
+# are naive, in the local time of the exchange, like the daily dates. resample() aggregates bars (intraday
+# or daily) to any coarser interval with polars group_by_dynamic.
+import os
+import logging
+from datetime import datetime, date, timedelta
+
+import polars as pl
+
+from libs.metrics import timer
+
+log = logging.getLogger()
+
+# provider intervals and their length in minutes
+INTERVALS = {"1m": 1, "2m": 2, "5m": 5, "15m": 15, "30m": 30, "60m": 60, "90m": 90}
+# days back from today the provider serves the bars of each interval, older days are never downloaded
+INTERVAL_HISTORY_DAYS = {"1m": 7, "2m": 60, "5m": 60, "15m": 60, "30m": 60, "60m": 730, "90m": 60}
+
+BAR_SCHEMA = {
+    "Datetime": pl.Datetime("us"),
+    "Open": pl.Float64,
+    "High": pl.Float64,
+    "Low": pl.Float64,
+    "Close": pl.Float64,
+    "Volume": pl.Float64,
+}
+
+# aggregation of each bar column when resampling, columns not listed here are dropped
+AGGREGATIONS = {
+    "Open": pl.first, "Adj Open": pl.first,
+    "High": pl.max, "Adj High": pl.max,
+    "Low": pl.min, "Adj Low": pl.min,
+    "Close": pl.last, "Adj Close": pl.last,
+    "Volume": pl.sum, "Dividends": pl.sum,
+}
+
+def _day(value) -> str:
+    if value is None:
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%Y-%m-%d")
+    return str(value)[:10]
+
+def _datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.fromisoformat(str(value))
+
+class IntradayStore():
+    def __init__(self, path):
+        self.path = path
+
+    def _ticker_path(self, ticker, interval):
+        return os.path.join(self.path, interval, ticker)
+
+    def days(self, ticker, interval, start=None, end=None) -> list:
+        '''
+        Stored trading days ("%Y-%m-%d") of ticker between the days of start and end, both included.
+        '''
+        path = self._ticker_path(ticker, interval)
+        if not os.path.isdir(path):
+            return []
+        start, end = _day(start), _day(end)
+        days = sorted(name[:-len(".parquet")] for name in os.listdir(path) if name.endswith(".parquet"))
+        return [day for day in days if (start is None or day >= start) and (end is None or day <= end)]
+
+    def write(self, ticker, interval, df) -> int:
+        '''
+        Store the bars of df (BAR_SCHEMA columns), merged with the stored bars of the same days,
+        the new bars replace the stored ones with the same Datetime. Returns the number of days written.
+        '''
+        if interval not in INTERVALS:
+            raise ValueError(f"Unknown interval {interval}, use one of {list(INTERVALS)}")
+        if df.is_empty():
+            return 0
+        path = self._ticker_path(ticker, interval)
+        os.makedirs(path, exist_ok=True)
+        df = df.select([pl.col(name).cast(dtype) for name, dtype in BAR_SCHEMA.items()])
+
+        days = 0
+        partitions = df.with_columns(pl.col("Datetime").dt.date().alias("Day")).partition_by("Day", as_dict=True, include_key=False)
+        for (day,), bars in partitions.items():
+            filename = os.path.join(path, f"{_day(day)}.parquet")
+            if os.path.exists(filename):
+                bars = pl.concat([pl.read_parquet(filename), bars])
+            bars = bars.unique(subset="Datetime", keep="last").sort("Datetime")
+            # write next to the partition and rename, readers never see a partial file
+            bars.write_parquet(f"{filename}.tmp", statistics=True)
+            os.replace(f"{filename}.tmp", filename)
+            days += 1
+        log.info(f"Stored {df.height} {interval} bars of {ticker} in {days} days")
+        return days
+
+    def write_empty(self, ticker, interval, days) -> int:
+        '''
+        Store an empty partition for each of days ("%Y-%m-%d") not stored yet, the days the provider has
+        no bars for are then listed by days() and not downloaded again. Returns the number of days written.
+        '''
+        path = self._ticker_path(ticker, interval)
+        empty = [day for day in days if not os.path.exists(os.path.join(path, f"{_day(day)}.parquet"))]
+        if not empty:
+            return 0
+        os.makedirs(path, exist_ok=True)
+        bars = pl.DataFrame(schema=BAR_SCHEMA)
+        for day in empty:
+            filename = os.path.join(path, f"{_day(day)}.parquet")
+            bars.write_parquet(f"{filename}.tmp", statistics=True)
+            os.replace(f"{filename}.tmp", filename)
+        log.info(f"No {interval} bars of {ticker} on {len(empty)} days, stored empty")
+        return len(empty)
+
+    def scan(self, tickers, interval, start=None, end=None) -> pl.LazyFrame:
+        '''
+        LazyFrame with Ticker and the bars of tickers (a ticker or a list) between start and end (end
+        excluded, dates or datetimes), only the day files of the range are read.
+        '''
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        start, end = _datetime(start), _datetime(end)
+        # end is excluded, a range ending at midnight does not touch the file of that day
+        last_day = end - timedelta(microseconds=1) if end is not None else None
+        frames = []
+        for ticker in tickers:
+            files = [os.path.join(self._ticker_path(ticker, interval), f"{day}.parquet") for day in self.days(ticker, interval, start, last_day)]
+            if files:
+                frames.append(pl.scan_parquet(files).with_columns(pl.lit(ticker).cast(pl.Categorical).alias("Ticker")))
+        if not frames:
+            return pl.LazyFrame(schema={"Ticker": pl.Categorical, **BAR_SCHEMA})
+
+        lf = pl.concat(frames).select("Ticker", *BAR_SCHEMA)
+        if start is not None:
+            lf = lf.filter(pl.col("Datetime") >= start)
+        if end is not None:
+            lf = lf.filter(pl.col("Datetime") < end)
+        return lf
+
+    def read(self, tickers, interval, start=None, end=None, every=None) -> pl.DataFrame:
+        '''
+        Bars of tickers between start and end, resampled to every ("15m", "1h", "1d", ...) when given.
+        '''
+        with timer("stocks_intraday", op="read", interval=interval):
+            lf = self.scan(tickers, interval, start, end)
+            if every is not None:
+                lf = resample(lf, every)
+            return lf.collect()
+
+    def ingest(self, provider, ticker, interval, start, end, days=()) -> int:
+        '''
+        Download the bars of ticker between start and end ("%Y-%m-%d") from provider and store them, the
+        trading days of the range in days that got no bars are stored empty, see write_empty.
+        '''
+        with timer("stocks_intraday", op="ingest", interval=interval):
+            df = provider.intraday(ticker, interval, start, end)
+            if df is None or df.is_empty():
+                log.warning(f"No {interval} bars of {ticker} between {start} and {end}")
+                written = 0
+            else:
+                written = self.write(ticker, interval, df)
+            self.write_empty(ticker, interval, days)
+            return written
+
+def resample(data, every, time_column=None, by="Ticker"):
+    '''
+    Aggregate the bars of data (DataFrame or LazyFrame, intraday or daily) to the coarser interval every
+    ("15m", "1h", "1d", "1w", "1mo", ...): first Open, max High, min Low, last Close, summed Volume and
+    Dividends, per by column when present. Bars are labeled by the start of their window.
+    '''
+    lf = data.lazy()
+    schema = lf.collect_schema()
+    time_column = time_column or ("Datetime" if "Datetime" in schema else "Date")
+    group_by = [by] if by in schema else None
+    aggregations = [AGGREGATIONS[name](name) for name in schema if name in AGGREGATIONS]
+    lf = lf.sort(*(group_by or []), time_column)
+    lf = lf.group_by_dynamic(time_column, every=every, group_by=group_by, label="left").agg(aggregations)
+    return lf.collect() if isinstance(data, pl.DataFrame) else lf
@@ -1,18 +1,30 @@
-from sklearnex import patch_sklearn
-patch_sklearn()
-
-from sklearn.linear_model import LinearRegression, Ridge, Lasso
-from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_absolute_error, mean_squared_error
 from datetime import timedelta
 import polars as pl
 import numpy as np
 import pickle as pkl
 import os
 
+from libs.metrics import timer
+
+_sklearn_patched = False
+
+def patch_sklearn():
+    '''
+    Enable the sklearnex accelerated estimators. It must run before sklearn estimators are imported,
+    so sklearn is imported lazily in the methods that use it.
+    '''
+    global _sklearn_patched
+    if not _sklearn_patched:
+        from sklearnex import patch_sklearn
+        patch_sklearn()
+        _sklearn_patched = True
+
 class LinearRegressionModel():
     def __init__(self, regression_model, model_path, predict_days, **kwargs):
+        patch_sklearn()
+        from sklearn.linear_model import LinearRegression, Ridge, Lasso
+        from sklearn.preprocessing import StandardScaler
+
         if regression_model == "linear":
             self.model = LinearRegression()
         elif regression_model == "ridge":
@@ -20,6 +32,7 @@ class LinearRegressionModel():
         elif regression_model == "lasso":
             self.model = Lasso(alpha=kwargs.get('alpha', 0.1))
         
+        self.regression_model = regression_model
         self.scaler = StandardScaler()
         self.model_path = model_path
         self.predict_days = predict_days
@@ -76,7 +89,8 @@ class LinearRegressionModel():
         self.last_data = df.select("Date", "Adj Close")[-1] # store last data to predict future values
         X, y = self.preprocess_data(df)
         metrics = self.metrics(X, y)
-        self.model.fit(X, y)
+        with timer("stocks_model", model=self.regression_model, op="fit"):
+            self.model.fit(X, y)
         self.compute_residuals(X, y)
         self.mse = metrics['mse']
 
@@ -112,9 +126,11 @@ class LinearRegressionModel():
         confidence = kwargs.get("confidence", 0.05)
         n_boot = kwargs.get("n_boot", 250)
 
-        pred = self.predict_steps(self.last_data.clone(), n_days)
+        with timer("stocks_model", model=self.regression_model, op="predict"):
+            pred = self.predict_steps(self.last_data.clone(), n_days)
         if return_interval:
-            bootstrapping_resampling = self.bootstrapping_resampling(self.last_data.clone(), n_boot, n_days)
+            with timer("stocks_model", model=self.regression_model, op="bootstrap"):
+                bootstrapping_resampling = self.bootstrapping_resampling(self.last_data.clone(), n_boot, n_days)
             pred_intervals = pl.DataFrame({
                 "Date": pred.select("Date"),
                 "Prediction": pred.select("Prediction"),
@@ -125,6 +141,9 @@ class LinearRegressionModel():
         return pred
 
     def metrics(self, X, y):
+        from sklearn.model_selection import train_test_split
+        from sklearn.metrics import mean_absolute_error, mean_squared_error
+
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2)
         self.model.fit(X_train, y_train)
         y_pred = self.model.predict(X_test)
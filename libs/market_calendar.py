@@ -0,0 +1,84 @@
+# Description: B3 trading calendar, used to schedule the data refresh after the market close.
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+B3_TIMEZONE = ZoneInfo("America/Sao_Paulo")
+B3_CLOSE = time(18, 0)
+
+def easter(year) -> date:
+    # anonymous gregorian algorithm
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+@lru_cache(maxsize=None)
+def b3_holidays(year) -> frozenset:
+    easter_day = easter(year)
+    holidays = {
+        date(year, 1, 1),    # Confraternização Universal
+        date(year, 4, 21),   # Tiradentes
+        date(year, 5, 1),    # Dia do Trabalho
+        date(year, 9, 7),    # Independência
+        date(year, 10, 12),  # Nossa Senhora Aparecida
+        date(year, 11, 2),   # Finados
+        date(year, 11, 15),  # Proclamação da República
+        date(year, 12, 24),  # Véspera de Natal
+        date(year, 12, 25),  # Natal
+        date(year, 12, 31),  # Último dia do ano
+        easter_day - timedelta(days=48),  # Carnaval
+        easter_day - timedelta(days=47),  # Carnaval
+        easter_day - timedelta(days=2),   # Sexta-feira Santa
+        easter_day + timedelta(days=60),  # Corpus Christi
+    }
+    if year >= 2024:
+        holidays.add(date(year, 11, 20))  # Consciência Negra
+    return frozenset(holidays)
+
+def is_trading_day(day) -> bool:
+    if isinstance(day, datetime):
+        day = day.date()
+    return day.weekday() < 5 and day not in b3_holidays(day.year)
+
+def previous_trading_day(day) -> date:
+    day = day - timedelta(days=1)
+    while not is_trading_day(day):
+        day -= timedelta(days=1)
+    return day
+
+def next_trading_day(day) -> date:
+    day = day + timedelta(days=1)
+    while not is_trading_day(day):
+        day += timedelta(days=1)
+    return day
+
+def close_time(day, delay=timedelta(0)) -> datetime:
+    return datetime.combine(day, B3_CLOSE, tzinfo=B3_TIMEZONE) + delay
+
+def last_closed_trading_day(now=None, delay=timedelta(0)) -> date:
+    '''
+    Most recent trading day whose close (plus delay) already happened.
+    '''
+    now = now or datetime.now(B3_TIMEZONE)
+    day = now.astimezone(B3_TIMEZONE).date()
+    if is_trading_day(day) and now >= close_time(day, delay):
+        return day
+    return previous_trading_day(day)
+
+def next_close(now=None, delay=timedelta(0)) -> datetime:
+    '''
+    Next trading day close (plus delay) after now.
+    '''
+    now = now or datetime.now(B3_TIMEZONE)
+    day = now.astimezone(B3_TIMEZONE).date()
+    if is_trading_day(day) and now < close_time(day, delay):
+        return close_time(day, delay)
+    return close_time(next_trading_day(day), delay)
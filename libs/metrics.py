@@ -0,0 +1,279 @@
+# Description: In-process latency histograms and counters, exposed in Prometheus text format.
+# The gunicorn workers each publish a snapshot of their registry to the shared disk cache every
+# METRICS_PUBLISH_SECONDS, /metrics answered by any of them renders the sum of the workers alive.
+import os
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+import logging
+
+from libs.config import METRICS_PUBLISH_SECONDS
+
+log = logging.getLogger()
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter():
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.values)
+
+    def merge(self, values):
+        with self.lock:
+            for key, value in values.items():
+                self.values[key] = self.values.get(key, 0) + value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+class Histogram():
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.values = {}  # labels -> [bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {key: [list(counts), total, count] for key, (counts, total, count) in self.values.items()}
+
+    def merge(self, values):
+        with self.lock:
+            for key, (counts, total, count) in values.items():
+                series = self.values.get(key)
+                if series is None:
+                    series = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+                series[2] += count
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', _format_value(bound))])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+class Registry():
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, help)
+            return self.metrics[name]
+
+    def histogram(self, name, help="") -> Histogram:
+        return self._get_or_create(Histogram, name, help)
+
+    def counter(self, name, help="") -> Counter:
+        return self._get_or_create(Counter, name, help)
+
+    def snapshot(self) -> dict:
+        '''
+        Values of every metric by name, picklable, see merge.
+        '''
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: (type(metric).__name__, metric.help, metric.snapshot()) for metric in metrics}
+
+    def merge(self, snapshot):
+        '''
+        Add the values of the snapshot of another registry to this one.
+        '''
+        for name, (kind, help, values) in snapshot.items():
+            metric = self.histogram(name, help) if kind == "Histogram" else self.counter(name, help)
+            metric.merge(values)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+class WorkerMetrics():
+    '''
+    Snapshots of the registry of each worker process in the shared disk cache. A worker publishes its own
+    every interval and when it answers /metrics, the snapshots of the workers not heard of for three
+    intervals are dropped: the counters of a dead worker stop adding to the sum, like a counter reset.
+    '''
+    KEY = "metrics_workers"
+
+    def __init__(self, registry, interval=METRICS_PUBLISH_SECONDS):
+        self.registry = registry
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def publish(self) -> dict:
+        from libs.cache import cache
+
+        now = time.time()
+        with cache.transact():
+            workers = {pid: (published, snapshot) for pid, (published, snapshot) in cache.get(self.KEY, {}).items()
+                       if now - published < 3 * self.interval}
+            workers[os.getpid()] = (now, self.registry.snapshot())
+            cache.set(self.KEY, workers)
+        return workers
+
+    def render(self) -> str:
+        merged = Registry()
+        for _, snapshot in self.publish().values():
+            merged.merge(snapshot)
+        return merged.render()
+
+    def run_forever(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.publish()
+            except Exception as e:
+                log.error(f"Error publishing the metrics of worker {os.getpid()}: {e}")
+
+    def start(self) -> threading.Thread:
+        self.publish()
+        self.thread = threading.Thread(target=self.run_forever, name="metrics", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+# set in the gunicorn workers, /metrics renders the sum of the workers instead of this process
+worker_metrics = None
+
+def publish_worker_metrics(interval=METRICS_PUBLISH_SECONDS) -> WorkerMetrics:
+    global worker_metrics
+    worker_metrics = WorkerMetrics(registry, interval)
+    worker_metrics.start()
+    return worker_metrics
+
+@contextmanager
+def timer(metric, **labels):
+    '''
+    Observe the duration of the block in the histogram <metric>_seconds and count
+    exceptions in <metric>_errors_total.
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        registry.counter(f"{metric}_errors_total", f"Errors raised in {metric}").inc(**labels)
+        raise
+    finally:
+        registry.histogram(f"{metric}_seconds", f"Latency of {metric} in seconds").observe(time.perf_counter() - start, **labels)
+
+def timed(metric, **labels):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(metric, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def instrument_methods(metric, label, exclude=()):
+    '''
+    Class decorator timing every public method, labelled by the method name.
+    '''
+    def decorator(cls):
+        for name, fn in list(vars(cls).items()):
+            if name.startswith("_") or name in exclude or not callable(fn):
+                continue
+            setattr(cls, name, timed(metric, **{label: name})(fn))
+        return cls
+    return decorator
+
+def register_metrics(app, path="/metrics"):
+    '''
+    Time Dash callbacks and page layouts of the app, and mount the metrics route on app.server.
+    '''
+    import dash
+    from flask import Response, g, request
+
+    server = app.server
+    callback_path = f"{app.config.requests_pathname_prefix}_dash-update-component"
+
+    for page in dash.page_registry.values():
+        if callable(page["layout"]):
+            page["layout"] = timed("stocks_layout", page=page["module"])(page["layout"])
+
+    @server.before_request
+    def _start_callback_timer():
+        if request.path == callback_path:
+            g.metrics_start = time.perf_counter()
+
+    @server.teardown_request
+    def _stop_callback_timer(exception):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return
+        body = request.get_json(silent=True) or {}
+        output = body.get("output", "unknown")
+        registry.histogram("stocks_callback_seconds", "Latency of Dash callbacks in seconds").observe(time.perf_counter() - start, output=output)
+        if exception is not None:
+            registry.counter("stocks_callback_errors_total", "Errors raised in Dash callbacks").inc(output=output)
+
+    @server.route(path)
+    def _metrics():
+        body = worker_metrics.render() if worker_metrics is not None else registry.render()
+        return Response(body, mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+    log.info(f"Metrics available at {path}")
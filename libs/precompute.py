@@ -0,0 +1,118 @@
+# Description: Heavy page data computed outside of the page layouts.
+# Results are cached in the shared disk cache per ingest generation, the pages read them from
+# background callbacks and warm_up() fills the cache after each ingest.
+import threading
+import logging
+import polars as pl
+
+from libs.cache import cache, get_generation
+
+log = logging.getLogger()
+
+EXPIRE = 7 * 24 * 3600
+
+def _key(name) -> tuple:
+    return ("precompute", name, get_generation())
+
+def cached(name, compute, *args, progress=None):
+    value = cache.get(_key(name))
+    if value is None:
+        value = compute(*args, progress=progress)
+        # compute may download a missing history and bump the generation, store under the one it read
+        key = _key(name)
+        log.info(f"Computed {name} for generation {key[-1]}")
+        cache.set(key, value, expire=EXPIRE)
+    return value
+
+def _analysis_table(stocks, periods, progress=None) -> list:
+    all_stocks = stocks.list_stocks()
+    data = []
+    for i, stock in enumerate(all_stocks):
+        stock = stock[0]
+        stats = stocks.get_statistics_all_periods(stock, periods, True)
+        row = {"ticker": stock}
+        for s in stats:
+            row[f"dividends_{s['Period']}"] = s['Dividends']
+            row[f"dividend_yield_{s['Period']}"] = s['Dividend_yield']
+            row[f"price_{s['Period']}"] = s['Close']
+            row[f"price_variation_{s['Period']}"] = s['Price_variation'] / 100
+        data.append(row)
+        if progress is not None:
+            progress(i + 1, len(all_stocks))
+    return data
+
+def analysis_table(stocks, periods=("1y", "2y", "5y"), progress=None) -> list:
+    '''
+    Rows of the analysis page: dividends, dividend yield, price and price variation of every stock by period.
+    '''
+    return cached(f"analysis_table_{'_'.join(periods)}", _analysis_table, stocks, list(periods), progress=progress)
+
+def cached_analysis_table(periods=("1y", "2y", "5y")) -> list:
+    '''
+    Rows of analysis_table when they are cached for the current generation, None otherwise.
+    '''
+    return cache.get(_key(f"analysis_table_{'_'.join(periods)}"))
+
+def _portifolio_statistics(stocks, progress=None) -> list:
+    df = stocks.get_portifolio()
+    statistics = []
+    for i, stock in enumerate(df.iter_rows(named=True)):
+        stats = stocks.get_statistics_by_buy_date(stock['Ticker'], stock['Date'], stock['Price at Buy'], return_dict=True)
+        stats["Ticker"] = stock['Ticker']
+        stats["Price at Buy"] = stock['Price at Buy']
+        stats["Number of Stocks"] = stock['Number of Stocks']
+        stats["Buy Date"] = stock['Date']
+        statistics.append(stats)
+        if progress is not None:
+            progress(i + 1, len(df))
+    return statistics
+
+def portifolio_statistics(stocks, progress=None) -> list:
+    '''
+    Statistics of every portifolio holding since its buy date, used by the home and portifolio pages.
+    '''
+    return cached("portifolio_statistics", _portifolio_statistics, stocks, progress=progress)
+
+def _monthly_portifolio_statistics(stocks, progress=None) -> dict:
+    if stocks.get_portifolio().is_empty():
+        return {"Date": [], "Dividends": [], "Price Variation Diff": []}
+    data = stocks.get_monthly_portifolio_statistics()
+    # the holdings are already monthly bars labeled by the first day of the month, sum them by month
+    data = data.group_by("Date").agg(pl.sum("Dividends"), pl.sum("Price Variation Diff")).sort("Date")
+    return data.to_dict(as_series=False)
+
+def monthly_portifolio_statistics(stocks, progress=None) -> dict:
+    '''
+    Monthly dividends and price variation of the whole portifolio, as columns.
+    '''
+    return cached("monthly_portifolio_statistics", _monthly_portifolio_statistics, stocks, progress=progress)
+
+def _portifolio_risk(stocks, confidence, horizon, scenarios, progress=None) -> dict:
+    return stocks.get_portifolio_risk(confidence, horizon, scenarios, progress=progress)
+
+def portifolio_risk(stocks, confidence=0.95, horizon=1, scenarios=100000, progress=None) -> dict:
+    '''
+    Risk metrics of the portifolio used by the risk page, see libs.risk.
+    '''
+    return cached(f"portifolio_risk_{confidence}_{horizon}_{scenarios}", _portifolio_risk, stocks, confidence, horizon, scenarios, progress=progress)
+
+def warm_up(db_path):
+    from libs.db import DB
+    from libs.stocks import Stocks
+
+    log.info(f"Warm up precomputed page data for generation {get_generation()}")
+    stocks = Stocks(DB(db_path))
+    try:
+        analysis_table(stocks)
+        portifolio_statistics(stocks)
+        monthly_portifolio_statistics(stocks)
+        portifolio_risk(stocks)
+    except Exception as e:
+        log.error(f"Error warming up page data: {e}")
+    finally:
+        stocks.db.close()
+
+def warm_up_async(db_path) -> threading.Thread:
+    thread = threading.Thread(target=warm_up, args=(db_path,), daemon=True)
+    thread.start()
+    return thread
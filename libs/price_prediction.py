@@ -1,40 +1,123 @@
-import pandas as pd
-from darts import TimeSeries
-from darts.models import RNNModel, TCNModel, TransformerModel, NBEATSModel, TiDEModel, TBATS, FFT
-from darts.utils.missing_values import fill_missing_values
-
+# darts, torch and pytorch-lightning take seconds and hundreds of MB to import,
+# so they are only imported inside the methods that train or load models.
 import os
 import logging
 
+from libs.metrics import timer
+
 log = logging.getLogger()
 
+# models trained once on the series of every ticker, TBATS and FFT only fit a single series
+GLOBAL_MODELS = ["rnn", "tcn", "transformer", "nbeats", "tide"]
+
 class StockForecast():
     def __init__(self, output_path):
         self.output_path = output_path
         if not os.path.exists(output_path):
             os.mkdir(output_path)
         self.ticker = None
+        self.compiled = None
 
-    def timeseries(self, df):
+    def timeseries(self, df, static_covariates=None, freq='D'):
+        '''
+        Series of the prices of df, daily bars by default. Intraday bars (Datetime and Close, see
+        libs.intraday) are read at freq, a pandas frequency like '5min', resample them first for coarser ones.
+        '''
+        import pandas as pd
+        from darts import TimeSeries
+        from darts.utils.missing_values import fill_missing_values
+
+        time_col, value_col = ('Date', 'Adj Close') if 'Date' in df.columns else ('Datetime', 'Close')
         df = df.to_pandas()
-        df.index = pd.to_datetime(df['Date'])   
-        series = TimeSeries.from_dataframe(df, 'Date', 'Adj Close', freq='D', fill_missing_dates=True)
+        df.index = pd.to_datetime(df[time_col])
+        series = TimeSeries.from_dataframe(df, time_col, value_col, freq=freq, fill_missing_dates=True)
         series = fill_missing_values(series)
+        if static_covariates is not None:
+            series = series.with_static_covariates(pd.Series(static_covariates))
         return series
     
     def train(self, time_series):
         for model_name, model in self.models.items():
-            model.fit(time_series)
+            with timer("stocks_model", model=model_name, op="fit"):
+                model.fit(time_series)
             model.save(os.path.join(self.output_path, f"model_{model_name}_{self.ticker}.pt"))
 
     def predict(self, predict_days=12):
         predictions = {}
         for model_name, model in self.models.items():
-            prediction = model.predict(predict_days)
+            with timer("stocks_model", model=model_name, op="predict"):
+                prediction = model.predict(predict_days)
             predictions[model_name] = prediction
         return predictions
     
+    def train_global(self, series):
+        '''
+        Fit each global model once on the series of all tickers ({ticker: TimeSeries}). Every series is
+        min-max scaled on its own, so tickers of any price level share the same model.
+        '''
+        from darts.dataprocessing.transformers import Scaler
+
+        scaled = Scaler().fit_transform(list(series.values()))
+        for model_name in GLOBAL_MODELS:
+            model = self.models[model_name]
+            with timer("stocks_model", model=model_name, op="fit_global"):
+                model.fit(scaled)
+            model.save(os.path.join(self.output_path, f"model_{model_name}_global.pt"))
+        log.info(f"Trained {len(GLOBAL_MODELS)} global models on {len(series)} series")
+
+    def predict_global(self, series, predict_days=12) -> dict:
+        '''
+        Forecast every ticker of series ({ticker: TimeSeries}) with one predict call per global model,
+        returns {ticker: {model_name: prediction}}.
+        '''
+        from darts.dataprocessing.transformers import Scaler
+
+        tickers = list(series)
+        scaler = Scaler()
+        scaled = scaler.fit_transform(list(series.values()))
+        predictions = {ticker: {} for ticker in tickers}
+        for model_name in GLOBAL_MODELS:
+            with timer("stocks_model", model=model_name, op="predict_global"):
+                prediction = self.models[model_name].predict(predict_days, series=scaled)
+            for ticker, p in zip(tickers, scaler.inverse_transform(prediction)):
+                predictions[ticker][model_name] = p
+        return predictions
+
+    def export_global(self, fmt="torchscript", predict_days=12) -> dict:
+        '''
+        Compile the trained global models for predict_days to TorchScript or ONNX, see libs.inference.
+        '''
+        from libs.inference import export_models
+
+        models = {model_name: self.models[model_name] for model_name in GLOBAL_MODELS}
+        return export_models(models, os.path.join(self.output_path, "compiled"), predict_days, fmt, scaled=True)
+
+    def predict_compiled(self, series, static_covariates=None, predict_days=12, threads=1) -> dict:
+        '''
+        Forecast with the compiled global models, series maps each ticker to its filled daily prices.
+        '''
+        from libs.inference import CompiledForecaster
+
+        if self.compiled is None:
+            self.compiled = CompiledForecaster(os.path.join(self.output_path, "compiled"), threads)
+        return self.compiled.predict(series, static_covariates, predict_days)
+
+    def try_load_global(self):
+        from darts.models import RNNModel, TCNModel, TransformerModel, NBEATSModel, TiDEModel
+
+        classes = {"rnn": RNNModel, "tcn": TCNModel, "transformer": TransformerModel, "nbeats": NBEATSModel, "tide": TiDEModel}
+        try:
+            self.models = {
+                model_name: classes[model_name].load(os.path.join(self.output_path, f"model_{model_name}_global.pt"))
+                for model_name in GLOBAL_MODELS
+            }
+        except Exception as e:
+            log.error(f"Error loading global models: {e}")
+            self.create_models()
+
     def try_load(self):
+        from darts.models import RNNModel, TCNModel, TransformerModel, NBEATSModel, TiDEModel, TBATS, FFT
+
         try:
             self.models = {
                 "rnn": RNNModel.load(os.path.join(self.output_path, f"model_RNN_{self.ticker}.pt")),
@@ -50,6 +133,8 @@ class StockForecast():
             self.create_models()
 
     def create_models(self):
+        from darts.models import RNNModel, TCNModel, TransformerModel, NBEATSModel, TiDEModel, TBATS, FFT
+
         self.models = {
             "rnn": RNNModel(input_chunk_length=48, model="LSTM", dropout=0.2, n_epochs=50, random_state=0,
                 n_rnn_layers=5,
@@ -0,0 +1,205 @@
+# Description: Opt-in per-request profiles of the Dash callbacks and page layouts.
+# A profiled request runs under pyinstrument (cProfile when it is not installed) and leaves two files in
+# PROFILE_PATH: the profile, <id>.speedscope.json (open it in https://www.speedscope.app) or <id>.prof
+# (pstats, for snakeviz or flameprof), and <id>.json with the request metadata. Requests are profiled:
+#
+#   - from an allowed client (PROFILE_ALLOWED) with the X-Profile header or the profile query parameter,
+#     equal to PROFILE_TOKEN when it is set. The parameter on a page url, /stocks-risk?profile=1, sets a
+#     cookie so the callbacks and page loads are profiled for PROFILE_COOKIE_SECONDS (not the assets nor
+#     /metrics), ?profile=0 clears it.
+#   - when enabled (PROFILE_ALL or app.py --profile), a PROFILE_SAMPLE_RATE fraction of the callbacks.
+#
+# Each process profiles one request at a time and keeps the PROFILE_KEEP most recent profiles. The
+# background callbacks run in the workers of the long callback manager and are not profiled.
+import os
+import json
+import time
+import random
+import threading
+import itertools
+import logging
+from datetime import datetime
+
+from libs.config import (PROFILE_PATH, PROFILE_ALL, PROFILE_SAMPLE_RATE, PROFILE_INTERVAL, PROFILE_KEEP,
+                         PROFILE_TOKEN, PROFILE_ALLOWED, PROFILE_COOKIE_SECONDS)
+from libs.metrics import registry
+
+log = logging.getLogger()
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_PARAMETER = "profile"
+
+_profiles = registry.counter("stocks_profiles_total", "Profiled requests, by profiler")
+
+class RequestProfiler():
+    '''
+    Sampling profiler of the current thread, pyinstrument when it is installed and cProfile otherwise.
+    '''
+    def __init__(self, interval=PROFILE_INTERVAL):
+        try:
+            from pyinstrument import Profiler
+
+            self.name = "pyinstrument"
+            self.profiler = Profiler(interval=interval, async_mode="disabled")
+        except ImportError:
+            import cProfile
+
+            self.name = "cprofile"
+            self.profiler = cProfile.Profile()
+
+    def start(self):
+        if self.name == "pyinstrument":
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.name == "pyinstrument":
+            self.profiler.stop()
+        else:
+            self.profiler.disable()
+
+    def save(self, path) -> str:
+        '''
+        Write the profile to path plus the extension of the format, returns the file name.
+        '''
+        if self.name == "pyinstrument":
+            from pyinstrument.renderers import SpeedscopeRenderer
+
+            filename = f"{path}.speedscope.json"
+            with open(filename, "w") as f:
+                f.write(self.profiler.output(SpeedscopeRenderer()))
+        else:
+            filename = f"{path}.prof"
+            self.profiler.dump_stats(filename)
+        return filename
+
+class ProfileStore():
+    '''
+    Directory of the profiles, the oldest are removed beyond keep.
+    '''
+    def __init__(self, path=PROFILE_PATH, keep=PROFILE_KEEP):
+        self.path = path
+        self.keep = keep
+        self.ids = itertools.count()
+
+    def new_id(self) -> str:
+        # sortable by time, unique across the workers
+        return f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{os.getpid()}-{next(self.ids)}"
+
+    def save(self, profiler, metadata) -> str:
+        os.makedirs(self.path, exist_ok=True)
+        profile_id = self.new_id()
+        path = os.path.join(self.path, profile_id)
+        metadata = {"id": profile_id, "profiler": profiler.name, "file": os.path.basename(profiler.save(path)), **metadata}
+        with open(f"{path}.json", "w") as f:
+            json.dump(metadata, f, indent=2, default=str)
+        self.prune()
+        return profile_id
+
+    def prune(self):
+        ids = sorted({name.split(".")[0] for name in os.listdir(self.path)})
+        for profile_id in ids[:max(0, len(ids) - self.keep)]:
+            for name in os.listdir(self.path):
+                if name.split(".")[0] == profile_id:
+                    try:
+                        os.remove(os.path.join(self.path, name))
+                    except FileNotFoundError:
+                        pass  # removed by another worker
+
+def _requested_value(request):
+    return request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_PARAMETER)
+
+def _allowed(request, value) -> bool:
+    if value is None or value == "0" or request.remote_addr not in PROFILE_ALLOWED:
+        return False
+    return PROFILE_TOKEN is None or value == PROFILE_TOKEN
+
+def register_profiling(app, enabled=PROFILE_ALL, sample_rate=PROFILE_SAMPLE_RATE, store=None):
+    '''
+    Profile the Dash callbacks of the app (page layouts are rendered by a callback) on demand and, when
+    enabled, a sample_rate fraction of them.
+    '''
+    import dash
+    from flask import g, request, has_request_context
+
+    server = app.server
+    store = store or ProfileStore()
+    callback_path = f"{app.config.requests_pathname_prefix}_dash-update-component"
+    # the requests the profile cookie applies to, the cookie is sent with every request of the site
+    cookie_paths = {callback_path, f"{app.config.requests_pathname_prefix}_dash-layout"}
+    cookie_paths.update(page["relative_path"] for page in dash.page_registry.values())
+    # one profile at a time per process, a burst of requests does not multiply the overhead
+    busy = threading.Lock()
+
+    def record_page(module, layout):
+        def wrapper(*args, **kwargs):
+            # the layouts are also called outside of requests, to validate the callbacks
+            if has_request_context() and "profiler" in g:
+                g.profile_pages.append(module)
+            return layout(*args, **kwargs)
+        return wrapper
+
+    for page in dash.page_registry.values():
+        if callable(page["layout"]):
+            page["layout"] = record_page(page["module"], page["layout"])
+
+    @server.before_request
+    def _start_profile():
+        value = _requested_value(request)
+        if not value and request.path in cookie_paths:
+            value = request.cookies.get(PROFILE_PARAMETER)
+        asked = _allowed(request, value)
+        sampled = enabled and request.path == callback_path and random.random() < sample_rate
+        if not (asked or sampled) or not busy.acquire(blocking=False):
+            return
+        g.profile_started = time.perf_counter()
+        g.profile_reason = "requested" if asked else "sampled"
+        g.profile_pages = []
+        g.profiler = RequestProfiler()
+        g.profiler.start()
+
+    @server.after_request
+    def _profile_cookie(response):
+        value = request.args.get(PROFILE_PARAMETER)
+        if value == "0":
+            response.delete_cookie(PROFILE_PARAMETER)
+        elif _allowed(request, value):
+            response.set_cookie(PROFILE_PARAMETER, value, max_age=PROFILE_COOKIE_SECONDS, httponly=True, samesite="Strict")
+        if "profiler" in g:
+            g.profile_status = response.status_code
+        return response
+
+    @server.teardown_request
+    def _stop_profile(exception):
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            return
+        try:
+            profiler.stop()
+            duration = time.perf_counter() - g.pop("profile_started")
+            body = (request.get_json(silent=True) or {}) if request.path == callback_path else {}
+            profile_id = store.save(profiler, {
+                "time": datetime.now(),
+                "method": request.method,
+                "path": request.path,
+                "query": request.query_string.decode(errors="replace"),
+                "reason": g.pop("profile_reason"),
+                "output": body.get("output"),
+                # the component ids and properties only, the values may hold user data
+                "inputs": [f"{i.get('id')}.{i.get('property')}" for i in body.get("inputs", []) if isinstance(i, dict)],
+                "pages": g.pop("profile_pages"),
+                "status": g.pop("profile_status", 500),
+                "error": repr(exception) if exception is not None else None,
+                "duration": duration,
+                "pid": os.getpid(),
+            })
+            _profiles.inc(profiler=profiler.name)
+            log.info(f"Profiled {request.path} in {duration:.3f}s, profile {profile_id}")
+        except Exception as e:
+            log.error(f"Error saving the profile of {request.path}: {e}")
+        finally:
+            busy.release()
+
+    log.info(f"Profiling available with the {PROFILE_HEADER} header or ?{PROFILE_PARAMETER}= from {PROFILE_ALLOWED}"
+             f"{f', sampling {sample_rate:.1%} of the callbacks' if enabled else ''}, profiles in {store.path}")
@@ -0,0 +1,248 @@
+# Description: Market data providers used by libs.finance.
+# YFinanceProvider reads from the yfinance api, RecordingProvider saves the raw responses of another
+# provider to disk, ReplayProvider serves those recordings and SyntheticProvider generates series
+# locally, so ingest can run offline and reproducibly.
+import json
+import os
+import re
+import logging
+from datetime import datetime, timedelta
+
+import polars as pl
+
+log = logging.getLogger()
+
+class UnknownTickerError(KeyError):
+    '''
+    The provider does not know the symbol, unlike the other errors of a provider (network, rate limit).
+    '''
+
+class Provider():
+    name = "base"
+
+    def info(self, ticker) -> dict:
+        '''
+        Ticker metadata, raises UnknownTickerError if the ticker does not exist. Other exceptions are
+        transient errors of the provider.
+        '''
+        raise NotImplementedError
+
+    def history(self, ticker, period, end=None) -> pl.DataFrame:
+        '''
+        Adjusted daily bars with Date, Open, High, Low, Close, Volume, Dividends and Stock Splits,
+        only the bars before end ("%Y-%m-%d") when given.
+        '''
+        raise NotImplementedError
+
+    def download(self, ticker, start, end) -> pl.DataFrame:
+        '''
+        Unadjusted daily bars between start and end ("%Y-%m-%d").
+        '''
+        raise NotImplementedError
+
+    def intraday(self, ticker, interval, start, end) -> pl.DataFrame:
+        '''
+        Intraday bars (see libs.intraday.INTERVALS) with Datetime, Open, High, Low, Close and Volume
+        between start and end ("%Y-%m-%d"), Datetime naive in the local time of the exchange.
+        '''
+        raise NotImplementedError
+
+class YFinanceProvider(Provider):
+    name = "yfinance"
+
+    def info(self, ticker) -> dict:
+        import yfinance as yf
+
+        try:
+            info = yf.Ticker(ticker).info
+        except Exception as e:
+            # the HTTPError class depends on the yfinance version (requests or curl_cffi)
+            if getattr(getattr(e, "response", None), "status_code", None) == 404:
+                raise UnknownTickerError(ticker) from e
+            raise
+        # yfinance logs the 404 of an unknown symbol and returns the info without the quote fields
+        if not info or not any(info.get(key) for key in ("quoteType", "shortName", "longName")):
+            raise UnknownTickerError(ticker)
+        return info
+
+    def history(self, ticker, period, end=None) -> pl.DataFrame:
+        import yfinance as yf
+        from libs.finance import period_to_days
+        if end is None:
+            return pl.from_pandas(yf.Ticker(ticker).history(period=period).reset_index())
+        if period == "max":
+            return pl.from_pandas(yf.Ticker(ticker).history(period=period, end=end).reset_index())
+        start = (datetime.now() - timedelta(days=period_to_days(period))).strftime("%Y-%m-%d")
+        return pl.from_pandas(yf.Ticker(ticker).history(start=start, end=end).reset_index())
+
+    def download(self, ticker, start, end) -> pl.DataFrame:
+        import yfinance as yf
+        return pl.from_pandas(yf.download(ticker, start=start, end=end).reset_index())
+
+    def intraday(self, ticker, interval, start, end) -> pl.DataFrame:
+        import yfinance as yf
+        # yfinance serves 1m bars for the last 7 days and the other intervals for the last 60 days
+        df = pl.from_pandas(yf.Ticker(ticker).history(interval=interval, start=start, end=end).reset_index())
+        if df.is_empty():
+            return df
+        return df.with_columns(pl.col("Datetime").dt.replace_time_zone(None)).select("Datetime", "Open", "High", "Low", "Close", "Volume")
+
+def _file_name(ticker):
+    return re.sub(r"[^A-Za-z0-9_.^=-]", "_", ticker)
+
+class RecordingProvider(Provider):
+    '''
+    Forward calls to another provider and save the responses under path, merged by date,
+    one file per ticker and method.
+    '''
+    name = "record"
+
+    def __init__(self, provider, path):
+        self.provider = provider
+        self.path = path
+        for method in ["info", "history", "download", "intraday"]:
+            os.makedirs(os.path.join(path, method), exist_ok=True)
+
+    def _save(self, method, ticker, df, key="Date"):
+        filename = os.path.join(self.path, method, f"{_file_name(ticker)}.ipc")
+        if os.path.exists(filename):
+            old = pl.read_ipc(filename, memory_map=False)
+            df = pl.concat([old, df], how="diagonal_relaxed").unique(subset=key, keep="last").sort(key)
+        df.write_ipc(filename)
+
+    def info(self, ticker) -> dict:
+        info = self.provider.info(ticker)
+        with open(os.path.join(self.path, "info", f"{_file_name(ticker)}.json"), "w") as f:
+            json.dump(info, f, default=str)
+        return info
+
+    def history(self, ticker, period, end=None) -> pl.DataFrame:
+        df = self.provider.history(ticker, period, end)
+        if not df.is_empty():
+            self._save("history", ticker, df)
+        return df
+
+    def download(self, ticker, start, end) -> pl.DataFrame:
+        df = self.provider.download(ticker, start, end)
+        if not df.is_empty():
+            self._save("download", ticker, df)
+        return df
+
+    def intraday(self, ticker, interval, start, end) -> pl.DataFrame:
+        df = self.provider.intraday(ticker, interval, start, end)
+        if not df.is_empty():
+            self._save("intraday", f"{ticker}_{interval}", df, key="Datetime")
+        return df
+
+class SyntheticProvider(Provider):
+    '''
+    Deterministic random walk series for any ticker, see libs.synthetic.
+    '''
+    name = "synthetic"
+
+    def __init__(self, years=20, seed=0):
+        self.years = years
+        self.seed = seed
+
+    def _series(self, ticker) -> pl.DataFrame:
+        from libs.synthetic import synthetic_history
+        return synthetic_history(ticker, self.years, self.seed)
+
+    def info(self, ticker) -> dict:
+        return {"symbol": ticker, "shortName": ticker, "currency": "BRL"}
+
+    def history(self, ticker, period, end=None) -> pl.DataFrame:
+        from libs.finance import period_to_days
+        min_date = datetime.now() - timedelta(days=period_to_days(period))
+        max_date = datetime.strptime(end, "%Y-%m-%d") if end is not None else datetime.max
+        return self._series(ticker).filter((pl.col("Date") >= min_date) & (pl.col("Date") < max_date)).select(
+            pl.col("Date"),
+            pl.col("Adj Open").alias("Open"),
+            pl.col("Adj High").alias("High"),
+            pl.col("Adj Low").alias("Low"),
+            pl.col("Adj Close").alias("Close"),
+            pl.col("Volume"),
+            pl.col("Dividends"),
+            pl.col("Stock Splits"),
+        )
+
+    def download(self, ticker, start, end) -> pl.DataFrame:
+        return self._series(ticker).filter(
+            (pl.col("Date") >= datetime.strptime(start, "%Y-%m-%d")) & (pl.col("Date") < datetime.strptime(end, "%Y-%m-%d"))
+        ).select("Date", "Open", "High", "Low", "Close", "Adj Close", "Volume")
+
+    def intraday(self, ticker, interval, start, end) -> pl.DataFrame:
+        from libs.intraday import INTERVALS
+        from libs.synthetic import synthetic_intraday
+        # the session of every business day opens at the open of the synthetic daily bar
+        days = self._series(ticker).filter(
+            (pl.col("Date") >= datetime.strptime(start, "%Y-%m-%d")) & (pl.col("Date") < datetime.strptime(end, "%Y-%m-%d"))
+        )
+        bars = [synthetic_intraday(ticker, day, INTERVALS[interval], self.seed, open_price) for day, open_price in days.select("Date", "Open").iter_rows()]
+        return pl.concat(bars) if bars else pl.DataFrame()
+
+class ReplayProvider(Provider):
+    '''
+    Serve the responses saved by RecordingProvider. Tickers without a recording are served by
+    the fallback provider, or reported as not found when there is no fallback.
+    '''
+    name = "replay"
+
+    def __init__(self, path, fallback=None):
+        self.path = path
+        self.fallback = fallback
+
+    def _load(self, method, ticker):
+        filename = os.path.join(self.path, method, f"{_file_name(ticker)}.ipc")
+        if not os.path.exists(filename):
+            return None
+        return pl.read_ipc(filename, memory_map=False)
+
+    def info(self, ticker) -> dict:
+        filename = os.path.join(self.path, "info", f"{_file_name(ticker)}.json")
+        if os.path.exists(filename):
+            with open(filename) as f:
+                return json.load(f)
+        if self.fallback is not None:
+            return self.fallback.info(ticker)
+        raise UnknownTickerError(f"No recording for {ticker} in {self.path}")
+
+    def history(self, ticker, period, end=None) -> pl.DataFrame:
+        from libs.finance import period_to_days
+        df = self._load("history", ticker)
+        if df is None:
+            return self.fallback.history(ticker, period, end) if self.fallback is not None else pl.DataFrame()
+        min_date = datetime.now() - timedelta(days=period_to_days(period))
+        max_date = datetime.strptime(end, "%Y-%m-%d") if end is not None else datetime.max
+        return df.filter(pl.col("Date").dt.replace_time_zone(None).is_between(min_date, max_date, closed="left"))
+
+    def download(self, ticker, start, end) -> pl.DataFrame:
+        df = self._load("download", ticker)
+        if df is None:
+            return self.fallback.download(ticker, start, end) if self.fallback is not None else pl.DataFrame()
+        return df.filter(
+            (pl.col("Date").dt.replace_time_zone(None) >= datetime.strptime(start, "%Y-%m-%d")) &
+            (pl.col("Date").dt.replace_time_zone(None) < datetime.strptime(end, "%Y-%m-%d"))
+        )
+
+    def intraday(self, ticker, interval, start, end) -> pl.DataFrame:
+        df = self._load("intraday", f"{ticker}_{interval}")
+        if df is None:
+            return self.fallback.intraday(ticker, interval, start, end) if self.fallback is not None else pl.DataFrame()
+        return df.filter(
+            (pl.col("Datetime") >= datetime.strptime(start, "%Y-%m-%d")) &
+            (pl.col("Datetime") < datetime.strptime(end, "%Y-%m-%d"))
+        )
+
+PROVIDERS = ["yfinance", "record", "replay", "synthetic"]
+
+def build_provider(name, path="fixtures") -> Provider:
+    if name == "yfinance":
+        return YFinanceProvider()
+    elif name == "record":
+        return RecordingProvider(YFinanceProvider(), path)
+    elif name == "replay":
+        return ReplayProvider(path, fallback=SyntheticProvider())
+    elif name == "synthetic":
+        return SyntheticProvider()
+    raise ValueError(f"Unknown provider {name}, use one of {PROVIDERS}")
@@ -0,0 +1,167 @@
+# Description: Portifolio risk engine.
+# The daily returns of all portifolio tickers are aligned in one matrix built from a single scan of
+# the database, covariance, correlation, volatility, beta and the historical and Monte Carlo
+# value at risk are computed from it with numpy. Monte Carlo scenarios are simulated in chunks,
+# so memory depends on the chunk size and not on the number of scenarios.
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+import polars as pl
+
+from libs.finance import period_to_days
+from libs.metrics import timer
+
+log = logging.getLogger()
+
+TRADING_DAYS = 252
+
+# float64 values per Monte Carlo chunk (~32 MiB)
+CHUNK_SIZE = 4_000_000
+
+def return_matrix(stocks, tickers, start) -> tuple:
+    '''
+    Aligned daily returns since start, returns (dates, tickers, returns, last prices) where returns
+    has one row per date and one column per ticker. Prices are forward filled, days before a ticker
+    starts trading have return 0. Tickers without history are dropped.
+    '''
+    prices = stocks.scan(["Ticker", "Date", "Close"], tickers, start).collect()
+    if prices.is_empty():
+        return pl.Series("Date", [], pl.Date), [], np.empty((0, 0)), ()
+    prices = prices.with_columns(pl.col("Ticker").cast(pl.Utf8)).pivot(on="Ticker", index="Date", values="Close").sort("Date")
+    tickers = [ticker for ticker in tickers if ticker in prices.columns]
+    prices = prices.select(pl.col("Date"), pl.col(tickers).forward_fill())
+    returns = prices.select(
+        pl.col("Date"),
+        pl.col(tickers).pct_change().fill_nan(None).fill_null(0)
+    ).slice(1)
+    return returns["Date"], tickers, returns.select(tickers).to_numpy(), prices.select(tickers).row(-1)
+
+def covariance(returns) -> np.ndarray:
+    return np.atleast_2d(np.cov(returns, rowvar=False))
+
+def correlation(cov) -> np.ndarray:
+    std = np.sqrt(np.diag(cov))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = cov / np.outer(std, std)
+    return np.nan_to_num(corr)
+
+def beta(returns, market) -> np.ndarray:
+    '''
+    Beta of every column of returns against the market returns.
+    '''
+    market = market - market.mean()
+    variance = market @ market
+    if variance == 0:
+        return np.full(returns.shape[1], np.nan)
+    return (returns - returns.mean(axis=0)).T @ market / variance
+
+def var_cvar(pnl, confidence) -> tuple:
+    '''
+    Value at risk and conditional value at risk of the returns in pnl, as positive losses, NaN when
+    pnl is empty (a history shorter than the horizon).
+    '''
+    if pnl.size == 0:
+        return np.nan, np.nan
+    var = -np.quantile(pnl, 1 - confidence)
+    tail = pnl[pnl <= -var]
+    return var, -tail.mean() if tail.size > 0 else var
+
+def historical_returns(portifolio_returns, horizon) -> np.ndarray:
+    # overlapping horizon-day returns of the portifolio rebalanced daily
+    growth = np.concatenate([[0.0], np.cumsum(np.log1p(portifolio_returns))])
+    return np.expm1(growth[horizon:] - growth[:-horizon])
+
+def _cholesky(cov) -> np.ndarray:
+    # short or collinear histories make the covariance only semi-definite, clip its eigenvalues instead
+    try:
+        return np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        values, vectors = np.linalg.eigh(cov)
+        return vectors * np.sqrt(np.clip(values, 0, None))
+
+def monte_carlo_returns(mean, cov, weights, horizon, scenarios, seed=0, progress=None) -> np.ndarray:
+    '''
+    Portifolio returns over horizon days of scenarios simulated from a multivariate normal of the
+    daily log returns (mean, cov). The sum of horizon daily draws is drawn at once, so the cost does
+    not depend on the horizon.
+    '''
+    rng = np.random.default_rng(seed)
+    factor = _cholesky(cov) * np.sqrt(horizon)
+    chunk = max(1, CHUNK_SIZE // len(mean))
+    result = np.empty(scenarios)
+    for first in range(0, scenarios, chunk):
+        n = min(chunk, scenarios - first)
+        log_returns = rng.standard_normal((n, len(mean))) @ factor.T
+        log_returns += mean * horizon
+        result[first:first + n] = np.expm1(log_returns) @ weights
+        if progress is not None:
+            progress(first + n, scenarios)
+    return result
+
+def portifolio_risk(stocks, confidence=0.95, horizon=1, scenarios=100000, lookback="2y", benchmark=None, seed=0, progress=None) -> dict:
+    '''
+    Risk metrics of the current portifolio, weighted by the market value of each holding.
+    Returns the per ticker weights, volatility and beta, the correlation matrix and the portifolio
+    volatility, historical and Monte Carlo VaR and CVaR over horizon days.
+    '''
+    portifolio = stocks.get_portifolio()
+    if portifolio.is_empty():
+        return {}
+    holdings = portifolio.group_by("Ticker", maintain_order=True).agg(pl.sum("Number of Stocks"))
+    tickers = holdings["Ticker"].to_list()
+
+    # the benchmark is only read for the betas, unless it is also a holding
+    extra = [benchmark] if benchmark is not None and benchmark not in tickers else []
+    for ticker in tickers + extra:
+        stocks.ensure_history(ticker, lookback)
+    start = datetime.now() - timedelta(days=period_to_days(lookback))
+
+    with timer("risk_engine", stage="returns"):
+        dates, tickers, returns, last_prices = return_matrix(stocks, tickers + extra, start)
+        market = returns[:, tickers.index(benchmark)] if benchmark in tickers else None
+        if extra and benchmark in tickers:
+            last_prices = np.delete(last_prices, tickers.index(benchmark))
+            returns = np.delete(returns, tickers.index(benchmark), axis=1)
+            tickers.remove(benchmark)
+    if len(tickers) == 0 or len(returns) < 2:
+        return {}
+
+    shares = dict(holdings.iter_rows())
+    value = np.array([shares[ticker] for ticker in tickers]) * np.array(last_prices)
+    weights = value / value.sum()
+
+    with timer("risk_engine", stage="covariance"):
+        cov = covariance(returns)
+        corr = correlation(cov)
+        portifolio_returns = returns @ weights
+        betas = beta(returns, market if market is not None else portifolio_returns)
+
+    with timer("risk_engine", stage="historical"):
+        var_historical, cvar_historical = var_cvar(historical_returns(portifolio_returns, horizon), confidence)
+
+    with timer("risk_engine", stage="monte_carlo"):
+        log_returns = np.log1p(returns)
+        simulated = monte_carlo_returns(log_returns.mean(axis=0), covariance(log_returns), weights, horizon, scenarios, seed, progress)
+        var_monte_carlo, cvar_monte_carlo = var_cvar(simulated, confidence)
+    log.info(f"Risk of {len(tickers)} stocks over {len(returns)} days with {scenarios} scenarios")
+
+    return {
+        "Tickers": tickers,
+        "Weights": weights.tolist(),
+        "Volatility": (np.sqrt(np.diag(cov)) * np.sqrt(TRADING_DAYS)).tolist(),
+        "Beta": betas.tolist(),
+        "Beta Reference": benchmark if market is not None else "portifolio",
+        "Correlation": corr.tolist(),
+        "Value": float(value.sum()),
+        "Portifolio Volatility": float(np.sqrt(weights @ cov @ weights) * np.sqrt(TRADING_DAYS)),
+        "Confidence": confidence,
+        "Horizon": horizon,
+        "Scenarios": scenarios,
+        "Start Date": dates[0],
+        "End Date": dates[-1],
+        "VaR Historical": float(var_historical),
+        "CVaR Historical": float(cvar_historical),
+        "VaR Monte Carlo": float(var_monte_carlo),
+        "CVaR Monte Carlo": float(cvar_monte_carlo),
+    }
@@ -0,0 +1,108 @@
+# Description: Scheduled data refresh after the B3 close.
+# Runs as a daemon thread inside the Dash server (app.py --scheduler) or as its own process:
+#
+#   $ python -m libs.scheduler --db-path stocks.db
+#
+# Every worker may run a scheduler, the ingest_runs table makes sure only one refresh
+# runs per trading day and keeps the run history.
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import threading
+import logging
+from datetime import datetime, timedelta
+
+from libs.db import DB
+from libs.finance import set_provider
+from libs.providers import PROVIDERS, build_provider
+from libs.market_calendar import B3_TIMEZONE, last_closed_trading_day, next_close
+
+log = logging.getLogger()
+
+class IngestScheduler():
+    def __init__(self, db_path, delay=timedelta(minutes=30), stale_after=timedelta(hours=2), retry_interval=timedelta(minutes=15)):
+        self.db_path = db_path
+        self.delay = delay
+        self.stale_after = stale_after
+        self.retry_interval = retry_interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def run_once(self, now=None) -> bool:
+        '''
+        Refresh every stock if the last closed trading day was not ingested yet.
+        Returns False when there was nothing to do or another worker holds the run.
+        '''
+        from libs.stocks import Stocks
+        from libs.precompute import warm_up
+
+        trading_date = last_closed_trading_day(now, self.delay).strftime("%Y-%m-%d")
+        stocks = Stocks(DB(self.db_path))
+        try:
+            run_id = stocks.db.start_ingest_run(trading_date, self.stale_after.total_seconds())
+            if run_id is None:
+                log.info(f"Ingest for {trading_date} already done or running")
+                return False
+
+            tickers = 0
+            try:
+                for tickers, _ in stocks.refresh_stocks():
+                    pass
+            except Exception as e:
+                log.error(f"Ingest run {run_id} failed: {e}")
+                stocks.db.finish_ingest_run(run_id, "failed", tickers, str(e))
+                raise
+            stocks.db.finish_ingest_run(run_id, "success", tickers)
+            stocks.catalog.refresh()
+        finally:
+            stocks.db.close()
+
+        warm_up(self.db_path)
+        return True
+
+    def run_forever(self):
+        log.info("Start ingest scheduler")
+        while not self.stop_event.is_set():
+            now = datetime.now(B3_TIMEZONE)
+            try:
+                self.run_once(now)
+                wake_up = next_close(now, self.delay)
+            except Exception as e:
+                log.error(f"Ingest scheduler error: {e}")
+                wake_up = now + self.retry_interval
+            log.info(f"Next ingest at {wake_up}")
+            self.stop_event.wait(max((wake_up - datetime.now(B3_TIMEZONE)).total_seconds(), 0))
+
+    def start(self) -> threading.Thread:
+        self.thread = threading.Thread(target=self.run_forever, name="ingest-scheduler", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stocks ingest scheduler")
+    parser.add_argument("--log-path", type=str, default="stocks.log", help="Path to log file")
+    parser.add_argument("--db-path", type=str, default="stocks.db", help="Path to database file")
+    parser.add_argument("--provider", type=str, default="yfinance", choices=PROVIDERS, help="Market data provider")
+    parser.add_argument("--provider-path", type=str, default="fixtures", help="Directory of the recorded provider responses")
+    parser.add_argument("--once", action="store_true", help="Run the last trading day refresh and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        filename=args.log_path,
+        format='%(asctime)s - %(filename)s - %(funcName)s - %(lineno)d - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    set_provider(build_provider(args.provider, args.provider_path))
+    scheduler = IngestScheduler(args.db_path)
+    if args.once:
+        scheduler.run_once()
+    else:
+        scheduler.run_forever()
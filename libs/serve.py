@@ -0,0 +1,98 @@
+# Description: Production serving of the Dash server with several worker processes.
+# gunicorn loads the app once in the master (preload) and forks the workers. Each worker reopens the
+# shared disk cache after the fork and warms the page data in a background thread: the warm up of a cold
+# cache can outlast the worker timeout, which would kill the worker before its first heartbeat. gunicorn
+# does not run on Windows, there the app is served by waitress threads in a single process.
+#
+#   $ python app.py --production --workers 4
+import os
+import sys
+import threading
+import logging
+
+log = logging.getLogger()
+
+def default_workers() -> int:
+    return min(2 * (os.cpu_count() or 1) + 1, 8)
+
+def warm_up_worker(db_path):
+    '''
+    Load the hot data of the pages in this process: the ticker list, the latest statistics of every
+    stock and the portifolio valuation. The results computed by another worker are read from the
+    shared cache, the page layouts are rendered once so their imports and queries are warm.
+    '''
+    import dash
+    from libs.precompute import warm_up
+
+    warm_up(db_path)
+    for page in dash.page_registry.values():
+        if callable(page["layout"]):
+            try:
+                page["layout"]()
+            except Exception as e:
+                log.error(f"Error warming up layout {page['module']}: {e}")
+    log.info(f"Worker {os.getpid()} warmed up")
+
+def warm_up_worker_async(db_path) -> threading.Thread:
+    thread = threading.Thread(target=warm_up_worker, args=(db_path,), name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def _start_scheduler(args):
+    if args.scheduler:
+        from libs.scheduler import IngestScheduler
+        # every worker runs a scheduler, the ingest_runs table lets only one of them refresh per day
+        IngestScheduler(args.db_path).start()
+
+def serve_gunicorn(server, args):
+    from gunicorn.app.base import BaseApplication
+
+    def post_fork(arbiter, worker):
+        # the cache connections opened by the master must not be shared with the workers
+        from libs.cache import cache
+        cache.close()
+
+    def post_worker_init(worker):
+        from libs.metrics import publish_worker_metrics
+
+        # the requests are spread over the workers, /metrics sums the registries of all of them
+        publish_worker_metrics()
+        # the worker answers requests (and heartbeats) while it warms up, the first ones may be slower
+        warm_up_worker_async(args.db_path)
+        _start_scheduler(args)
+
+    options = {
+        "bind": f"{args.addr}:{args.port}",
+        "workers": args.workers,
+        "threads": args.threads,
+        "preload_app": True,
+        "timeout": 120,
+        "post_fork": post_fork,
+        "post_worker_init": post_worker_init,
+        "accesslog": "-",
+    }
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return server
+
+    log.info(f"Serve with gunicorn, {args.workers} workers x {args.threads} threads on {options['bind']}")
+    Application().run()
+
+def serve_waitress(server, args):
+    import waitress
+
+    warm_up_worker(args.db_path)
+    _start_scheduler(args)
+    log.info(f"Serve with waitress, {args.threads} threads on {args.addr}:{args.port}")
+    waitress.serve(server, host=args.addr, port=args.port, threads=args.threads)
+
+def serve(server, args):
+    if sys.platform == "win32":
+        serve_waitress(server, args)
+    else:
+        serve_gunicorn(server, args)
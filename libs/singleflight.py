@@ -0,0 +1,82 @@
+# Description: Coalescing of concurrent calls with the same key (single flight).
+# The first caller of a key runs the call, the callers arriving while it runs wait for it and share its
+# result. Across processes (gunicorn workers) the call also holds a diskcache lock on the key, the worker
+# waiting on the lock checks again with needed() before running the call, since the other worker may
+# have done the work in the meantime.
+#
+#   flight = SingleFlight(cache)
+#   flight.do(("PETR4.SA", "max"), download, "PETR4.SA", "max", needed=lambda: not stored("PETR4.SA"))
+import threading
+import logging
+
+import diskcache
+
+from libs.metrics import registry
+
+log = logging.getLogger()
+
+# a worker killed while holding the lock releases it after this many seconds
+LOCK_EXPIRE = 300
+
+_calls = registry.counter("stocks_singleflight_total", "Coalesced calls, by the role of the caller (leader, shared, skipped)")
+
+class _Call():
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight():
+    def __init__(self, cache=None, name="singleflight", expire=LOCK_EXPIRE):
+        self.cache = cache
+        self.name = name
+        self.expire = expire
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def _key(self, key) -> str:
+        key = key if isinstance(key, tuple) else (key,)
+        return ":".join([self.name, *[str(k) for k in key]])
+
+    def do(self, key, fn, *args, needed=None, **kwargs):
+        '''
+        Run fn(*args, **kwargs) once for all the concurrent callers of key and return its result (an
+        exception is raised to all of them). needed, when given, is called with the lock of the key held
+        and fn is skipped (None returned) when it returns False.
+        '''
+        key = self._key(key)
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+
+        if not leader:
+            _calls.inc(name=self.name, role="shared")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            lock = diskcache.Lock(self.cache, key, expire=self.expire) if self.cache is not None else None
+            if lock is not None:
+                lock.acquire()
+            try:
+                if needed is not None and not needed():
+                    _calls.inc(name=self.name, role="skipped")
+                    log.info(f"Skip {key}, done by another worker")
+                else:
+                    _calls.inc(name=self.name, role="leader")
+                    call.result = fn(*args, **kwargs)
+            finally:
+                if lock is not None:
+                    lock.release()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
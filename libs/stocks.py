@@ -1,33 +1,83 @@
 # Description: This file contains the Stocks class which is used to interact with the database to get stock data.
 from datetime import datetime, timedelta
-from libs.finance import get_historical_data, period_to_days, days_to_period
+from libs.finance import get_historical_data, get_provider, period_to_days, days_to_period, days_to_min_period
 from libs.price_prediction import StockForecast
+from libs.config import OUTPUT_PATH, BENCHMARK_TICKER, INTRADAY_PATH, WINDOW_INDEX_TICKERS
+from libs.cache import cache, bump_generation
+from libs.ingest import IngestPipeline, prepare_stock_data, download_info
+from libs.risk import portifolio_risk
+from libs.intraday import IntradayStore, INTERVAL_HISTORY_DAYS
+from libs.catalog import TickerCatalog
+from libs.market_calendar import is_trading_day, last_closed_trading_day
+from libs.singleflight import SingleFlight
+from libs.window_index import WindowIndex, WindowIndexCache, WINDOW_COLUMNS
 import polars as pl
+import numpy as np
 import logging
 
 log = logging.getLogger()
 
+# columns of the bars returned by get_bars
+BAR_COLUMNS = ["Ticker", "Date", "Open", "High", "Low", "Close", "Adj Open", "Adj High", "Adj Low", "Adj Close", "Dividends", "Volume"]
+
+# calendar buckets of get_breakdown and their polars interval
+BREAKDOWN_GRANULARITIES = {"month": "1mo", "quarter": "3mo", "year": "1y"}
+
+# window indexes of the tickers read by the process, see get_window_statistics
+_window_indexes = WindowIndexCache(WINDOW_INDEX_TICKERS)
+
+# concurrent downloads of the same ticker and period, in the process and across workers, run once
+_history_flight = SingleFlight(cache, name="history")
+
+def _covers(coverage, start) -> bool:
+    if coverage is None:
+        return False
+    return coverage["Full History"] or coverage["Start"] <= start.date()
+
 class Stocks():
-    def __init__(self, db, output_path):
+    def __init__(self, db, output_path=OUTPUT_PATH, intraday_path=INTRADAY_PATH):
         self.db = db
         self.db.create_tables()
-        self.all_stocks = None
         self.forecast = StockForecast(output_path)
+        self.intraday = IntradayStore(intraday_path)
+        self.catalog = TickerCatalog(db)
 
     def add_stocks(self, ticker):
         log.info(f"Add {ticker} to database")
+        if not self.catalog.is_valid(ticker):
+            return
         _ = self.get_data_from_api(ticker, 'max')
 
+    def get_catalog(self) -> pl.DataFrame:
+        '''
+        Symbol, name, currency, sector, first and last stored date and validation status of the stored tickers.
+        '''
+        return self.db.get_catalog().filter(pl.col("Ticker") != BENCHMARK_TICKER)
+
     def list_stocks(self) -> list:
-        stocks = self.db.get_stocks_ticker()
+        # the benchmark is stored for the betas of the risk page, refresh_stocks keeps it current
+        stocks = [row for row in self.db.get_stocks_ticker() if row[0] != BENCHMARK_TICKER]
         log.info(f"List all stocks in database: {stocks}")
         return stocks
     
     def update_stocks(self):
-        stocks = self.list_stocks()
-        for i, stock in enumerate(stocks):
-            _ = self.get_data_from_api(stock, 'max')
-            yield i+1, len(stocks)
+        jobs = [(stock, 'max', True) for (stock,) in self.list_stocks()]
+        yield from IngestPipeline(self.db).run(jobs)
+
+    def refresh_stocks(self):
+        '''
+        Incremental update, download only the period since the last date stored for each stock and
+        for the benchmark when the risk page stored it.
+        '''
+        jobs = []
+        benchmark = [(BENCHMARK_TICKER,)] if self.db.get_coverage(BENCHMARK_TICKER, cached=False) is not None else []
+        for (stock,) in self.list_stocks() + benchmark:
+            coverage = self.db.get_coverage(stock, cached=False)
+            full_history = coverage["Full History"]
+            period = days_to_min_period((datetime.now().date() - coverage["End"]).days + 1)
+            log.info(f"Refresh {stock} with period {period}")
+            jobs.append((stock, period, full_history))
+        yield from IngestPipeline(self.db).run(jobs)
 
     def get_stocks(self, ticker, period=0) -> pl.DataFrame:
         if isinstance(ticker, list) or isinstance(ticker, tuple):
@@ -39,6 +89,7 @@ class Stocks():
     def insert_portifolio(self, ticker, number_of_stocks, price_at_buy, date) -> None:
         log.info(f"Add {ticker} to portifolio")
         self.db.insert_portifolio(ticker, number_of_stocks, price_at_buy, date)
+        bump_generation()
     
     def get_portifolio(self) -> pl.DataFrame:
         log.info(f"Get portifolio")
@@ -47,62 +98,150 @@ class Stocks():
     def delete_stock_from_portifolio(self, ticker) -> None:
         log.info(f"Delete {ticker} from portifolio")
         self.db.delete_from_portifolio(ticker)
+        bump_generation()
 
-    def get_stock(self, ticker, period=0, search_api=True) -> pl.DataFrame:
-        log.info(f"Get stock {ticker} for period {period}")
-        min_date, _ = self.db.get_min_max_date(ticker)
+    def ensure_history(self, ticker, period=0, search_api=True) -> datetime:
+        '''
+        Download the history of ticker missing in the database for period and return the first date of the period.
+        '''
         min_period_date = datetime.now() - timedelta(days=period_to_days(period)) 
-        
-        download_info = self.db.get_stock_download_info(ticker)
+        self.ensure_coverage(ticker, min_period_date, period, search_api)
+        return min_period_date
+
+    def ensure_coverage(self, ticker, start, period='max', search_api=True):
+        '''
+        Download the history of ticker since start when it is not covered by the database, only the
+        head missing before the stored history when the ticker is already stored. period is the
+        provider period that reaches start.
+        '''
+        # the coverage of the process answers without a query, read it again before downloading
+        if _covers(self.db.get_coverage(ticker), start) or _covers(self.db.get_coverage(ticker, cached=False), start):
+            return
 
-        if download_info is None or download_info.is_empty():
+        if self.db.get_coverage(ticker) is None:
+            # unknown symbols are remembered by the catalog, the provider is not asked again before the ttl
+            if not self.catalog.is_valid(ticker):
+                return
             log.info(f"Stock {ticker} not found in database, fetch data from yfinance api")
-            return self.get_data_from_api(ticker, period)        
-        
-        if (min_date is None or min_period_date < min_date) and download_info.select("Download All Period").item() == "NO":
-            if search_api:
-                log.info(f"Stock {ticker} no found in database, fetch data from yfinance api")
-                self.get_data_from_api(ticker, period)
-            else:
-                log.info(f"Stock {ticker} not found in database,  search in API is disable, return database values")
+        elif search_api:
+            log.info(f"Stock {ticker} history before {self.db.get_coverage(ticker)['Start']} not found in database, fetch data from yfinance api")
+        else:
+            log.info(f"Stock {ticker} not found in database,  search in API is disable, return database values")
+            return
+
+        self._fetch_history(ticker, period, start)
 
+    def _fetch_history(self, ticker, period, start) -> pl.DataFrame:
+        '''
+        Download the history of ticker since start missing in the database, coalesced by (ticker, period):
+        the requests arriving while a download runs wait for it and a worker that waited on another one
+        downloads only what is still missing.
+        '''
+        def backfill():
+            coverage = self.db.get_coverage(ticker)
+            end = coverage["Start"].strftime("%Y-%m-%d") if coverage is not None else None
+            return self.get_data_from_api(ticker, period, end=end)
+
+        return _history_flight.do((ticker, period), backfill, needed=lambda: not _covers(self.db.get_coverage(ticker, cached=False), start))
+
+    def get_stock(self, ticker, period=0, search_api=True) -> pl.DataFrame:
+        log.info(f"Get stock {ticker} for period {period}")
+        min_period_date = self.ensure_history(ticker, period, search_api)
         return self.db.get_stock(ticker, min_period_date.strftime("%Y-%m-%d"))
+
+    def get_bars(self, ticker, period=0, granularity="1d") -> pl.DataFrame:
+        '''
+        OHLC bars of ticker for period, daily rows for "1d" and the weekly, monthly or yearly rollups for
+        "1w", "1mo" and "1y". The first bucket, cut by the start of the period, is aggregated from the
+        daily rows, the others are read from the rollups. Rows are labeled by the first day of the bucket.
+        '''
+        start = self.ensure_history(ticker, period)
+        if granularity == "1d":
+            return self.db.get_stock(ticker, start.strftime("%Y-%m-%d")).select(BAR_COLUMNS)
+        return self.db.get_rollups(ticker, granularity, start).select(BAR_COLUMNS)
+
+    def scan(self, columns=None, tickers=None, start=None, end=None) -> pl.LazyFrame:
+        '''
+        LazyFrame over the stored price history of tickers (a ticker or a list, all when None) between
+        start and end (end excluded). The filters and the columns used by the query are pushed down to the
+        database read, the history is not downloaded, see ensure_history.
+        '''
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        lf = self.db.scan_stocks(tickers, start, end)
+        if columns is not None:
+            lf = lf.select(columns)
+        return lf
     
+    def get_intraday(self, ticker, interval="5m", start=None, end=None, every=None, search_api=True) -> pl.DataFrame:
+        '''
+        Intraday bars of ticker between the days start and end (end excluded, the last closed session
+        when start is None, today when end is None), resampled to every when given. The closed trading
+        days of the range missing in the store are downloaded first when search_api is set.
+        '''
+        start, end = [datetime.strptime(str(day)[:10], "%Y-%m-%d").date() if day is not None else None for day in (start, end)]
+        start = start or last_closed_trading_day()
+        end = end or max(start, datetime.now().date()) + timedelta(days=1)
+        if search_api:
+            self.ensure_intraday(ticker, interval, start, end)
+        return self.intraday.read(ticker, interval, start, end, every)
+
+    def ensure_intraday(self, ticker, interval, start, end):
+        # the days the provider does not serve anymore would be missing, and asked for, on every read
+        start = max(start, datetime.now().date() - timedelta(days=INTERVAL_HISTORY_DAYS.get(interval, 60) - 1))
+        stored = set(self.intraday.days(ticker, interval, start, end - timedelta(days=1)))
+        last_day = min(end - timedelta(days=1), last_closed_trading_day())
+        trading_days = [day for day in pl.date_range(start, last_day, eager=True).to_list() if is_trading_day(day)] if start <= last_day else []
+        # consecutive trading days not stored, each run is one download
+        runs = []
+        for i, day in enumerate(trading_days):
+            if day.strftime("%Y-%m-%d") in stored:
+                continue
+            if runs and runs[-1][-1] == trading_days[i - 1]:
+                runs[-1].append(day)
+            else:
+                runs.append([day])
+        for run in runs:
+            log.info(f"Download {len(run)} days of {interval} bars of {ticker} from {run[0]}")
+            self.intraday.ingest(get_provider(), ticker, interval, run[0].strftime("%Y-%m-%d"), (run[-1] + timedelta(days=1)).strftime("%Y-%m-%d"),
+                                 [day.strftime("%Y-%m-%d") for day in run])
+
     def get_all_stocks(self) -> pl.DataFrame:
         return self.db.get_all_stocks()
     
     def get_stocks_by_timerange(self, ticker: str, min_date: datetime, max_date: datetime) -> pl.DataFrame:
         log.info(f"Get stock {ticker} for period {min_date} -> {max_date}")
-        min_date_db, _ = self.db.get_min_max_date(ticker)
-        if min_date_db is None or min_date_db > min_date:
-            log.info(f"Stock {ticker} no found in database, fetch data from yfinance api")
-            _ = self.get_data_from_api(ticker, period='max')
+        self.ensure_coverage(ticker, min_date)
         
         return self.db.get_stocks_by_timerange(ticker, min_date.strftime('%Y-%m-%d'), max_date.strftime('%Y-%m-%d'))
 
-    def get_data_from_api(self, ticker: str, period: str, insert_db=True) -> pl.DataFrame:
-        data = get_historical_data(ticker, period)
+    def get_data_from_api(self, ticker: str, period: str, insert_db=True, full_history=False, end=None) -> pl.DataFrame:
+        '''
+        Download period of ticker, only the days before end ("%Y-%m-%d") when given, and store it.
+        '''
+        data = get_historical_data(ticker, period, end)
+        # the first day asked to the provider, the history is covered from there even when the ticker starts later
+        covered_from = datetime.now() - timedelta(days=period_to_days(period))
         if data is not None and not data.is_empty():
-            df = data.with_columns(
-                pl.lit(ticker).alias("Ticker")
-            ).with_columns(
-                pl.col("Date").dt.strftime("%Y-%m-%d %H:%M:%S")
-            ).select(["Ticker", "Open", "Close", "High", "Low", "Adj Open", "Adj Close", "Adj High", "Adj Low", "Dividends", "Volume", "Stock Splits", "Date"]).fill_null(0)
+            df = prepare_stock_data(ticker, data)
             if insert_db:
-                data = df.to_numpy()
-                self.db.bulk_insert(data.tolist())
-                self.db.insert_stock_download_info(
-                    ticker, 
-                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "YES" if period == "max" else "NO"
-                )
+                self.db.bulk_write(df.rows(), [download_info(ticker, period, full_history)], [(ticker, covered_from)])
+                bump_generation()
             return df
+        elif end is not None:
+            # nothing before the stored history, do not ask again
+            if insert_db:
+                self.db.set_coverage(ticker, covered_from, period == "max" or full_history)
+            return None
         else:
             log.warn(f"Stock {ticker} not found, database doens't contains this stock or yfinance api can not find this ticker")
             return None
 
-    def _get_statistics(self, data) -> dict:
+    def _get_statistics(self, data, dividends=None) -> dict:
+        '''
+        Statistics of the daily rows of data, dividends is the sum of the dividends of the rows, read from
+        the corporate events by the callers (the Dividends column of data when None).
+        '''
         if data.is_empty() or data is None:
             return {
                 "Start_date": 0,
@@ -118,7 +257,9 @@ class Stocks():
             }        
 
         close = data.select(pl.last("Close")).item()
-        dividend_yield = data.select('Dividends').sum().item() / data.select('Close').mean().item()
+        if dividends is None:
+            dividends = data.select('Dividends').sum().item()
+        dividend_yield = dividends / data.select('Close').mean().item()
         if close != 0:
             price_variation = ((close - data.select(pl.first("Close")).item()) / close )* 100
         else: 
@@ -126,7 +267,7 @@ class Stocks():
         return {
             "Start_date": data.select(pl.first("Date")).item(),
             "End_date": data.select(pl.last("Date")).item(),
-            "Dividends": data.select('Dividends').sum().item(),
+            "Dividends": dividends,
             "Volume": data.select('Volume').mean().item(),
             "High": data.select('High').max().item(),
             "Low": data.select('Low').min().item(),
@@ -136,14 +277,32 @@ class Stocks():
             "Price_variation": price_variation
         }
 
+    def window_index(self, ticker) -> WindowIndex:
+        '''
+        Window index of the stored history of ticker, built on the first use in the process and extended
+        with the rows of each later insert.
+        '''
+        revision, changed_from = self.db.get_ticker_revision(ticker)
+
+        def read(since):
+            return self.scan(WINDOW_COLUMNS, ticker, since).collect(), self.get_dividends(ticker, since)
+
+        return _window_indexes.get((self.db.filename, ticker), revision, changed_from, read)
+
+    def get_window_statistics(self, ticker, start=None, end=None) -> dict:
+        '''
+        Statistics of _get_statistics of the stored rows of ticker between start and end (end excluded),
+        answered by the window index without reading the rows.
+        '''
+        return self.window_index(ticker).statistics(start, end) or self._get_statistics(pl.DataFrame())
+
     def get_statistics_all_periods(self, ticker,  periods=["3mo", "6mo", "1y", "2y", "5y"], return_dict=False) -> pl.DataFrame:
         statistics = []
-        if self.all_stocks is None:
-            self.all_stocks = self.get_all_stocks()
+        index = self.window_index(ticker)
         for period in periods:
             min_period_date = datetime.now() - timedelta(days=period_to_days(period)) 
-            df = self.all_stocks.filter((pl.col("Date") > min_period_date) & (pl.col('Ticker') == ticker))
-            stats = self._get_statistics(df)
+            # the rows after the day of min_period_date
+            stats = index.statistics(min_period_date + timedelta(days=1)) or self._get_statistics(pl.DataFrame())
             stats['Period'] = period
             statistics.append(stats)
 
@@ -152,27 +311,57 @@ class Stocks():
         return pl.from_dicts(statistics)
 
     def get_statistics_by_period(self, ticker, period) -> pl.DataFrame:
-        data = self.get_stock(ticker, period)
-        return self._get_statistics(data)
+        start = self.ensure_history(ticker, period)
+        return self.get_window_statistics(ticker, start)
     
-    def get_statistics_by_year(self, ticker):
-        end_date = datetime.now().replace(month=12, day=31, hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
-        start_time = end_date - timedelta(days=365*6)
-        time_range = pl.date_range(start=start_time, end=end_date, freq='1y', eager=True).to_numpy('datetime64[ns]').tolist()
-        statistics = []
+    def get_breakdown(self, tickers, granularity="year", start=None, end=None) -> pl.DataFrame:
+        '''
+        Statistics of _get_statistics for each ticker (a ticker or a list) and calendar bucket, "month",
+        "quarter" or "year", between start and end (end excluded, the stored history when None). Returns a
+        tidy frame with Ticker, Date, the first day of the bucket, and the statistics, ordered by ticker
+        and date. The monthly rollups of all the tickers are read in one query and aggregated to quarters
+        and years with group_by_dynamic, the first month is cut by start.
+        '''
+        every = BREAKDOWN_GRANULARITIES.get(granularity, granularity)
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        if start is not None:
+            for ticker in tickers:
+                self.ensure_coverage(ticker, start)
 
-        for start, end in zip(time_range, time_range[1:]):
-            data = self.get_stocks_by_timerange(ticker, start, end)
-            statistics.append(self._get_statistics(data))
+        months = self.db.get_rollups(tickers, "1mo", start, end).lazy()
+        if every != "1mo":
+            months = months.group_by_dynamic("Date", every=every, group_by="Ticker", label="left").agg(
+                pl.min("First Date"), pl.max("Last Date"), pl.sum("Days"),
+                pl.first("Open"), pl.first("First Close"), pl.last("Close"),
+                pl.max("High"), pl.min("Low"), pl.sum("Close Sum"), pl.sum("Dividends"), pl.sum("Volume"),
+            )
+        return months.select(
+            "Ticker", "Date",
+            pl.col("First Date").alias("Start_date"),
+            pl.col("Last Date").alias("End_date"),
+            "Dividends",
+            (pl.col("Volume") / pl.col("Days")).alias("Volume"),
+            "High", "Low", "Open", "Close",
+            (pl.col("Dividends") / (pl.col("Close Sum") / pl.col("Days"))).alias("Dividend_yield"),
+            pl.when(pl.col("Close") != 0)
+              .then((pl.col("Close") - pl.col("First Close")) / pl.col("Close") * 100)
+              .otherwise(0.0).alias("Price_variation"),
+        ).sort("Ticker", "Date").collect()
 
+    def get_statistics_by_year(self, ticker, years=6):
+        year = datetime.now().year
+        breakdown = self.get_breakdown(ticker, "year", datetime(year - years + 1, 1, 1))
+        by_year = dict(zip([day.year for day in breakdown["Date"]], breakdown.drop("Ticker", "Date").iter_rows(named=True)))
+        statistics = [by_year.get(y, self._get_statistics(pl.DataFrame())) for y in range(year - years + 1, year + 1)]
         return pl.from_dicts(statistics)
     
     def get_statistics_by_buy_date(self, ticker, buy_date, price_at_buy=None, return_dict=False) -> pl.DataFrame:
         end_date = datetime.now().replace(month=12, day=31, hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
         start_time = buy_date
         
-        data = self.get_stocks_by_timerange(ticker, start_time, end_date)
-        stats = self._get_statistics(data)
+        self.ensure_coverage(ticker, start_time)
+        stats = self.get_window_statistics(ticker, start_time, end_date)
         # replace start_date with buy_date and price_variation with price_variation from buy_date
         stats["Date"] = buy_date
         if price_at_buy is not None:
@@ -186,8 +375,11 @@ class Stocks():
         statistics = []
         for stock in portifolio.iter_rows(named=True):
             days = (datetime.now() - stock['Date']).days
-            dividend = self.get_monthly_dividends(stock['Ticker'], days_to_period(days))
-            close = self.get_monthly_close_price(stock['Ticker'], days_to_period(days))
+            bars = self.get_bars(stock['Ticker'], days_to_period(days), "1mo")
+            if bars.is_empty():
+                continue
+            dividend = bars.select("Date", "Dividends")
+            close = bars.select("Date", "Close")
             
             close[0, "Close"] = stock['Price at Buy'] # add buy price to take a diff
             close = close.with_columns(
@@ -211,21 +403,31 @@ class Stocks():
         return pl.concat(statistics, how="vertical")
 
 
+    def get_portifolio_risk(self, confidence=0.95, horizon=1, scenarios=100000, lookback="2y", benchmark=BENCHMARK_TICKER, progress=None) -> dict:
+        log.info(f"Get portifolio risk, confidence {confidence}, horizon {horizon} days, {scenarios} scenarios")
+        return portifolio_risk(self, confidence, horizon, scenarios, lookback, benchmark, progress=progress)
+
+    def get_dividends(self, tickers=None, start=None, end=None) -> pl.DataFrame:
+        '''
+        Dividends (Ticker, Date, Dividends) of tickers (a ticker or a list, all when None) paid between
+        start and end (end excluded), read from the corporate events, the history is not downloaded.
+        '''
+        events = self.db.get_corporate_events(tickers, "dividend", start, end)
+        return events.select("Ticker", "Date", pl.col("Amount").alias("Dividends"))
+
     def get_monthly_dividends(self, ticker, period)  -> pl.DataFrame:
-        data = self.get_stock(ticker, period)
-        if data is None or data.is_empty():
+        start = self.ensure_history(ticker, period)
+        data = self.get_dividends(ticker, start)
+        if data.is_empty():
             return 0
-        return data.group_by_dynamic(
-            "Date", every="1mo", period="1mo", closed="right"
-        ).agg(pl.sum("Dividends")).select("Date", "Dividends")
+        # months without dividends have no row
+        return data.group_by(pl.col("Date").dt.truncate("1mo")).agg(pl.sum("Dividends")).sort("Date")
     
     def get_monthly_close_price(self, ticker, period)  -> pl.DataFrame:
-        data = self.get_stock(ticker, period)
-        if data is None or data.is_empty():
+        data = self.get_bars(ticker, period, "1mo")
+        if data.is_empty():
             return 0
-        return data.group_by_dynamic(
-            "Date", every="1mo", period="1mo", closed="right"
-        ).agg(pl.last("Close")).select("Date", "Close")
+        return data.select("Date", "Close")
 
     def adj_stock_price(self, df) -> pl.DataFrame:
         # https://www.bussoladoinvestidor.com.br/ajustar-o-historico-de-precos-de-acoes/
@@ -262,19 +464,67 @@ class Stocks():
         )
         return df
     
-    def train_models(self):
+    def train_models(self, global_model=False, static_covariates=False):
         portifolio = self.get_portifolio()
+        if global_model:
+            series = self._forecast_series(portifolio["Ticker"].unique(maintain_order=True).to_list(), static_covariates)
+            self.forecast.create_models()
+            self.forecast.train_global(series)
+            return
+
         for stock in portifolio.iter_rows(named=True):
             data = self.get_stock(stock['Ticker'], 'max')
             series = self.forecast.timeseries(data)
             self.forecast.train(series)
 
+    def _static_covariates(self, data) -> dict:
+        # numeric description of the ticker shared by all its samples
+        returns = data["Adj Close"].pct_change().drop_nulls()
+        return {
+            "volatility": returns.std() or 0.0,
+            "dividend_yield": data["Dividends"].sum() / data["Close"].mean() / max(data.height / 252, 1),
+            "log_volume": float(np.log1p(data["Volume"].mean())),
+        }
+
+    def _forecast_series(self, tickers, static_covariates=False) -> dict:
+        series = {}
+        for ticker in tickers:
+            data = self.get_stock(ticker, 'max')
+            if data.is_empty():
+                continue
+            series[ticker] = self.forecast.timeseries(data, self._static_covariates(data) if static_covariates else None)
+        return series
+
     def forecast_stock(self, ticker, days=12) -> dict:
         self.forecast.ticker = ticker
         pred = self.forecast.predict(days)
         print(pred)
         return pred
-    
+
+    def forecast_stocks(self, tickers, days=12, static_covariates=False, compiled=False) -> dict:
+        '''
+        Forecast all tickers at once with the global models, static_covariates must match the training.
+        compiled runs the models exported by StockForecast.export_global without darts.
+        '''
+        if compiled:
+            return self._forecast_compiled(tickers, days, static_covariates)
+        series = self._forecast_series(tickers, static_covariates)
+        self.forecast.try_load_global()
+        return self.forecast.predict_global(series, days)
+
+    def _forecast_compiled(self, tickers, days, static_covariates) -> dict:
+        series, covariates = {}, {}
+        for ticker in tickers:
+            data = self.get_stock(ticker, 'max')
+            if data.is_empty():
+                continue
+            # one value per calendar day with the gaps interpolated, like StockForecast.timeseries
+            prices = data.select("Date", "Adj Close").sort("Date").upsample("Date", every="1d")
+            series[ticker] = prices["Adj Close"].interpolate().to_numpy()
+            if static_covariates:
+                covariates[ticker] = self._static_covariates(data)
+        return self.forecast.predict_compiled(series, covariates or None, days)
+
     def load_forecast(self, ticker):
         return self.db.get_forecast_by_ticker(ticker)
 
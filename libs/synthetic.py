@@ -0,0 +1,118 @@
+# Description: Synthetic market data generator, used to build offline databases for benchmarks and development.
+from datetime import datetime, timedelta
+import numpy as np
+import polars as pl
+import zlib
+import logging
+
+from libs.db import DB
+
+log = logging.getLogger()
+
+def synthetic_tickers(n_tickers) -> list:
+    return [f"SYN{i:04d}.SA" for i in range(n_tickers)]
+
+def synthetic_history(ticker, years, seed=0, end_date=None) -> pl.DataFrame:
+    '''
+    Generate a daily price history with the same columns returned by finance.get_historical_data.
+    Prices follow a geometric random walk on business days, with quarterly dividends
+    and at most one stock split per ticker.
+    '''
+    rng = np.random.default_rng([seed, zlib.crc32(ticker.encode())])
+    end_date = (end_date or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    start_date = end_date - timedelta(days=int(365 * years))
+
+    dates = pl.datetime_range(start_date, end_date, interval="1d", eager=True)
+    dates = dates.filter(dates.dt.weekday() < 6)
+    n = len(dates)
+
+    close = rng.uniform(5, 80) * np.exp(np.cumsum(rng.normal(0.0003, 0.02, n)))
+    open_ = np.concatenate([[close[0]], close[:-1]]) * np.exp(rng.normal(0, 0.005, n))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, n)))
+    volume = np.round(rng.lognormal(13, 1, n))
+
+    dividends = np.zeros(n)
+    first_dividend = int(rng.integers(0, 63))
+    dividends[first_dividend::63] = close[first_dividend::63] * rng.uniform(0.005, 0.02)
+
+    splits = np.zeros(n)
+    if n > 1 and rng.random() < 0.3:
+        splits[int(rng.integers(1, n))] = 2.0
+
+    # same adjustment as the provider: prices before an ex-dividend date are scaled by (1 - dividend / previous close)
+    factor = np.ones(n)
+    ex_dates = np.nonzero(dividends[1:])[0] + 1
+    factor[ex_dates - 1] = 1 - dividends[ex_dates] / close[ex_dates - 1]
+    factor = np.cumprod(factor[::-1])[::-1]
+
+    return pl.DataFrame({
+        "Open": open_,
+        "Close": close,
+        "High": high,
+        "Low": low,
+        "Adj Open": open_ * factor,
+        "Adj Close": close * factor,
+        "Adj High": high * factor,
+        "Adj Low": low * factor,
+        "Dividends": dividends,
+        "Volume": volume,
+        "Stock Splits": splits,
+        "Date": dates,
+    })
+
+def synthetic_intraday(ticker, day, interval_minutes=5, seed=0, open_price=None) -> pl.DataFrame:
+    '''
+    Generate the intraday bars of a trading day (10:00 to 17:00, the B3 session) with the columns
+    returned by the intraday providers. The same ticker, day and seed always give the same bars.
+    '''
+    day = datetime(day.year, day.month, day.day)
+    rng = np.random.default_rng([seed, zlib.crc32(ticker.encode()), day.toordinal()])
+    # the last bar of an interval not dividing the session starts before the close, 90m gives 5 bars
+    times = pl.datetime_range(day + timedelta(hours=10), day + timedelta(hours=17), interval=f"{interval_minutes}m", closed="left", eager=True)
+    n = len(times)
+    open_price = open_price or rng.uniform(5, 80)
+
+    close = open_price * np.exp(np.cumsum(rng.normal(0, 0.02 / np.sqrt(n), n)))
+    open_ = np.concatenate([[open_price], close[:-1]])
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.002, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.002, n)))
+
+    return pl.DataFrame({
+        "Datetime": times,
+        "Open": open_,
+        "High": high,
+        "Low": low,
+        "Close": close,
+        "Volume": np.round(rng.lognormal(9, 1, n)),
+    })
+
+def create_synthetic_db(filename, n_tickers=50, years=10, portifolio_size=10, seed=0) -> list:
+    '''
+    Create a database with n_tickers synthetic stocks and a portifolio with the first
+    portifolio_size tickers. Every ticker is marked as fully downloaded, so reads never reach the api.
+    '''
+    db = DB(filename)
+    db.create_tables()
+    tickers = synthetic_tickers(n_tickers)
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rng = np.random.default_rng(seed)
+
+    rows = []
+    for i, ticker in enumerate(tickers):
+        df = synthetic_history(ticker, years, seed).with_columns(
+            pl.lit(ticker).alias("Ticker")
+        ).with_columns(
+            pl.col("Date").dt.strftime("%Y-%m-%d %H:%M:%S")
+        ).select(["Ticker", "Open", "Close", "High", "Low", "Adj Open", "Adj Close", "Adj High", "Adj Low", "Dividends", "Volume", "Stock Splits", "Date"])
+        rows.extend(df.rows())
+        db.insert_stock_download_info(ticker, now, now, "YES")
+
+        if i < portifolio_size:
+            buy = df.row(int(rng.integers(0, len(df))), named=True)
+            db.insert_portifolio(ticker, int(rng.integers(1, 10)) * 100, buy["Close"], buy["Date"])
+
+    db.bulk_insert(rows)
+    db.close()
+    log.info(f"Created synthetic database {filename} with {n_tickers} tickers and {len(rows)} rows")
+    return tickers
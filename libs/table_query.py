@@ -0,0 +1,94 @@
+# Description: Server side paging, sorting and filtering of Dash DataTables.
+# Tables with page_action, sort_action and filter_action set to 'custom' send page_current, page_size,
+# sort_by and filter_query to a callback, table_page() translates them into polars expressions and
+# returns only the rows of the visible page.
+import re
+import math
+import logging
+
+import polars as pl
+
+log = logging.getLogger()
+
+# operators of the DataTable filter row, the symbolic form and the word form are both accepted
+OPERATORS = {
+    ">=": "ge", "<=": "le", "!=": "ne", "<": "lt", ">": "gt", "=": "eq",
+    "ge": "ge", "le": "le", "ne": "ne", "lt": "lt", "gt": "gt", "eq": "eq",
+    "contains": "contains", "datestartswith": "datestartswith",
+}
+
+_TERM = re.compile(
+    r'''\{(?P<column>[^}]+)\}\s+
+        (?P<case>[si]?)(?P<operator>>=|<=|!=|<|>|=|ge|le|ne|lt|gt|eq|contains|datestartswith)\s+
+        (?P<value>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|`(?:[^`\\]|\\.)*`|.+)''',
+    re.VERBOSE
+)
+
+def _value(text):
+    if text[:1] in ('"', "'", "`") and text[-1:] == text[:1]:
+        return re.sub(r"\\(.)", r"\1", text[1:-1])
+    try:
+        return float(text) if any(c in text for c in ".eE") else int(text)
+    except ValueError:
+        return text
+
+def _term(column, operator, value, case_sensitive, dtype) -> pl.Expr:
+    col = pl.col(column)
+    if operator in ("contains", "datestartswith") or dtype in (pl.Utf8, pl.Categorical) or dtype.is_temporal():
+        # text and dates are compared as text, ISO dates sort like their values
+        col, value = col.cast(pl.Utf8), str(value)
+        if not case_sensitive:
+            col, value = col.str.to_lowercase(), value.lower()
+        if operator == "contains":
+            return col.str.contains(value, literal=True)
+        if operator == "datestartswith":
+            return col.str.starts_with(value)
+    elif isinstance(value, str):
+        # a text value on a numeric column matches nothing, like the native filter
+        return pl.lit(False)
+    return {
+        "eq": col == value, "ne": col != value, "lt": col < value,
+        "le": col <= value, "gt": col > value, "ge": col >= value,
+    }[operator]
+
+def filter_expression(filter_query, schema) -> pl.Expr:
+    '''
+    Translate a DataTable filter_query ("{col} op value && ...") into a polars expression,
+    None when the query is empty. Terms on unknown columns or that can not be parsed are ignored.
+    '''
+    expressions = []
+    for part in (filter_query or "").split(" && "):
+        part = part.strip()
+        if not part:
+            continue
+        match = _TERM.fullmatch(part)
+        if match is None or match["column"] not in schema:
+            log.warning(f"Ignore filter {part}")
+            continue
+        # "i" prefixed operators are case insensitive, like the filter_options of the DataTable
+        expressions.append(_term(match["column"], OPERATORS[match["operator"]], _value(match["value"].strip()),
+                                 match["case"] != "i", schema[match["column"]]))
+    if not expressions:
+        return None
+    return pl.all_horizontal(expressions)
+
+def table_page(data, page_current=0, page_size=20, sort_by=None, filter_query=None) -> tuple:
+    '''
+    Filter, sort and slice data (DataFrame, LazyFrame or list of dicts) for a DataTable with custom
+    paging, returns (rows of the page, page count).
+    '''
+    if isinstance(data, list):
+        data = pl.from_dicts(data, infer_schema_length=None) if data else pl.DataFrame()
+    lf = data.lazy()
+    schema = lf.collect_schema()
+
+    expression = filter_expression(filter_query, schema)
+    if expression is not None:
+        lf = lf.filter(expression)
+    sort_by = [s for s in (sort_by or []) if s["column_id"] in schema]
+    if sort_by:
+        lf = lf.sort([s["column_id"] for s in sort_by], descending=[s["direction"] == "desc" for s in sort_by], nulls_last=True)
+
+    page_current, page_size = page_current or 0, page_size or 20
+    df = lf.collect()
+    return df.slice(page_current * page_size, page_size).to_dicts(), max(1, math.ceil(df.height / page_size))
@@ -0,0 +1,193 @@
+# Description: In-memory index of a ticker history for the statistics of any date window.
+# Prefix sums of Close, Volume and the dividends give the sums and means of a window with two lookups,
+# sparse tables of High and Low give its max and min with two overlapping power of two blocks. The
+# window rows are found by a binary search of the dates, a query is O(log n) and does not touch the rows.
+#
+#   index = WindowIndex(stocks.scan(WINDOW_COLUMNS, ticker).collect(), stocks.get_dividends(ticker))
+#   index.statistics(date(2024, 1, 1), date(2025, 1, 1))
+from collections import OrderedDict
+from datetime import datetime
+import threading
+import logging
+
+import numpy as np
+import polars as pl
+
+log = logging.getLogger()
+
+# columns of the daily rows read by WindowIndex
+WINDOW_COLUMNS = ["Date", "Open", "Close", "High", "Low", "Volume"]
+
+def _day(value) -> np.datetime64:
+    if isinstance(value, datetime):
+        value = value.date()
+    return np.datetime64(value, "D")
+
+def _extend_sums(sums, start, values) -> np.ndarray:
+    # sums[i] is the sum of the first i values, the values from start are replaced
+    return np.concatenate([sums[:start + 1], sums[start] + np.cumsum(values)])
+
+class SparseTable():
+    '''
+    Range max or min (op np.maximum or np.minimum) of values in O(1), level k holds the op of the
+    2^k values starting at each position.
+    '''
+    def __init__(self, op, values=()):
+        self.op = op
+        self.levels = [np.empty(0)]
+        self.extend(0, values)
+
+    def extend(self, start, values):
+        '''
+        Replace the values from position start by values, only the blocks reaching start are computed again.
+        '''
+        base = np.concatenate([self.levels[0][:start], np.asarray(values, dtype=np.float64)])
+        n = len(base)
+        levels = [base]
+        k = 1
+        while (1 << k) <= n:
+            half, length = 1 << (k - 1), n - (1 << k) + 1
+            prev = levels[-1]
+            keep = max(0, min(start - (1 << k) + 1, length))
+            old = self.levels[k][:keep] if k < len(self.levels) else prev[:0]
+            keep = len(old)
+            levels.append(np.concatenate([old, self.op(prev[keep:length], prev[keep + half:length + half])]))
+            k += 1
+        self.levels = levels
+
+    def copy(self) -> "SparseTable":
+        table = SparseTable(self.op)
+        table.levels = list(self.levels)
+        return table
+
+    def query(self, i, j) -> float:
+        # op of the values in [i, j), j > i
+        k = int(j - i).bit_length() - 1
+        return float(self.op(self.levels[k][i], self.levels[k][j - (1 << k)]))
+
+class WindowIndex():
+    def __init__(self, data=None, dividends=None):
+        self.dates = np.empty(0, dtype="datetime64[D]")
+        self.open = np.empty(0)
+        self.close = np.empty(0)
+        self.close_sums = np.zeros(1)
+        self.volume_sums = np.zeros(1)
+        self.high = SparseTable(np.maximum)
+        self.low = SparseTable(np.minimum)
+        self.dividend_dates = np.empty(0, dtype="datetime64[D]")
+        self.dividend_sums = np.zeros(1)
+        self.extend(data, dividends)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def extend(self, data=None, dividends=None, since=None):
+        '''
+        Add the daily rows of data (WINDOW_COLUMNS ordered by Date) and the dividends (Date, Dividends) from
+        the date since (the first date of data when None), the indexed rows and dividends from since on are
+        replaced. Only the new rows are summed, appending a few days to a long history is cheap.
+        '''
+        if since is None and data is not None and not data.is_empty():
+            since = data["Date"][0]
+        if since is None:
+            return
+        since = _day(since)
+
+        start = int(np.searchsorted(self.dates, since))
+        if data is None or data.is_empty():
+            data = pl.DataFrame(schema={name: pl.Float64 for name in WINDOW_COLUMNS}).cast({"Date": pl.Date})
+        close = data["Close"].to_numpy().astype(np.float64)
+        self.dates = np.concatenate([self.dates[:start], data["Date"].cast(pl.Date).to_numpy().astype("datetime64[D]")])
+        self.open = np.concatenate([self.open[:start], data["Open"].to_numpy().astype(np.float64)])
+        self.close = np.concatenate([self.close[:start], close])
+        self.close_sums = _extend_sums(self.close_sums, start, close)
+        self.volume_sums = _extend_sums(self.volume_sums, start, data["Volume"].to_numpy().astype(np.float64))
+        self.high.extend(start, data["High"].to_numpy())
+        self.low.extend(start, data["Low"].to_numpy())
+
+        start = int(np.searchsorted(self.dividend_dates, since))
+        if dividends is None:
+            dividends = pl.DataFrame(schema={"Date": pl.Date, "Dividends": pl.Float64})
+        self.dividend_dates = np.concatenate([self.dividend_dates[:start], dividends["Date"].cast(pl.Date).to_numpy().astype("datetime64[D]")])
+        self.dividend_sums = _extend_sums(self.dividend_sums, start, dividends["Dividends"].to_numpy().astype(np.float64))
+
+    def copy(self) -> "WindowIndex":
+        # the arrays are never changed in place, extend builds new ones, so they are shared
+        index = WindowIndex.__new__(WindowIndex)
+        index.__dict__.update(self.__dict__)
+        index.high, index.low = self.high.copy(), self.low.copy()
+        return index
+
+    def span(self, start=None, end=None) -> tuple:
+        '''
+        Positions [i, j) of the rows between start and end (end excluded).
+        '''
+        i = 0 if start is None else int(np.searchsorted(self.dates, _day(start)))
+        j = len(self.dates) if end is None else int(np.searchsorted(self.dates, _day(end)))
+        return i, max(i, j)
+
+    def dividends(self, start=None, end=None) -> float:
+        i = 0 if start is None else int(np.searchsorted(self.dividend_dates, _day(start)))
+        j = len(self.dividend_dates) if end is None else int(np.searchsorted(self.dividend_dates, _day(end)))
+        return float(self.dividend_sums[max(i, j)] - self.dividend_sums[i])
+
+    def statistics(self, start=None, end=None) -> dict:
+        '''
+        Statistics of Stocks._get_statistics for the rows between start and end (end excluded, dates or
+        datetimes, a datetime counts from its day), None when the window has no rows.
+        '''
+        i, j = self.span(start, end)
+        if i == j:
+            return None
+        days = j - i
+        close = float(self.close[j - 1])
+        dividends = self.dividends(start, end)
+        return {
+            "Start_date": self.dates[i].item(),
+            "End_date": self.dates[j - 1].item(),
+            "Dividends": dividends,
+            "Volume": float(self.volume_sums[j] - self.volume_sums[i]) / days,
+            "High": self.high.query(i, j),
+            "Low": self.low.query(i, j),
+            "Open": float(self.open[i]),
+            "Close": close,
+            "Dividend_yield": dividends / (float(self.close_sums[j] - self.close_sums[i]) / days),
+            "Price_variation": (close - float(self.close[i])) / close * 100 if close != 0 else 0
+        }
+
+class WindowIndexCache():
+    '''
+    WindowIndex of the most recently used tickers. An entry is valid for one revision of the ticker
+    history (see DB.get_ticker_revision), the next revision extends it from the first changed date and
+    any later one builds it again.
+    '''
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, revision, changed_from, read) -> WindowIndex:
+        '''
+        Index of key at revision, read(since) returns the (rows, dividends) since a date (all when None).
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is not None and entry[0] == revision:
+            return entry[1]
+
+        if entry is not None and entry[0] == revision - 1 and changed_from is not None:
+            # a copy, the readers of the current revision keep a consistent index
+            index = entry[1].copy()
+            index.extend(*read(changed_from), since=changed_from)
+        else:
+            index = WindowIndex(*read(None))
+            log.info(f"Built the window index of {key[-1]} with {len(index)} rows")
+
+        with self.lock:
+            self.entries[key] = (revision, index)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return index
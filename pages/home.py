@@ -1,88 +1,71 @@
-from dash import register_page, html, dcc
+from dash import register_page, html, dcc, callback, Input, Output
 from dash.dash_table import DataTable, FormatTemplate
 from dash.dash_table.Format import Format, Scheme, Group, Symbol
 import dash_bootstrap_components as dbc
 
 import plotly.graph_objects as go
-import polars as pl
 
 from libs.db import DB
 from libs.stocks import Stocks
 from libs.config import DATABASE_PATH
+from libs.precompute import portifolio_statistics, monthly_portifolio_statistics
+from libs.figures import compact_figure
 
 register_page(__name__, path='/')
 
 money_format = Format(
-    scheme=Scheme.fixed, 
+    scheme=Scheme.fixed,
     precision=2,
     group=Group.yes,
     groups=3,
     group_delimiter='.',
     decimal_delimiter=',',
-    symbol=Symbol.yes, 
+    symbol=Symbol.yes,
     symbol_prefix=u'R$'
 )
 
-def layout(**kwargs):
-    stocks = Stocks(DB(DATABASE_PATH))
-    df = stocks.get_portifolio()
-
-    statistics = []
-
-    for stock in df.iter_rows(named=True):
-        stats = stocks.get_statistics_by_buy_date(stock['Ticker'], stock['Date'], stock['Price at Buy'], return_dict=True)
-        stats["Price at Buy"] = stock['Price at Buy']
-        stats["N Stocks"] = stock['Number of Stocks']
-        stats["Buy Date"] = stock['Date'].strftime("%d/%m/%Y")
-        stats["Div Yield"] = stats["Dividend_yield"] 
-        stats["Close Price"] = stats["Close"]
-        stats["Price %"] = stats["Price_variation"]
-        stats["Ticker"] = stock['Ticker']
-        statistics.append(stats)
+cols = ["Ticker", "Price %", "Close Price", "Price at Buy", "Dividends", "Div Yield", "N Stocks", "Buy Date"]
+formatters = {
+    "Price %": FormatTemplate.percentage(2),
+    "Div Yield": FormatTemplate.percentage(2),
+    "Close Price": money_format,
+    "Price at Buy": money_format,
+    "Dividends": money_format,
+}
+columns = [
+    dict(name=i, id=i, type="numeric", format=formatters[i])
+    if i in formatters else {"name": i, "id": i}
+    for i in cols
+]
 
-    cols = ["Ticker", "Price %", "Close Price", "Price at Buy", "Dividends", "Div Yield", "N Stocks", "Buy Date"]
-    formatters = {
-        "Price %": FormatTemplate.percentage(2),
-        "Div Yield": FormatTemplate.percentage(2),
-        "Close Price": money_format,
-        "Price at Buy": money_format,
-        "Dividends": money_format,
-    }
-    data = [
-        {k: v for k, v in s.items() if k in cols}
-        for s in statistics
-    ]
-    cols = [
-        dict(name=i, id=i, type="numeric", format=formatters[i])
-        if i in formatters else {"name": i, "id": i}
-        for i in cols 
-    ]
+data_table_style = [
+    {
+        'if': {
+            'filter_query': f'{{{col["id"]}}} < 0',
+            'column_id': col['id']
+        },
+        'backgroundColor': 'white',
+        'color': 'red'
+    } for col in columns if "Price %" == col["id"]
+]
 
-    data_table_style = [
-        {
-            'if': {
-                'filter_query': f'{{{col["id"]}}} < 0',
-                'column_id': col['id']
-            },
-            'backgroundColor': 'white',
-            'color': 'red'
-        } for col in cols if "Price %" == col["id"]
-    ]
+data_table_style.extend([
+    {
+        'if': {
+            'filter_query': f'{{{col["id"]}}} > 0',
+            'column_id': col['id']
+        },
+        'backgroundColor': 'white',
+        'color': 'green'
+    } for col in columns if "Price Variation" == col["id"]
+])
 
-    data_table_style.extend([
-        {
-            'if': {
-                'filter_query': f'{{{col["id"]}}} > 0',
-                'column_id': col['id']
-            },
-            'backgroundColor': 'white',
-            'color': 'green'
-        } for col in cols if "Price Variation" == col["id"]
-    ])
+def layout(**kwargs):
+    # only the page shell is rendered here, the data is filled by the background callbacks below
     d_table = DataTable(
-            id='portifolio-table',
-            data=data,
-            columns=cols,
+            id='home-portifolio-table',
+            data=[],
+            columns=columns,
             page_size=20,
             page_action='native',
             filter_action='native',
@@ -93,12 +76,54 @@ def layout(**kwargs):
             },
             style_data_conditional=data_table_style,
         )
+
+    return html.Div([
+        dcc.Store(id='home-load', data=0),
+        dbc.Progress(id='home-progress', value=0, max=1, style={"margin": "0px 20px 0px 20px"}),
+        dbc.Row([
+            dbc.Col([
+                d_table
+            ], width=6),
+            dbc.Col([
+                dcc.Loading(dcc.Graph(id='home-chart', style={'height': '500px'}))
+            ], width=6)
+        ], style={"margin": "20px 20px 20px 20px"})
+    ])
+
+@callback(
+    Output('home-portifolio-table', 'data'),
+    Input('home-load', 'data'),
+    background=True,
+    progress=[Output('home-progress', 'value'), Output('home-progress', 'max')],
+    running=[(Output('home-progress', 'style'), {"margin": "0px 20px 0px 20px"}, {"display": "none"})],
+)
+def update_portifolio_table(set_progress, _):
+    stocks = Stocks(DB(DATABASE_PATH))
+    statistics = portifolio_statistics(stocks, progress=lambda i, n: set_progress((i, n)))
+
+    data = []
+    for stats in statistics:
+        data.append({
+            "Ticker": stats["Ticker"],
+            "Price %": stats["Price_variation"],
+            "Close Price": stats["Close"],
+            "Price at Buy": stats["Price at Buy"],
+            "Dividends": stats["Dividends"],
+            "Div Yield": stats["Dividend_yield"],
+            "N Stocks": stats["Number of Stocks"],
+            "Buy Date": stats["Buy Date"].strftime("%d/%m/%Y"),
+        })
+    return data
+
+@callback(
+    Output('home-chart', 'figure'),
+    Input('home-load', 'data'),
+    background=True,
+)
+def update_portifolio_chart(_):
     # bar chart with dividends and price variation
-    data = stocks.get_monthly_portifolio_statistics()
-    data = data.sort("Date", descending=False)
-    data = data.group_by_dynamic(
-            "Date", every="1mo", period="1mo", closed="right"
-        ).agg(pl.sum("Dividends"), pl.sum("Price Variation Diff")).select("Date", "Dividends", "Price Variation Diff")
+    stocks = Stocks(DB(DATABASE_PATH))
+    data = monthly_portifolio_statistics(stocks)
 
     fig = go.Figure(data=[
         go.Bar(x=data['Date'], y=data['Dividends'], name="Dividends"),
@@ -115,14 +140,4 @@ def layout(**kwargs):
             x=1
         )
     )
-
-    return html.Div(
-        dbc.Row([
-            dbc.Col([
-                d_table
-            ], width=6),
-            dbc.Col([
-                dcc.Graph(figure=fig, style={'height': '500px'})
-            ], width=6)
-        ], style={"margin": "20px 20px 20px 20px"})
-    )
\ No newline at end of file
+    return compact_figure(fig)
@@ -1,107 +1,127 @@
-from dash import register_page, html
+from dash import register_page, html, dcc, callback, no_update, Input, Output, State
 from dash.dash_table import DataTable, FormatTemplate
 from dash.dash_table.Format import Format, Scheme, Group, Symbol
+import dash_bootstrap_components as dbc
 
 from libs.db import DB
 from libs.stocks import Stocks
 from libs.config import DATABASE_PATH
+from libs.precompute import analysis_table, cached_analysis_table
+from libs.table_query import table_page
 
-from tqdm import tqdm
 import logging
 
 register_page(__name__, title='Stocks Portifolio')
 
 log = logging.getLogger()
 
-def layout(**kwargs):
-    stocks = Stocks(DB(DATABASE_PATH))
-    all_stocks = stocks.list_stocks()
-
-    statistics = []
+periods = ["1y", "2y", "5y"]
 
-    progress_bar = tqdm(all_stocks)
-    for stock in progress_bar:
-        log.info(str(progress_bar))
-        stock = stock[0]
-        stats = stocks.get_statistics_all_periods(stock, ["1y", "2y", "5y"], True)
-
-        statistics.append({
-            "ticker": stock,
-            "dividends": {s['Period']:s['Dividends'] for s in stats},
-            "dividend_yield": {s['Period']:s['Dividend_yield'] for s in stats},
-            "price": {s['Period']:s['Close'] for s in stats},
-            "price_variation": {s['Period']:s['Price_variation']/100 for s in stats},
-        })
-
-    cols = []
-    for k,v in statistics[0].items():
-        if isinstance(v, dict):
-            for k1,v1 in v.items():
-                if k == "dividends"  or k == "price":
-                    cols.append(dict(name=[k, k1], id=f"{k}_{k1}", type="numeric", format=Format(
-                                                                                        scheme=Scheme.fixed, 
-                                                                                        precision=2,
-                                                                                        group=Group.yes,
-                                                                                        groups=3,
-                                                                                        group_delimiter='.',
-                                                                                        decimal_delimiter=',',
-                                                                                        symbol=Symbol.yes, 
-                                                                                        symbol_prefix=u'R$')))
-                elif k == "price_variation" or k == "dividend_yield":
-                    cols.append(dict(name=[k, k1], id=f"{k}_{k1}", type="numeric", format=FormatTemplate.percentage(2)))
-                else:
-                    cols.append({"name": [k, k1], "id": f"{k}_{k1}"})
-                
+cols = [{"name": "ticker", "id": "ticker"}]
+for k in ["dividends", "dividend_yield", "price", "price_variation"]:
+    for k1 in periods:
+        if k == "dividends"  or k == "price":
+            cols.append(dict(name=[k, k1], id=f"{k}_{k1}", type="numeric", format=Format(
+                                                                                scheme=Scheme.fixed,
+                                                                                precision=2,
+                                                                                group=Group.yes,
+                                                                                groups=3,
+                                                                                group_delimiter='.',
+                                                                                decimal_delimiter=',',
+                                                                                symbol=Symbol.yes,
+                                                                                symbol_prefix=u'R$')))
         else:
-            cols.append({"name": k, "id": k})
+            cols.append(dict(name=[k, k1], id=f"{k}_{k1}", type="numeric", format=FormatTemplate.percentage(2)))
 
-    data = []
-    for s in statistics:
-        d = {}
-        for k, v in s.items():
-            if isinstance(v, dict):
-                for k1, v1 in v.items():
-                        d[f"{k}_{k1}"] = v1
-            else:
-                d[k] = v
-        data.append(d)
+data_table_style = [
+    {
+        'if': {
+            'filter_query': f'{{{col["id"]}}} < 0',
+            'column_id': col['id']
+        },
+        'backgroundColor': 'white',
+        'color': 'red'
+    } for col in cols if "price_variation" in col["id"]
+]
 
-    data_table_style = [
-        {
-            'if': {
-                'filter_query': f'{{{col["id"]}}} < 0',
-                'column_id': col['id']
-            },
-            'backgroundColor': 'white',
-            'color': 'red'
-        } for col in cols if "price_variation" in col["id"]
-    ]
+data_table_style.extend([
+    {
+        'if': {
+            'filter_query': f'{{{col["id"]}}} > 0',
+            'column_id': col['id']
+        },
+        'backgroundColor': 'white',
+        'color': 'green'
+    } for col in cols if "price_variation" in col["id"]
+])
 
-    data_table_style.extend([
-        {
-            'if': {
-                'filter_query': f'{{{col["id"]}}} > 0',
-                'column_id': col['id']
+def layout(**kwargs):
+    # only the page shell is rendered here, the statistics are computed by a background callback
+    # and the table is paged, sorted and filtered on the server
+    return html.Div([
+        dcc.Store(id='analysis-load', data=0),
+        dcc.Store(id='analysis-ready', data=0),
+        # fires once when the page callback finds the table no longer cached, to compute it again
+        dcc.Interval(id='analysis-retry', interval=500, n_intervals=0, max_intervals=0),
+        dbc.Progress(id='analysis-progress', value=0, max=1, style={"margin": "0px 20px 0px 20px"}),
+        DataTable(
+            id='analysis-table',
+            data=[],
+            columns=cols,
+            style_table={'height': '900px'},
+            style_cell={
+                'minWidth': 95, 'maxWidth': 500, 'width': 95, 'textAlign': 'center'
             },
-            'backgroundColor': 'white',
-            'color': 'green'
-        } for col in cols if "price_variation" in col["id"]
+            merge_duplicate_headers=True,
+            style_data_conditional=data_table_style,
+            filter_action="custom",
+            sort_action="custom",
+            page_action="custom",
+            page_current=0,
+            page_size=50,
+        )
     ])
 
+@callback(
+    Output('analysis-ready', 'data'),
+    Input('analysis-load', 'data'),
+    Input('analysis-retry', 'n_intervals'),
+    State('analysis-ready', 'data'),
+    background=True,
+    progress=[Output('analysis-progress', 'value'), Output('analysis-progress', 'max')],
+    running=[(Output('analysis-progress', 'style'), {"margin": "0px 20px 0px 20px"}, {"display": "none"})],
+)
+def update_analysis_table(set_progress, _, retries, ready):
+    stocks = Stocks(DB(DATABASE_PATH))
+
+    def progress(i, n):
+        log.info(f"Statistics of {i}/{n} stocks")
+        set_progress((i, n))
 
-    return html.Div(
-            DataTable(
-                data=data,
-                columns=cols,
-                style_table={'height': '900px'},
-                style_cell={
-                    'minWidth': 95, 'maxWidth': 500, 'width': 95, 'textAlign': 'center'
-                },
-                merge_duplicate_headers=True,
-                style_data_conditional=data_table_style,
-                filter_action="native",
-                sort_action="native",
-                page_action="native",
-                page_size=50,
-            )
-        )
+    analysis_table(stocks, periods, progress=progress)
+    # a new value on every run, so the page callback reads the cache again
+    return (ready or 0) + 1
+
+@callback(
+    Output('analysis-table', 'data'),
+    Output('analysis-table', 'page_count'),
+    Output('analysis-retry', 'max_intervals'),
+    Input('analysis-ready', 'data'),
+    Input('analysis-table', 'page_current'),
+    Input('analysis-table', 'page_size'),
+    Input('analysis-table', 'sort_by'),
+    Input('analysis-table', 'filter_query'),
+    State('analysis-retry', 'n_intervals'),
+    State('analysis-retry', 'max_intervals'),
+)
+def update_analysis_page(ready, page_current, page_size, sort_by, filter_query, retries, max_retries):
+    if not ready:
+        return [], 1, no_update
+    # only the rows cached by the background callback above, a miss (an ingest since) is computed there again
+    data = cached_analysis_table(periods)
+    if data is None:
+        log.info("Analysis table not cached for the current generation, compute it again")
+        # one more tick of analysis-retry, unless one is already pending
+        return [], 1, retries + 1 if max_retries <= retries else no_update
+    rows, page_count = table_page(data, page_current, page_size, sort_by, filter_query)
+    return rows, page_count, no_update
@@ -7,9 +7,13 @@ import polars as pl
 from libs.db import DB
 from libs.stocks import Stocks
 from libs.config import DATABASE_PATH
+from libs.figures import compact_figure
 
 register_page(__name__, title='Historical Data')
 
+# long periods are drawn with weekly bars read from the rollups
+CHART_GRANULARITY = {"5y": "1w", "max": "1w"}
+
 def layout(**kwargs):
     stocks = Stocks(DB(DATABASE_PATH))
     return html.Div([
@@ -22,7 +26,10 @@ def layout(**kwargs):
                     [
                         html.Div(id='stocks-card'),
                         dcc.Dropdown(
-                            options=[s[0] for s in stocks.list_stocks()],
+                            options=[
+                                {"label": f"{ticker} - {name}" if name else ticker, "value": ticker}
+                                for ticker, name in stocks.get_catalog().select("Ticker", "Name").iter_rows()
+                            ],
                             value="PETR3.SA",
                             # multi=True,
                             id="stocks-dropdown"
@@ -83,7 +90,7 @@ def layout(**kwargs):
 )
 def update_stocks_chart(dropdown, period, avg_mean):
     stocks = Stocks(DB(DATABASE_PATH))
-    df = stocks.get_stocks(dropdown, period)
+    df = stocks.get_bars(dropdown, period, CHART_GRANULARITY.get(period, "1d"))
     statistics = stocks.get_statistics_by_period(dropdown, period)
     fig = go.Figure(data=[go.Candlestick(x=df['Date'],
             open=df['Open'], high=df['High'],
@@ -110,7 +117,7 @@ def update_stocks_chart(dropdown, period, avg_mean):
             x=1
         )
     )
-    chart = dcc.Graph(figure=fig, style={'height': '600px'})
+    chart = dcc.Graph(figure=compact_figure(fig), style={'height': '600px'})
     quote_variation = statistics['Close']/statistics['Open']*100-100
     card = dbc.Card(
         [
@@ -144,7 +151,7 @@ def update_stocks_chart(dropdown, period, avg_mean):
 def update_dividends_chart(dropdown, period, radio):
     if radio == "Yes":
         stocks = Stocks(DB(DATABASE_PATH))
-        df = stocks.get_stocks(dropdown, period)
+        df = stocks.get_bars(dropdown, period, CHART_GRANULARITY.get(period, "1d"))
 
         fig = go.Figure(data=[go.Scatter(x=df['Date'], y=df['Close'], name=dropdown, mode='lines')])
         fig.add_trace(go.Scatter(x=df['Date'], y=df['Adj Close'], name='Adjusted Price', mode='lines'))
@@ -159,6 +166,6 @@ def update_dividends_chart(dropdown, period, radio):
             )
         )
         # fig.add_trace(go.Scatter(x=df['Date'], y=df['Dividends'].cum_sum(), name='Dividends Gain', mode='lines'))
-        return dcc.Graph(figure=fig, style={'height': '600px'})
+        return dcc.Graph(figure=compact_figure(fig), style={'height': '600px'})
     else:
         return None
\ No newline at end of file
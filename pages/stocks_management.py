@@ -8,6 +8,8 @@ from datetime import date
 from libs.db import DB
 from libs.stocks import Stocks
 from libs.config import DATABASE_PATH
+from libs.precompute import warm_up_async
+from libs.table_query import table_page
 
 register_page(__name__, title='Stocks Management')
 
@@ -33,7 +35,22 @@ layout = html.Div([
                 )
             ], width=2, style={"margin": "0px 20px 0px 20px"}),
             dbc.Col([
-                html.Div(id="stocks-data-table"),
+                html.Div(
+                    dash_table.DataTable(
+                        id="stocks-data-table",
+                        data=[],
+                        columns=[{'id': "Stocks in Database", 'name': "Stocks in Database"}],
+                        style_table={'height': '900px'},
+                        style_cell={
+                            'minWidth': 95, 'maxWidth': 500, 'width': 95, 'textAlign': 'center'
+                        },
+                        page_current=0,
+                        page_size=20,
+                        page_action='custom',
+                        filter_action='custom',
+                        sort_action='custom',
+                    )
+                ),
             ],
             width=2),
             dbc.Col([
@@ -62,10 +79,12 @@ layout = html.Div([
                     dash_table.DataTable(
                         id='portifolio-table',
                         data=[],
+                        columns=[{'id': c, 'name': c} for c in ["id", "Ticker", "Number of Stocks", "Price at Buy", "Date"]],
+                        page_current=0,
                         page_size=20,
-                        page_action='native',
-                        filter_action='native',
-                        sort_action='native',
+                        page_action='custom',
+                        filter_action='custom',
+                        sort_action='custom',
                         style_table={'height': '900px'},
                         style_cell={
                             'minWidth': 95, 'maxWidth': 200, 'width': 95, 'textAlign': 'center'
@@ -81,65 +100,68 @@ layout = html.Div([
 
 
 @callback(
-    Output("stocks-data-table", "children"), 
+    Output("stocks-data-table", "data"),
+    Output("stocks-data-table", "page_count"),
     Input("add-button", "n_clicks"),
+    Input("stocks-data-table", "page_current"),
+    Input("stocks-data-table", "page_size"),
+    Input("stocks-data-table", "sort_by"),
+    Input("stocks-data-table", "filter_query"),
     State("stocks-to-add", "value")
 )
-def add_stock_database(n, stocks_to_add):
+def add_stock_database(n, page_current, page_size, sort_by, filter_query, stocks_to_add):
     stocks = Stocks(DB(DATABASE_PATH))
 
-    if not n is None:
+    if dash.callback_context.triggered_id == "add-button" and n is not None and stocks_to_add:
         stocks_to_add = f"{stocks_to_add}.SA" if not stocks_to_add.endswith(".SA") else stocks_to_add
         stocks.add_stocks(stocks_to_add)
+        warm_up_async(DATABASE_PATH)
 
     stocks_list = stocks.list_stocks()
-    df = pl.DataFrame(stocks_list, schema=[("Stocks in Database", pl.Utf8)])
-    table = dash_table.DataTable(
-        data=df.to_dicts(),
-        columns=[{'id': c, 'name': c} for c in df.columns],
-        style_table={'height': '900px'},
-        style_cell={
-            'minWidth': 95, 'maxWidth': 500, 'width': 95, 'textAlign': 'center'
-        },
-        page_size=20,
-        page_action='native',
-        filter_action='native',
-        sort_action='native',
-    )
-
-    return table
+    df = pl.DataFrame(stocks_list, schema=[("Stocks in Database", pl.Utf8)], orient="row")
+    return table_page(df, page_current, page_size, sort_by, filter_query)
     
 @callback(
     Output("portifolio-table", "data"),
-    Output("portifolio-table", "columns"),
+    Output("portifolio-table", "page_count"),
+    Output("portifolio-table", "selected_rows"),
     Input("add-to-portifolio-button", "n_clicks"),
     Input("delete-from-portifolio-button", "n_clicks"),
+    Input("portifolio-table", "page_current"),
+    Input("portifolio-table", "page_size"),
+    Input("portifolio-table", "sort_by"),
+    Input("portifolio-table", "filter_query"),
     State("stocks-to-portifolio", "value"),
     State("number-of-stocks", "value"),
     State("price-at-buy", "value"),
     State("stocks-date-picker", "date"),
-    State("portifolio-table", "selected_rows")
+    State("portifolio-table", "selected_row_ids")
 )
-def add_stocks_to_portifolio(n1, n2, stocks_to_portifolio, number_of_stocks, price_at_buy, date, selected_rows):
+def add_stocks_to_portifolio(n1, n2, page_current, page_size, sort_by, filter_query, stocks_to_portifolio, number_of_stocks, price_at_buy, date, selected_row_ids):
     stocks = Stocks(DB(DATABASE_PATH))
-    if dash.callback_context.triggered[0]['prop_id'] == "delete-from-portifolio-button.n_clicks":
-        if n2 is not None or selected_rows is not None:
-            df = stocks.get_portifolio().reset_index(drop=True)
-            ticker = df.loc[selected_rows[0], "Ticker"]
-            stocks.delete_stock_from_portifolio(ticker)
+    triggered = dash.callback_context.triggered_id
+    if triggered == "delete-from-portifolio-button":
+        # the rows are paged on the server, so the selection is resolved by the portifolio id of the row
+        if n2 is not None and selected_row_ids:
+            df = stocks.get_portifolio().filter(pl.col("id") == selected_row_ids[0])
+            if not df.is_empty():
+                stocks.delete_stock_from_portifolio(df["Ticker"].item())
+                warm_up_async(DATABASE_PATH)
 
-    if dash.callback_context.triggered[0]['prop_id'] == "add-to-portifolio-button.n_clicks":
-        if  n1 is not None and stocks_to_portifolio != "" and number_of_stocks  != "" and price_at_buy  != "" and date is not None:
+    if triggered == "add-to-portifolio-button":
+        if  n1 is not None and stocks_to_portifolio and number_of_stocks and price_at_buy and date is not None:
             stocks_to_portifolio = f"{stocks_to_portifolio}.SA" if not stocks_to_portifolio.endswith(".SA") else stocks_to_portifolio
             date = f"{date} 00:00:00" # keep all dates in the same format
             stocks.insert_portifolio(stocks_to_portifolio, number_of_stocks, price_at_buy, date)
+            warm_up_async(DATABASE_PATH)
 
-    df = stocks.get_portifolio()
+    if triggered in ("add-to-portifolio-button", "delete-from-portifolio-button"):
+        set_props("stocks-to-portifolio", {"value": ""})
+        set_props("number-of-stocks", {"value": ""})
+        set_props("price-at-buy", {"value": ""})
 
-    set_props("stocks-to-portifolio", {"value": ""})
-    set_props("number-of-stocks", {"value": ""})
-    set_props("price-at-buy", {"value": ""})
-    return df.to_dicts() ,[{'id': c, 'name': c} for c in df.columns]
+    data, page_count = table_page(stocks.get_portifolio(), page_current, page_size, sort_by, filter_query)
+    return data, page_count, []
 
 # @app.long_callback(
 #     inputs=Input("update-button", "n_clicks"),
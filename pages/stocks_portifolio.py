@@ -4,16 +4,33 @@ import dash_bootstrap_components as dbc
 from libs.db import DB
 from libs.stocks import Stocks
 from libs.config import DATABASE_PATH
+from libs.precompute import portifolio_statistics
 
 register_page(__name__, title='Stocks Portifolio')
 
 def layout(**kwargs):
+    # only the page shell is rendered here, the cards are filled by a background callback
+    return html.Div([
+        dcc.Store(id='portifolio-load', data=0),
+        dbc.Progress(id='portifolio-progress', value=0, max=1, style={"margin": "0px 20px 0px 20px"}),
+        html.Div(id='portifolio-content'),
+    ])
+
+@callback(
+    Output('portifolio-content', 'children'),
+    Input('portifolio-load', 'data'),
+    background=True,
+    progress=[Output('portifolio-progress', 'value'), Output('portifolio-progress', 'max')],
+    running=[(Output('portifolio-progress', 'style'), {"margin": "0px 20px 0px 20px"}, {"display": "none"})],
+)
+def update_portifolio_cards(set_progress, _):
     stocks = Stocks(DB(DATABASE_PATH))
-    df = stocks.get_portifolio()
+    statistics = portifolio_statistics(stocks, progress=lambda i, n: set_progress((i, n)))
 
     cards = []
-    for stock in df.iter_rows(named=True):
-        stats = stocks.get_statistics_by_buy_date(stock['Ticker'], stock['Date'], return_dict=True)
+    for stats in statistics:
+        stock = {k: stats[k] for k in ("Ticker", "Number of Stocks", "Price at Buy")}
+        stock["Date"] = stats["Buy Date"]
         num_stocks = stock['Number of Stocks']
         quote_variation = stats['Close'] / stock['Price at Buy'] * 100 - 100
         gain = (stats['Close'] - stock['Price at Buy']) * num_stocks
@@ -52,4 +69,4 @@ def layout(**kwargs):
         else:
             cards.insert(i + 2, html.Br())
 
-    return html.Div(id='portifolio-content', children=cards)
\ No newline at end of file
+    return cards
\ No newline at end of file
@@ -0,0 +1,108 @@
+from dash import register_page, html, dcc, callback, Input, Output
+from dash.dash_table import DataTable, FormatTemplate
+import dash_bootstrap_components as dbc
+
+import numpy as np
+import plotly.graph_objects as go
+
+from libs.db import DB
+from libs.stocks import Stocks
+from libs.config import DATABASE_PATH
+from libs.precompute import portifolio_risk
+from libs.figures import compact_figure
+
+register_page(__name__, title='Portifolio Risk')
+
+columns = [
+    {"name": "Ticker", "id": "Ticker"},
+    dict(name="Weight", id="Weight", type="numeric", format=FormatTemplate.percentage(2)),
+    dict(name="Volatility", id="Volatility", type="numeric", format=FormatTemplate.percentage(2)),
+    dict(name="Beta", id="Beta", type="numeric", format={"specifier": ".2f"}),
+]
+
+def layout(**kwargs):
+    # only the page shell is rendered here, the risk metrics are filled by a background callback
+    return html.Div([
+        dcc.Store(id='risk-load', data=0),
+        dbc.Row([
+            dbc.Col([
+                html.Label("Confidence"),
+                dcc.Dropdown(id='risk-confidence', options=[{"label": "95%", "value": 0.95}, {"label": "99%", "value": 0.99}], value=0.95, clearable=False),
+            ], width=2),
+            dbc.Col([
+                html.Label("Horizon (days)"),
+                dcc.Dropdown(id='risk-horizon', options=[1, 5, 10, 21], value=1, clearable=False),
+            ], width=2),
+            dbc.Col([
+                html.Label("Scenarios"),
+                dcc.Dropdown(id='risk-scenarios', options=[10000, 100000, 1000000], value=100000, clearable=False),
+            ], width=2),
+        ], style={"margin": "0px 20px 20px 20px"}),
+        dbc.Progress(id='risk-progress', value=0, max=1, style={"margin": "0px 20px 0px 20px"}),
+        html.Div(id='risk-summary', style={"margin": "0px 20px 20px 20px"}),
+        dbc.Row([
+            dbc.Col([
+                DataTable(
+                    id='risk-table',
+                    data=[],
+                    columns=columns,
+                    page_size=20,
+                    page_action='native',
+                    sort_action='native',
+                    style_cell={'textAlign': 'center', 'fontSize': 14},
+                )
+            ], width=4),
+            dbc.Col([
+                dcc.Graph(id='risk-correlation', style={'height': '600px'})
+            ], width=8)
+        ], style={"margin": "20px 20px 20px 20px"})
+    ])
+
+def _money(value):
+    return "-" if np.isnan(value) else f"R$ {value:,.2f}"
+
+def _card(title, value):
+    return dbc.Col(dbc.Card(dbc.CardBody([
+        html.Span(title),
+        html.H4(value, style={"font-weight": "bold"}),
+    ])), width=2)
+
+@callback(
+    Output('risk-summary', 'children'),
+    Output('risk-table', 'data'),
+    Output('risk-correlation', 'figure'),
+    Input('risk-load', 'data'),
+    Input('risk-confidence', 'value'),
+    Input('risk-horizon', 'value'),
+    Input('risk-scenarios', 'value'),
+    background=True,
+    progress=[Output('risk-progress', 'value'), Output('risk-progress', 'max')],
+    running=[(Output('risk-progress', 'style'), {"margin": "0px 20px 0px 20px"}, {"display": "none"})],
+)
+def update_risk(set_progress, _, confidence, horizon, scenarios):
+    stocks = Stocks(DB(DATABASE_PATH))
+    risk = portifolio_risk(stocks, confidence, horizon, scenarios, progress=lambda i, n: set_progress((i, n)))
+    if not risk:
+        return html.Span("No portifolio history to compute the risk"), [], go.Figure()
+
+    value = risk["Value"]
+    summary = dbc.Row([
+        _card("Portifolio Value", f"R$ {value:,.2f}"),
+        _card("Volatility (year)", f"{risk['Portifolio Volatility']*100:.2f}%"),
+        _card(f"VaR Historical {horizon}d", _money(risk['VaR Historical']*value)),
+        _card(f"CVaR Historical {horizon}d", _money(risk['CVaR Historical']*value)),
+        _card(f"VaR Monte Carlo {horizon}d", _money(risk['VaR Monte Carlo']*value)),
+        _card(f"CVaR Monte Carlo {horizon}d", _money(risk['CVaR Monte Carlo']*value)),
+    ])
+
+    data = [
+        {"Ticker": ticker, "Weight": weight, "Volatility": volatility, "Beta": beta}
+        for ticker, weight, volatility, beta in zip(risk["Tickers"], risk["Weights"], risk["Volatility"], risk["Beta"])
+    ]
+
+    fig = go.Figure(data=go.Heatmap(
+        z=risk["Correlation"], x=risk["Tickers"], y=risk["Tickers"],
+        zmin=-1, zmax=1, colorscale="RdBu"
+    ))
+    fig.update_layout(margin=dict(l=40, r=40, t=10, b=10))
+    return summary, data, compact_figure(fig)